@@ -0,0 +1,54 @@
+"""
+Per-line cost of Interpreter.send with and without the fast path
+bypassing argparse for plain signatures.
+
+$ python bench/fastpath.py -n 20000
+"""
+from __future__ import print_function
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import plac
+import plac_core
+
+
+class Tool(object):
+    "A command container with a few typical commands"
+    commands = ['add', 'show', 'setkw']
+
+    @plac.annotations(
+        count=('how many times', 'option', 'c', int),
+        verbose=('verbose mode', 'flag', 'v'))
+    def add(self, name, value, count=1, verbose=False):
+        return name
+
+    def show(self, *names):
+        return names
+
+    def setkw(self, key, **kw):
+        return kw
+
+
+LINES = ['add a 1 -c 3 -v', 'show x y z', 'setkw k a=1 b=2']
+
+
+@plac.annotations(number=('number of lines per measure', 'option', 'n', int))
+def main(number=10000):
+    "Compare the per-line dispatch time with and without the fast path"
+    print('%-18s %14s %14s %8s' % ('line', 'argparse (us)', 'fast (us)',
+                                   'speedup'))
+    with plac.Interpreter(Tool()) as i:
+        for line in LINES:
+            times = []
+            for fastpath in (False, True):
+                plac_core.ArgumentParser.fastpath = fastpath
+                times.append(min(timeit.repeat(
+                    lambda: i.send(line), number=number, repeat=3)) /
+                    number * 1E6)
+            print('%-18s %14.1f %14.1f %7.1fx' % (
+                line, times[0], times[1], times[0] / times[1]))
+
+
+if __name__ == '__main__':
+    plac.call(main)
@@ -0,0 +1,57 @@
+"""
+Startup time of a command container as a function of the number of
+commands, with eager and lazy subparser construction. The measured time
+is the time needed to build the parser and dispatch a single command,
+i.e. what a command-line tool pays at each invocation.
+
+$ python bench/lazy_startup.py -n 5 10 100 400 1000
+"""
+from __future__ import print_function
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import plac
+import plac_core
+
+
+def make_container(ncommands, lazy):
+    "Build a command container class with ncommands commands"
+    def cmd(self, name, count=1, verbose=False, *args):
+        "A synthetic command"
+        return name
+    cmd.__annotations__ = dict(
+        count=('how many times', 'option', 'c', int),
+        verbose=('verbose mode', 'flag', 'v'))
+    dic = dict(commands=['cmd%d' % i for i in range(ncommands)], lazy=lazy)
+    for name in dic['commands']:
+        dic[name] = cmd
+    return type('Container%d' % ncommands, (object,), dic)
+
+
+def startup(cls):
+    "Build the parser from scratch and dispatch the last command"
+    plac_core._parser_registry.clear()
+    return plac.call(cls(), ['cmd%d' % (len(cls.commands) - 1), 'x'])
+
+
+@plac.annotations(
+    number=('number of runs per measure', 'option', 'n', int),
+    sizes=('numbers of commands', 'positional', None, int))
+def main(number=5, *sizes):
+    "Compare eager and lazy parser construction"
+    print('%8s %12s %12s %8s' % ('commands', 'eager (ms)', 'lazy (ms)',
+                                  'speedup'))
+    for size in sizes or (1, 10, 100, 400, 1000):
+        eager = make_container(size, lazy=False)
+        lazy = make_container(size, lazy=True)
+        t_eager = min(timeit.repeat(
+            lambda: startup(eager), number=1, repeat=number)) * 1000
+        t_lazy = min(timeit.repeat(
+            lambda: startup(lazy), number=1, repeat=number)) * 1000
+        print('%8d %12.2f %12.2f %7.1fx' % (
+            size, t_eager, t_lazy, t_eager / t_lazy))
+
+
+if __name__ == '__main__':
+    plac.call(main)
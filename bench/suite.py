@@ -0,0 +1,251 @@
+"""
+Benchmark suite for plac: parser construction, dispatch, interpreter
+tasks, runp and import time, on synthetic tools of different sizes.
+For each benchmark it prints the latency percentiles and the throughput;
+the results can be saved in JSON format and compared with a baseline:
+
+$ python bench/suite.py -o baseline.json  # before the change
+$ python bench/suite.py -c baseline.json  # after the change
+
+The comparison exits with status 1 if a benchmark is slower (on the
+median) than the baseline by more than the given tolerance.
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import plac
+import plac_core
+
+
+# ########################### synthetic tools ############################ #
+
+def make_func(noptions, kind='plain'):
+    """
+    Build a command with a positional argument, noptions options (half of
+    them flags) and, depending on the kind, *args or **kw
+    """
+    names = ['opt%d' % i for i in range(noptions)]
+    params = ['name'] + ['%s=%s' % (n, 'False' if i % 2 else '1')
+                         for i, n in enumerate(names)]
+    if kind == 'varargs':
+        params.append('*args')
+    elif kind == 'kwargs':
+        params.append('**kw')
+    dic = {}
+    exec('def cmd(self, %s):\n    return name\n' % ', '.join(params), dic)
+    cmd = dic['cmd']
+    cmd.__annotations__ = dict(
+        (n, ('option %d' % i, 'flag', None) if i % 2 else
+         ('option %d' % i, 'option', None, int))
+        for i, n in enumerate(names))
+    return cmd
+
+
+def make_tool(ncommands, noptions=2, kind='plain'):
+    "Build an instance of a command container with ncommands commands"
+    cmd = make_func(noptions, kind)
+    dic = dict(commands=['cmd%d' % i for i in range(ncommands)])
+    for name in dic['commands']:
+        dic[name] = cmd
+    return type('Tool%d' % ncommands, (object,), dic)()
+
+
+def make_arglist(noptions, kind='plain'):
+    "An arglist for the commands built by make_func"
+    arglist = []
+    for i in range(noptions):
+        arglist.extend(['-opt%d' % i] if i % 2 else ['-opt%d' % i, '2'])
+    arglist.append('x')
+    if kind == 'varargs':
+        arglist.extend('a%d' % i for i in range(20))
+    elif kind == 'kwargs':
+        arglist.extend('k%d=%d' % (i, i) for i in range(20))
+    return arglist
+
+
+class Tasks(object):
+    "A container with a threaded and a multiprocessing command"
+    thcommands = ['th']
+    mpcommands = ['mp']
+
+    def th(self):
+        yield 'ok'
+
+    def mp(self):
+        yield 'ok'
+
+
+def gen():
+    yield 1
+
+# ############################## measures ################################ #
+
+
+def percentile(sorted_values, p):
+    "The p-th percentile of a sorted list, with linear interpolation"
+    k = (len(sorted_values) - 1) * p / 100.
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (
+        k - lo)
+
+
+def measure(func, repeat, setup=None):
+    "Call func repeat times and return the statistics in microseconds"
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - t0) * 1E6)
+    samples.sort()
+    total = sum(samples)
+    return dict(n=repeat, mean=total / repeat,
+                p50=percentile(samples, 50), p90=percentile(samples, 90),
+                p99=percentile(samples, 99), max=samples[-1],
+                ops=repeat / total * 1E6)
+
+
+def clear_registry():
+    plac_core.parser_registry.clear()
+
+
+def import_plac():
+    "The time needed to import plac in a fresh interpreter"
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.check_call([sys.executable, '-c', 'import plac'], env=env)
+
+
+def run_task(interpreter, line):
+    "Submit a task to the interpreter and start it"
+    task = interpreter.submit(line)
+    task.run()
+    return task
+
+
+def python_startup():
+    subprocess.check_call([sys.executable, '-c', 'pass'])
+
+
+def benchmarks(quick):
+    "Yield tuples (name, func, setup, number of repetitions)"
+    scale = 0.1 if quick else 1
+    sizes = (1, 10, 100) if quick else (1, 10, 100, 1000)
+    for ncommands in sizes:
+        for lazy in (False, True):
+            tool = make_tool(ncommands)
+            tool.lazy = lazy
+            name = 'parser_from/%s/%d' % ('lazy' if lazy else 'eager',
+                                          ncommands)
+            yield (name, lambda tool=tool: plac.parser_from(tool),
+                   clear_registry, max(int(1000 * scale / ncommands), 5))
+        tool = make_tool(ncommands)
+        arglist = ['cmd%d' % (ncommands - 1), 'x']
+        yield ('dispatch/%d' % ncommands,
+               lambda tool=tool, arglist=arglist: plac.call(tool, arglist),
+               None, int(2000 * scale))
+    for noptions in (0, 10, 50):
+        for kind in ('plain', 'varargs', 'kwargs'):
+            func = make_func(noptions, kind).__get__(object())
+            arglist = make_arglist(noptions, kind)
+            yield ('consume/%s/%d' % (kind, noptions),
+                   lambda func=func, arglist=arglist: plac.call(
+                       func, arglist),
+                   None, int(2000 * scale))
+    tool = make_tool(10)
+    inter = plac.Interpreter(tool).__enter__()
+    yield ('interpreter/send', lambda: inter.send('cmd9 x -opt0 3'),
+           None, int(5000 * scale))
+    tasks = plac.Interpreter(Tasks()).__enter__()
+    started = []
+    yield ('task/threaded', lambda: started.append(run_task(tasks, 'th')),
+           None, int(500 * scale))
+    for task in started:  # the benchmarks are run lazily, one at the time
+        task.wait()
+    yield ('task/threaded+wait', lambda: run_task(tasks, 'th').wait(),
+           None, int(500 * scale))
+    if sys.platform != 'win32':
+        yield ('task/mp+wait', lambda: run_task(tasks, 'mp').wait(),
+               None, max(int(50 * scale), 5))
+    yield ('runp/threads/10', lambda: plac.runp(
+        [gen() for _ in range(10)], mode='t'), None, int(100 * scale))
+    if sys.platform != 'win32':
+        yield ('runp/processes/4', lambda: plac.runp(
+            [gen() for _ in range(4)], mode='p'), None,
+            max(int(20 * scale), 5))
+    yield 'python -c pass', python_startup, None, max(int(30 * scale), 5)
+    yield 'import plac', import_plac, None, max(int(30 * scale), 5)
+    inter.close()
+    tasks.close()
+
+
+# ############################## reports ################################# #
+
+def print_results(results, baseline=None):
+    header = '%-24s %10s %10s %10s %12s' % (
+        'benchmark', 'p50 (us)', 'p90 (us)', 'p99 (us)', 'ops/s')
+    if baseline:
+        header += ' %10s' % 'vs base'
+    print(header)
+    print('-' * len(header))
+    for name, res in results.items():
+        line = '%-24s %10.1f %10.1f %10.1f %12.1f' % (
+            name, res['p50'], res['p90'], res['p99'], res['ops'])
+        if baseline and name in baseline:
+            line += ' %9.2fx' % (res['p50'] / baseline[name]['p50'])
+        print(line)
+
+
+def compare(results, baseline, tolerance):
+    "Return the names of the benchmarks slower than the baseline"
+    return [name for name, res in results.items()
+            if name in baseline and
+            res['p50'] > baseline[name]['p50'] * tolerance]
+
+
+@plac.annotations(
+    output=('save the results in JSON format', 'option', 'o'),
+    compare_with=('compare with a baseline saved with -o', 'option', 'c'),
+    tolerance=('tolerated slowdown of the median', 'option', 't', float),
+    quick=('run fewer and smaller benchmarks', 'flag', 'q'),
+    select=('run only the benchmarks containing these strings',
+            'positional'))
+def main(output=None, compare_with=None, tolerance=1.2, quick=False,
+         *select):
+    "Run the plac benchmark suite"
+    baseline = None
+    if compare_with:
+        with open(compare_with) as f:
+            baseline = json.load(f)['results']
+    results = {}
+    for name, func, setup, repeat in benchmarks(quick):
+        if select and not any(s in name for s in select):
+            continue
+        func()  # warm up
+        results[name] = measure(func, repeat, setup)
+    print_results(results, baseline)
+    if output:
+        data = dict(python=platform.python_version(),
+                    platform=platform.platform(),
+                    plac=plac.__version__, time=time.time(),
+                    results=results)
+        with open(output, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+    if baseline:
+        slower = compare(results, baseline, tolerance)
+        for name in slower:
+            print('REGRESSION %s: %.2fx slower than the baseline' % (
+                name, results[name]['p50'] / baseline[name]['p50']))
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    plac.call(main)
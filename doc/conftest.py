@@ -0,0 +1,12 @@
+import sys
+import pytest
+
+# the asynchronous generators are a syntax error before Python 3.6
+collect_ignore = ['test_plac_async.py'] if sys.version_info < (3, 6) else []
+
+
+@pytest.fixture(autouse=True)
+def shelve_in_tmpdir(request, tmp_path, monkeypatch):
+    "The ishelve examples write conf.shelve in the current directory"
+    if request.module.__name__.startswith('test_ishelve'):
+        monkeypatch.chdir(str(tmp_path))
@@ -2,15 +2,23 @@
 The tests should be run as standalone script
 """
 
+import gc
 import os
 import sys
+import shutil
+import tempfile
 import argparse
 import datetime
+import time
+import threading
 import doctest
+import pickle
 import subprocess
 import plac
 import plac_core
+import plac_ext
 import difflib
+import weakref
 
 version = sys.version_info[:2]
 
@@ -277,12 +285,100 @@ def test_kwargs3():
     assert plac.call(main, ['z=1']) == ['foo', {'z': '1'}]
 
 
+def check_fastpath(parser, arglists):
+    "The fast path must give the same namespace as argparse, or nothing"
+    used = 0
+    for arglist in arglists:
+        ns = parser._fast_parse(list(arglist))
+        if ns is None:  # fallback to argparse
+            continue
+        used += 1
+        if parser.argspec.varargs:
+            expected, extra = parser.parse_known_args(list(arglist))
+            assert not extra, extra
+        else:
+            expected = parser.parse_args(list(arglist))
+        assert vars(ns) == vars(expected), (arglist, ns, expected)
+    return used
+
+
+def test_fastpath():
+    p = parser_from(lambda name, count=1, verbose=False, color='red',
+                    *args, **kw: None,
+                    count=('count', 'option', 'c', int),
+                    verbose=('verbose', 'flag', 'v'),
+                    color=('color', 'option', None, str, ['red', 'blue']))
+    arglists = [
+        [], ['x'], ['x', 'y', 'z'], ['-c', '2', 'x'], ['x', '-c', '2'],
+        ['x', '--count', '3', '-v'], ['x', '--count=3'], ['--count=3', 'x'],
+        ['x', '-v', 'y'], ['x', 'a=1', 'b=2'], ['-color', 'blue', 'x'],
+        ['-color', 'green', 'x'], ['-c', 'x', 'y'], ['-c'], ['-h'],
+        ['x', '--', '-c'], ['-cv', '2', 'x'], ['x', '--cou', '2'],
+        ['x', '--verbose=1'], ['-c', '-1', 'x'], ['', 'x']]
+    used = check_fastpath(p, arglists)
+    assert used >= 10, used
+
+    p = parser_from(lambda day=datetime.date(2020, 1, 1), n='3',
+                    *words: None,
+                    n=('n', 'option', 'n', int))
+    arglists = [[], ['2021-01-01'], ['2021-01-01', 'a', 'b'], ['-n', '5'],
+                ['not-a-date'], ['-n', 'x']]
+    used = check_fastpath(p, arglists)
+    assert used == 4, used
+
+
+def test_fastpath_call():
+    def main(name, count=1, verbose=False, *args, **kw):
+        return name, count, verbose, args, kw
+    main.__annotations__ = dict(count=('count', 'option', 'c', int),
+                                verbose=('verbose', 'flag', 'v'))
+    parser = plac.parser_from(main)
+    for arglist in (['x', '-c', '2', 'y', 'k=v'], ['-c', '2', 'x', 'k=v'],
+                    ['-v', 'x', 'y', 'z']):
+        fast = plac.call(main, arglist)
+        parser.fastpath = False
+        try:
+            slow = plac.call(main, arglist)
+        finally:
+            parser.fastpath = True
+        assert fast == slow, (fast, slow)
+
+
 def test_date_default():
     p = parser_from(lambda day=datetime.date.today(): day)
     arg = p.parse_args(['2019-11-19'])
     assert arg.day == datetime.date(2019, 11, 19)
 
 
+def strptime_date(s):
+    return datetime.date(*time.strptime(s, "%Y-%m-%d")[0:3])
+
+
+def strptime_datetime(s):
+    return datetime.datetime(*time.strptime(s, "%Y-%m-%d %H-%M-%S")[0:6])
+
+
+def test_date_converters():
+    # the fast paths must be equivalent to strptime, errors included
+    for conv, ref, values in [
+            (plac.to_date, strptime_date,
+             ['2019-11-19', '2019-1-9', '2019-02-30', '0000-01-01',
+              '20191119', '2019-11-19 ', 'x']),
+            (plac.to_datetime, strptime_datetime,
+             ['2019-11-19 10-20-30', '2019-11-19 1-2-3', '2019-11-19',
+              '2019-11-19 25-00-00', '2019-11-19  10-20-30', 'x'])]:
+        for value in values:
+            try:
+                expected = ref(value)
+            except ValueError as exc:
+                expected = str(exc)
+            try:
+                got = conv(value)
+            except ValueError as exc:
+                got = str(exc)
+            assert got == expected, (value, got, expected)
+
+
 def test_int_default():
     p = parser_from(lambda number=42: number)
     arg = p.parse_args([])
@@ -299,6 +395,44 @@ def test_none_default():
     assert arg.nonable == 'somestring'
 
 
+def spec_main(name, count=1, verbose=False, *args):
+    "A main function with a cached parser"
+    return name, count, verbose, args
+
+
+spec_main.__annotations__ = dict(count=('count', 'option', 'c', int),
+                                 verbose=('verbose', 'flag', 'v'))
+
+
+def test_spec_cache():
+    tmp = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        p1 = plac.parser_from(spec_main, spec_cache=tmp)
+        assert plac_core.load_spec(spec_main, tmp) is not None
+        del plac_core._parser_registry[spec_main]
+        os.chdir(tmp)  # the source file is found from any directory
+        p2 = plac.parser_from(spec_main, spec_cache=tmp)
+        assert isinstance(p2.argspec, plac_core._CachedArgSpec)
+        assert p2.format_help() == p1.format_help()
+        res = plac.call(spec_main, ['a', '-c', '2', '-v', 'x'])
+        assert res == ['a', 2, True, ('x',)], res
+    finally:
+        os.chdir(cwd)
+        del plac_core._parser_registry[spec_main]
+        shutil.rmtree(tmp)
+
+
+def test_spec_cache_lambda():
+    # lambdas cannot be identified, so they are not cached
+    tmp = tempfile.mkdtemp()
+    try:
+        plac.parser_from(lambda x: x, spec_cache=tmp)
+        assert os.listdir(tmp) == []
+    finally:
+        shutil.rmtree(tmp)
+
+
 class Cmds(object):
     add_help = False
     commands = 'help', 'commit'
@@ -325,12 +459,216 @@ def test_cmd_abbrevs():
     expect(SystemExit, plac.call, cmds, ['foo'])
 
 
+def test_command_index():
+    index = plac_core.CommandIndex(['show', 'showall', 'set', 'delete'])
+    assert index.match('show') == 'show'  # exact match
+    assert index.match('showa') == 'showall'  # unique prefix
+    assert index.match('d') == 'delete'
+    assert index.match('x') is None
+    expect(NameError, index.match, 's')  # ambiguous
+    assert index.completions('sh') == ['show', 'showall']
+    assert index.completions('') == ['delete', 'set', 'show', 'showall']
+    index = plac_core.CommandIndex(['Show', 'Set'], case_sensitive=False)
+    assert index.match('sh') == 'Show'
+    assert index.completions('s') == ['Set', 'Show']
+
+
+def test_case_insensitive_cmds():
+    c = Cmds()
+    c.case_sensitive = False
+    assert 'commit' == plac.call(c, ['COMM'])
+
+
+class LazyCmds(Cmds):
+    lazy = True
+
+
+def test_lazy_cmds():
+    c = LazyCmds()
+    p = plac.parser_from(c)
+    name_parser_map = p.subparsers._name_parser_map
+    assert dict.get(name_parser_map, 'commit') is None  # not built yet
+    assert 'commit' == plac.call(c, ['comm'])
+    assert dict.get(name_parser_map, 'commit') is not None  # built
+    assert dict.get(name_parser_map, 'help') is None  # still not built
+    assert ['help', 'foo'] == plac.call(c, ['h', 'foo'])
+    assert p.format_help() == plac.parser_from(Cmds()).format_help()
+    expect(SystemExit, plac.call, c, ['foo'])
+
+
+def test_registry_weakrefs():
+    registry = plac_core.parser_registry
+    c = Cmds()
+    plac.call(c, ['commit'])
+    hits = registry.hits
+    plac.call(c, ['commit'])
+    assert registry.hits == hits + 1
+    assert c in registry and c.commit in registry
+    size = len(registry)
+    ref = weakref.ref(c)
+    del c
+    gc.collect()
+    assert ref() is not None  # kept alive by the most recent parsers
+    maxsize, registry.maxsize = registry.maxsize, 0  # evict everything
+    try:
+        gc.collect()
+        assert ref() is None  # the evicted parsers do not keep it alive
+        assert len(registry) < size
+    finally:
+        registry.maxsize = maxsize
+    # a parser keeps its callable alive
+    p = plac.parser_from(lambda a: a)
+    m = plac.parser_from(Cmds().commit)
+    gc.collect()
+    assert p.consume(['1'])[1] == '1' and m.consume([])[1] == 'commit'
+
+
+def test_registry_lru():
+    registry = plac_core.ParserRegistry(maxsize=2)
+    funcs = [lambda: None for i in range(3)]
+    for f in funcs:
+        registry[f] = plac_core.ArgumentParser()
+    assert funcs[0] not in registry and funcs[2] in registry
+    stats = registry.stats()
+    assert stats['evictions'] == 1 and stats['size'] == 2, stats
+    assert not vars(funcs[2])  # nothing is stored inside the objects
+
+
+def test_registry_pickle():
+    c = Cmds()
+    plac.parser_from(c)
+    c2 = pickle.loads(pickle.dumps(c))
+    assert vars(c2) == vars(c) == {}
+    assert plac.call(c2, ['commit']) == 'commit'
+    with plac.Interpreter(Cmds()) as i:
+        ref = weakref.ref(i.obj)
+        assert i.send('commit').str == 'commit'
+    del i
+    gc.collect()
+    assert ref() is None  # the closed interpreter left no parsers behind
+
+
 def test_sub_help():
     c = Cmds()
     c.add_help = True
     expect(SystemExit, plac.call, c, ['commit', '-h'])
 
 
+class HelpCmds(object):
+    "Used in test_help_cache"
+    commands = ['commit', 'push']
+
+    def commit(self, message):
+        "commit the changes"
+
+    def push(self):
+        "push the changes"
+
+    def pull(self):
+        "pull the changes"
+
+
+def test_help_cache():
+    with plac.Interpreter(HelpCmds()) as i:
+        parser = i.parser
+        assert not parser.__dict__.get('_helpcache')  # nothing built yet
+        summary = i.send('help').str
+        assert 'commit  help  push' in summary, summary
+        assert parser._helpcache[None] == summary
+        assert parser.format_help() is parser._helpcache[None]
+        assert 'commit the changes' not in summary
+        usage = i.send('help commit').str
+        assert 'message' in usage, usage
+        assert i.send('help commit').str == usage
+        i.obj.commands.add('pull')
+        parser.addsubcommands(['pull'], i.obj)  # invalidate the cache
+        assert not parser._helpcache
+        assert 'pull' in i.send('help').str
+
+
+class CompletionCmds(object):
+    "Used in test_completion"
+    commands = ['commit', 'checkout', 'push']
+
+    @plac.annotations(
+        message=('commit message', 'option', 'm'),
+        amend=('amend the last commit', 'flag', 'a'),
+        color=('color', 'option', 'c', str, ['red', 'green']))
+    def commit(self, message='', amend=False, color='red', *files):
+        pass
+
+    @plac.annotations(mode=('mode', 'positional', None, str, ['hard', 'soft']))
+    def checkout(self, mode):
+        pass
+
+    def push(self, remote):
+        pass
+
+
+def complete(script, *words):
+    "Run the bash completion function on the given words"
+    code = '%s\nCOMP_WORDS=(%s); COMP_CWORD=%d; _plac_tool\n' \
+        'echo "${COMPREPLY[*]}"' % (script, ' '.join(
+            "'%s'" % w for w in words), len(words) - 1)
+    return subprocess.check_output(['bash', '-c', code]).decode().split()
+
+
+def test_completion():
+    script = plac.completion(CompletionCmds(), prog='tool',
+                             hooks={'push.remote': 'echo origin upstream'})
+    assert script.startswith('# bash completion for tool')
+    zsh = plac.completion(CompletionCmds(), 'zsh', prog='tool')
+    assert zsh.startswith('#compdef tool')
+    expect(ValueError, plac.completion, CompletionCmds(), 'csh')
+    try:
+        subprocess.check_call(['bash', '-c', 'true'])
+    except OSError:  # no bash
+        return
+    assert complete(script, 'tool', 'c') == ['commit', 'checkout']
+    assert complete(script, 'tool', 'commit', '--c') == ['--color']
+    assert complete(script, 'tool', 'commit', '-c', '') == ['red', 'green']
+    assert complete(script, 'tool', 'checkout', '') == ['hard', 'soft']
+    assert complete(script, 'tool', 'push', 'o') == ['origin']
+
+
+def batch_main(n, times=1):
+    "Used in test_call_many"
+    for i in range(int(times)):
+        yield int(n) * 2
+
+
+class BatchCmds(object):
+    "Used in test_call_many"
+    commands = 'double',
+
+    def double(self, n):
+        # the misses of the registry do not grow if the parser is reused
+        return os.getpid(), plac_core.parser_registry.misses, int(n) * 2
+
+
+def test_call_many():
+    lines = ['%d %d' % (i, i % 3) for i in range(20)]
+    expected = [[i * 2] * (i % 3) for i in range(20)]
+    assert list(plac.call_many(batch_main, lines)) == expected
+    if version < (3, 2):  # there is no concurrent.futures
+        return
+    arglists = [line.split() for line in lines]
+    assert list(plac.call_many(batch_main, arglists, mode='t')) == expected
+    res = list(plac.call_many(batch_main, lines, mode='t', ordered=False))
+    assert sorted(res) == sorted(expected)
+    res = list(plac.call_many(batch_main, lines, mode='p', workers=2))
+    assert res == expected
+    res = list(plac.call_many(BatchCmds(), ['double %d' % i for i in
+                                           range(20)], mode='p', workers=2))
+    assert [r[2] for r in res] == [i * 2 for i in range(20)], res
+    if version < (3, 7):  # the parsers are not built by an initializer
+        return
+    misses = dict((pid, set()) for pid, _, _ in res)
+    for pid, nmisses, _ in res:
+        misses[pid].add(nmisses)
+    assert all(len(m) == 1 for m in misses.values()), misses
+
+
 def test_yield():
     def main():
         for i in (1, 2, 3):
@@ -338,6 +676,453 @@ def test_yield():
     assert plac.call(main, []) == [1, 2, 3]
 
 
+class StatsCmds(object):
+    "Used in test_stats"
+    commands = ['sleep', 'fail', 'many']
+    thcommands = ['bg']
+
+    def many(self, n):
+        for i in range(int(n)):
+            yield i
+
+    def sleep(self, t):
+        time.sleep(float(t))
+        yield 'slept'
+
+    def fail(self):
+        1 / 0
+
+    def bg(self):
+        yield 'bg'
+
+
+def test_stats():
+    hist = plac_ext.Histogram()
+    for value in (.001, .002, .003, .004, 0):
+        hist.add(value)
+    assert hist.count == 5 and hist.max == .004 and hist.min == 0
+    assert .002 <= hist.percentile(50) <= .002 * 1.1, hist.percentile(50)
+    assert hist.percentile(100) == .004
+    with plac.Interpreter(StatsCmds()) as i:
+        for t in ('0', '0.01', '0.02'):
+            i.send('sleep %s' % t)
+        i.send('fail')
+        i.send('bg')
+        i.send('.list')  # special commands are not recorded
+        stats = i.stats()
+        assert sorted(stats) == ['bg', 'fail', 'sleep'], sorted(stats)
+        assert stats['sleep'].count == 3
+        assert stats['sleep'].wall.max >= .02
+        assert stats['sleep'].items.mean == 1
+        assert stats['fail'].outcomes['ABORTED'] == 1
+        lines = i.send('.stats').str.splitlines()
+        assert lines[0].split()[:2] == ['command', 'tasks'], lines
+        assert [line.split()[:3] for line in lines[1:]] == [
+            ['bg', '1', '0'], ['fail', '1', '1'], ['sleep', '3', '0']]
+        out = i.send('.stats sleep').str
+        assert out.startswith('sleep: 3 tasks, 3 FINISHED'), out
+        i.tm.out_maxlen, i.tm.out_overflow = 1, 'discard'
+        i.send('many 3')
+        assert i.stats()['many'].items.max == 3  # discarded values included
+
+
+class MPCmds(object):
+    "Used in test_mptask"
+    mpcommands = ['many', 'slow', 'crash', 'fail']
+
+    def many(self, n):
+        for i in range(int(n)):
+            yield 'line %d' % i
+
+    def slow(self):
+        for i in range(1000):
+            yield i
+            time.sleep(.01)
+
+    def crash(self):
+        yield 'before'
+        os._exit(1)
+
+    def fail(self):
+        yield 'before'
+        1 / 0
+
+
+def test_mptask():
+    with plac.Interpreter(MPCmds()) as i:
+        task = i.submit('many 5000')
+        task.run()
+        task.wait()
+        assert task.status == 'FINISHED', task
+        assert task.outlist == ['line %d' % n for n in range(5000)]
+        assert task.str.endswith('line 4999')
+        task = i.submit('slow')
+        task.run()
+        time.sleep(.2)
+        i.send('.kill')
+        task.wait()
+        assert task.status == 'KILLED', task
+        assert 0 < len(task.outlist) < 1000
+        task = i.submit('crash')
+        task.run()
+        task.wait()
+        assert task.status == 'ABORTED', task
+        task = i.submit('fail')
+        task.run()
+        task.wait()
+        assert task.status == 'ABORTED' and task.outlist == ['before']
+        assert task.etype is ZeroDivisionError
+        expect(ZeroDivisionError, lambda: task.result)
+        # polled by many threads, as in a server
+        task = i.submit('many 20000')
+        task.run()
+        threads = [threading.Thread(target=task.wait) for _ in range(4)] + [
+            threading.Thread(target=lambda: [task.status for _ in range(500)])
+            for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert task.status == 'FINISHED', task
+        assert task.outlist == ['line %d' % n for n in range(20000)]
+
+
+class PoolCmds(MPCmds):
+    "Used in test_mp_pool"
+    mpcommands = MPCmds.mpcommands + ['pid']
+    mp_pool_size = 2
+    mp_maxtasksperchild = 3
+
+    def pid(self):
+        return os.getpid()
+
+
+def test_mp_pool():
+    with plac.Interpreter(PoolCmds()) as i:
+        pids = [i.send('pid').outlist[0] for _ in range(6)]
+        assert len(set(pids)) == 2, pids  # recycled after 3 tasks
+        assert os.getpid() not in pids
+        assert i.send('many 3').str == 'line 0\nline 1\nline 2'
+        slow1, slow2, queued = [i.submit(line) for line in (
+            'slow', 'slow', 'many 2')]
+        for task in (slow1, slow2, queued):
+            task.run()
+        time.sleep(.1)
+        assert queued.status == 'SUBMITTED', queued  # no free workers
+        i.send('.kill %d' % slow1.no)
+        slow1.wait()
+        queued.wait()
+        assert slow1.status == 'KILLED', slow1
+        assert slow2.status == 'RUNNING', slow2  # not affected
+        assert queued.status == 'FINISHED', queued
+        slow2.kill()
+        slow2.wait()
+        assert slow2.status == 'KILLED', slow2
+        task = i.submit('crash')
+        task.run()
+        task.wait()
+        assert task.status == 'ABORTED', task
+        assert 'died with exit code 1' in task.traceback
+        assert i.send('pid').status == 'FINISHED'  # the pool is still ok
+
+
+class ThCmds(object):
+    "Used in test_thread_pool"
+    thcommands = ['work', 'imp']
+    th_pool_size = 3
+    th_limits = {'imp': 1}
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def work(self):
+        self.event.wait()
+        yield threading.current_thread().name
+
+    def imp(self):
+        self.event.wait()
+        yield 'imp'
+
+
+def test_thread_pool():
+    obj = ThCmds()
+    with plac.Interpreter(obj) as i:
+        imp1, imp2, work1, work2, work3 = tasks = [
+            i.submit(line) for line in
+            ('imp', 'imp', 'work', 'work', 'work')]
+        for task in tasks:
+            task.run()
+        time.sleep(.1)
+        assert imp1.status == 'RUNNING', imp1
+        assert imp2.status == 'SUBMITTED', imp2  # limit reached
+        assert work1.status == work2.status == 'RUNNING'
+        assert work3.status == 'SUBMITTED', work3  # no free threads
+        lines = i.send('.list').str.splitlines()
+        assert lines[0] == (
+            'thread pool: 3/3 threads busy, 2 queued, imp 1/1'), lines
+        i.send('.kill %d' % work3.no)
+        assert work3.status == 'KILLED', work3
+        obj.event.set()
+        for task in tasks:
+            task.wait()
+        assert [t.status for t in tasks] == ['FINISHED'] * 4 + ['KILLED']
+        names = set(t.outlist[0] for t in (work1, work2))
+        assert len(names) == 2, names
+    # an unbounded pool does not spawn threads for the limited tasks
+    obj = ThCmds()
+    obj.th_pool_size = None
+    with plac.Interpreter(obj) as i:
+        tasks = [i.submit('imp') for _ in range(50)]
+        for task in tasks:
+            task.run()
+        time.sleep(.1)
+        assert i.tm.thpool.nthreads == 1, i.tm.thpool.nthreads
+        obj.event.set()
+        for task in tasks:
+            task.wait()
+        assert all(t.status == 'FINISHED' for t in tasks)
+        assert i.tm.thpool.nthreads == 1, i.tm.thpool.nthreads
+
+
+class OutCmds(object):
+    "Used in test_output_buffer"
+    thcommands = ['imp']
+    out_maxlen = 3
+
+    def imp(self, n):
+        for i in range(int(n)):
+            yield 'line %d' % i
+
+
+def test_output_buffer():
+    for overflow in ('spill', 'gzip'):
+        buf = plac_ext.OutputBuffer(3, overflow)
+        buf.extend(range(10))
+        assert list(buf) == list(range(10))
+        buf.append(10)  # spill after reading
+        assert (len(buf), buf[0], buf[5], buf[-1]) == (11, 0, 5, 10)
+        buf.close()
+    buf = plac_ext.OutputBuffer(3, 'discard')
+    buf.extend(range(10))
+    assert (list(buf), buf.ndiscarded) == ([7, 8, 9], 7)
+    expect(IndexError, lambda: buf[3])
+    with plac.Interpreter(OutCmds()) as i:
+        task = i.submit('imp 5')
+        task.run()
+        task.wait()
+        assert task.outlist.nspooled == 2, task.outlist.nspooled
+        assert task.str == 'line 0\nline 1\nline 2\nline 3\nline 4'
+        assert task.result == 'line 4'
+        out = i.send('.output %d' % task.no).outlist
+        assert out[-1] == task.str, out
+    assert task.outlist._file is None  # the spool file was removed
+    assert len(task.outlist) == 3, len(task.outlist)
+
+
+def test_output_cursor():
+    class Task(object):
+        pass
+    for overflow in ('spill', 'gzip', 'discard'):
+        task = Task()
+        task.outlist = buf = plac_ext.OutputBuffer(3, overflow)
+        cursor = plac_ext.OutputCursor(task)
+        got = []
+        for i in range(0, 20, 4):
+            buf.extend(range(i, i + 4))
+            got.extend(cursor.read())  # the spool is not read again
+        assert cursor.read() == [] and buf.total == 20
+        if overflow == 'discard':
+            assert got == [1, 2, 3, 5, 6, 7, 9, 10, 11, 13, 14, 15, 17, 18,
+                           19], got
+            assert cursor.skipped == 5, cursor.skipped
+        else:
+            assert got == list(range(20)), got
+        buf.close()
+    task.outlist = [1, 2]
+    cursor = plac_ext.OutputCursor(task)
+    assert cursor.read() == [1, 2]
+    task.outlist.append(3)
+    assert cursor.read() == [3]
+
+
+class KeepCmds(object):
+    "Used in test_retention"
+    thcommands = ['echo']
+    keep_tasks = 2
+    keep_bytes = 10
+
+    def echo(self, text):
+        yield text
+
+
+def test_retention():
+    with plac.Interpreter(KeepCmds()) as i:
+        for text in ('a', 'b', 'c', 'd'):
+            i.send('echo ' + text)
+        assert sorted(i.tm.registry) == [2, 3, 4], sorted(i.tm.registry)
+        out = i.send('.output 1').str  # takes the number 5
+        assert out.startswith('<ThreadedTask 1 [echo a] FINISHED, evi'), out
+        i.send('echo %s' % ('x' * 10))  # exceeds keep_bytes with the others
+        i.send('echo y')
+        assert sorted(i.tm.registry) == [6, 7], sorted(i.tm.registry)
+        i.tm.keep_age = 0
+        time.sleep(.01)
+        i.send('echo z')  # task 7 is seen only now, but finished before
+        assert sorted(i.tm.registry) == [8], sorted(i.tm.registry)
+        assert list(i.tm.evicted) == [1, 2, 3, 4, 6, 7]
+        assert i.tm.evicted[7].wall is not None
+        line = u'echo \u00e8\u00e8'
+        task = i.send(line if version >= (3,) else line.encode('utf-8'))
+        assert plac_ext._outsize(task) == 4  # bytes, not characters
+
+
+class IndexCmds(object):
+    "Used in test_task_index"
+    thcommands = ['even', 'odd']
+
+    def even(self, n):
+        yield n
+
+    odd = even
+
+
+def test_task_index():
+    with plac.Interpreter(IndexCmds()) as i:
+        for n in range(10):
+            i.send('%s %d' % ('odd' if n % 2 else 'even', n))
+        task = i.submit('even 10')
+        assert i.tm._get_latest(-1) is task
+        assert i.tm._get_latest(-1, 'FINISHED').no == 10
+        assert i.tm._get_latest(-2, 'FINISHED').no == 9
+        assert list(i.tm.bystatus['SUBMITTED']) == [11]
+        task.run()
+        task.wait()
+        lines = i.send('.list FINISHED -c odd -s 2 -p 2').str.splitlines()
+        assert lines == ['<ThreadedTask 6 [odd 5] FINISHED>',
+                         '<ThreadedTask 8 [odd 7] FINISHED>',
+                         '... more tasks in page 3'], lines
+        out = i.send('.list FINISHED -c odd -a 60 -s 2 -p 3').str
+        assert out == '<ThreadedTask 10 [odd 9] FINISHED>', out
+        assert i.send('.list FINISHED -a 0').str == ''
+
+
+def test_import_cost():
+    # a script using only plac.call must not import plac_ext & co
+    if version < (3, 7):  # no -X importtime
+        return
+    def importtime(code):
+        # module name -> cumulative import time in us
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(docdir))
+        out = subprocess.check_output(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            stderr=subprocess.STDOUT, env=env).decode('utf-8')
+        cumulative = {}
+        for line in out.splitlines():
+            if line.startswith('import time:') and '|' in line:
+                self_us, cum_us, name = line[12:].split('|')
+                if cum_us.strip().isdigit():
+                    cumulative[name.strip()] = int(cum_us)
+        return cumulative
+    cumulative = importtime('import plac; plac.call(lambda x: x, ["1"])')
+    # argparse alone imports threading on some versions (via shutil/bz2)
+    base = importtime('import argparse')
+    for name in ('plac_ext', 'plac_tk', 'multiprocessing', 'subprocess',
+                 'threading', 'cmd'):
+        assert name not in cumulative or name in base, name
+    assert cumulative['plac'] < 200000, cumulative['plac']  # 0.2 seconds
+
+
+class CountingStream(object):
+    "A stream recording the writes, used to check the flush policy"
+    def __init__(self, tty=False):
+        self.writes = []
+        self.tty = tty
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self.tty
+
+
+def test_output_writer():
+    stream = CountingStream()
+    with plac.OutputWriter(stream, bufsize=10, interval=None) as out:
+        for i in range(7):
+            out.write('%d\n' % i)
+        assert stream.writes == ['0\n1\n2\n3\n4\n'], stream.writes
+    assert ''.join(stream.writes) == ''.join('%d\n' % i for i in range(7))
+    stream = CountingStream(tty=True)  # line buffered
+    out = plac.OutputWriter(stream)
+    out.write('a')
+    out.write('b\n')
+    assert stream.writes == ['ab\n'], stream.writes
+    stream = CountingStream()  # flushed by time
+    out = plac.OutputWriter(stream, interval=0)
+    out.write('a')
+    assert stream.writes == ['a'], stream.writes
+    stream = CountingStream()  # flushed by the timer, with no more writes
+    out = plac.OutputWriter(stream, interval=.05)
+    out.write('b')
+    assert stream.writes == [], stream.writes
+    time.sleep(.2)
+    assert stream.writes == ['b'], stream.writes
+
+
+def test_output_broken_pipe():
+    # a generator command piped to a reader closing early, as in | head
+    tmp = tempfile.mkdtemp()
+    try:
+        script = os.path.join(tmp, 'many.py')
+        with open(script, 'w') as f:
+            f.write('def main():\n    for i in range(1000000):\n'
+                    '        yield i\n')
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(docdir))
+        proc = subprocess.Popen([sys.executable, PLAC_RUNNER, script],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, env=env)
+        assert proc.stdout.readline() == b'0\n'
+        proc.stdout.close()
+        err = proc.stderr.read()
+        proc.stderr.close()
+        assert proc.wait() == 0, err
+        assert not err, err
+    finally:
+        shutil.rmtree(tmp)
+
+
+class DeferCmds(object):
+    "Used in test_defer_calls"
+    commands = ['add', 'fail']
+
+    def __init__(self):
+        self.calls = 0
+
+    def add(self, a, b):
+        self.calls += 1
+        return int(a) + int(b)
+
+    def fail(self):
+        1 / 0
+
+
+def test_defer_calls():
+    obj = DeferCmds()
+    with plac.Interpreter(obj) as i:
+        i.defer_calls = True
+        task = i.submit('add 1 2')
+        assert obj.calls == 0  # called when the task runs
+        task.run()
+        assert (task.result, obj.calls) == (3, 1)
+        task = i.send('fail')
+        assert task.status == 'ABORTED', task
+        assert task.etype is ZeroDivisionError
+        assert 'in fail' in i.send('.last_tb').str  # special command
+
+
 def test_doctest():
     failure, tot = doctest.testfile('index.rst', module_relative=False)
     assert not failure, failure
@@ -369,8 +1154,12 @@ def test_placet():
 '''
 
 if __name__ == '__main__':
+    tests = dict(globals())
+    if version >= (3, 6):  # the asynchronous generators are in the syntax
+        import test_plac_async
+        tests.update(vars(test_plac_async))
     n = 0
-    for name, test in sorted(globals().items()):
+    for name, test in sorted(tests.items()):
         if name.startswith('test_'):
             print('Running ' + name)
             maybegen = test()
@@ -0,0 +1,76 @@
+"""
+The tests of the asynchronous commands, which need Python 3.6+; they are
+run by test_plac.py too
+"""
+
+import time
+import asyncio
+import plac
+
+
+async def async_main(x, n=1):
+    "Used in test_async_call"
+    await asyncio.sleep(0)
+    return x * int(n)
+
+
+async def async_gen(n):
+    "Used in test_async_call"
+    for i in range(int(n)):
+        await asyncio.sleep(0)
+        yield i
+
+
+def test_async_call():
+    assert plac.call(async_main, ['a', '3']) == 'aaa'
+    assert plac.call(async_gen, ['3']) == [0, 1, 2]
+    assert list(plac.call(async_gen, ['2'], eager=False)) == [0, 1]
+
+    async def caller():  # in a running loop the caller awaits the result
+        return await plac.call(async_main, ['b', '2'])
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(caller()) == 'bb'
+    finally:
+        loop.close()
+    res = list(plac.call_many(async_main, ['x 2', 'y'], mode='t'))
+    assert res == ['xx', 'y'], res
+
+
+class AsyncCmds(object):
+    "Used in test_async_interpreter"
+    commands = ['gen']
+    asyncommands = ['sleep', 'forever']
+
+    async def gen(self, n):
+        for i in range(int(n)):
+            yield i
+
+    async def sleep(self, x):
+        await asyncio.sleep(.1)
+        return x
+
+    async def forever(self):
+        while True:
+            await asyncio.sleep(.01)
+            yield 'tick'
+
+
+def test_async_interpreter():
+    with plac.Interpreter(AsyncCmds()) as i:
+        assert i.send('gen 3').str == '0\n1\n2'
+        t0 = time.time()
+        tasks = [i.submit('sleep %d' % n) for n in range(20)]
+        for task in tasks:
+            task.run()
+        for n, task in enumerate(tasks):
+            assert task.result == str(n), task.result
+        assert time.time() - t0 < 1  # the tasks run concurrently
+        task = i.submit('forever')
+        task.run()
+        time.sleep(.05)
+        assert i.send('.list').str == str(task)
+        i.send('.kill')
+        task.wait()
+        assert task.status == 'KILLED', task
+        assert task.outlist[0] == 'tick'
@@ -1,9 +1,18 @@
-import multiprocessing, subprocess, random, time
+import os
+import sys
+import json
+import time
+import socket
+import random
+import signal
+import shutil
+import threading
+import tempfile
+import http.client
+import multiprocessing
 import plac
 from ishelve2 import ShelveInterface
 
-i = plac.Interpreter(ShelveInterface(configfile=None))
-
 COMMANDS = ['''\
 help
 set a 1
@@ -14,26 +23,438 @@ wrong command
 showall
 ''']
 
-def telnet(commands, port):
-    po = subprocess.Popen(['telnet', 'localhost', str(port)],
-                          stdin=subprocess.PIPE)
-    try:
+
+class SlowInterface(object):
+    "Used to check that a slow client does not block the others"
+    commands = 'sleep', 'ping', 'count', 'pid', 'crash', 'repeat'
+    thcommands = 'tick',
+
+    def sleep(self, seconds):
+        time.sleep(float(seconds))
+        return 'slept'
+
+    def ping(self):
+        return 'pong'
+
+    def repeat(self, text, times):
+        return text * int(times)
+
+    def pid(self):
+        return os.getpid()
+
+    def crash(self):
+        os._exit(1)
+
+    def count(self, n):
+        for i in range(int(n)):
+            yield i
+            time.sleep(.1)
+
+    def tick(self, n):
+        for i in range(int(n)):
+            time.sleep(.1)
+            yield 'tick %d' % i
+
+
+class BigInterface(SlowInterface):
+    "A container with many commands, slow to parse"
+    commands = SlowInterface.commands + tuple(
+        'cmd%d' % i for i in range(300))
+
+for _name in BigInterface.commands[len(SlowInterface.commands):]:
+    setattr(BigInterface, _name, lambda self, x=1, y=2: x)
+
+
+class BoundedInterface(object):
+    "A container keeping only the last 3 values of the tasks in memory"
+    thcommands = 'gen',
+    out_maxlen = 3
+
+    def __init__(self, overflow):
+        self.out_overflow = overflow
+
+    def gen(self, n):
+        for i in range(int(n)):
+            yield i
+            time.sleep(.002)
+
+
+def connect(port, timeout=10):
+    "Connect to the server, waiting for it to start"
+    t0 = time.time()
+    while True:
+        try:
+            return socket.create_connection(('localhost', port), timeout)
+        except socket.error:
+            if time.time() - t0 > timeout:
+                raise
+            time.sleep(.05)
+
+
+def read_answer(f, prompt=b'i> '):
+    "Read the answer of the server up to the next prompt"
+    data = b''
+    while not data.endswith(prompt):
+        char = f.read(1)
+        if not char:  # connection closed
+            break
+        data += char
+    return data[:-len(prompt)].decode('utf-8').replace('\r\n', '\n')
+
+
+def client(commands, port):
+    "Send the commands to the server and return the answers"
+    sock = connect(port)
+    with sock, sock.makefile('rwb') as f:
+        read_answer(f)  # the first prompt
+        answers = []
         for cmd in commands.splitlines():
-            po.stdin.write((cmd + '\n').encode('ascii'))
-            time.sleep(.1) # wait a bit for the server to answer
-    finally:
-        po.stdin.close()
+            f.write((cmd + '\r\n').encode('ascii'))
+            f.flush()
+            answers.append(read_answer(f))
+        f.write(b'EOF\r\n')
+        f.flush()
+        f.read()  # wait for the server to close the session
+    return answers
+
+
+def json_client(requests, port):
+    "Send all the requests at once and return the received messages"
+    sock = connect(port)
+    with sock, sock.makefile('rwb') as f:
+        for req in requests:
+            f.write((json.dumps(req) + '\n').encode('utf-8'))
+        f.flush()
+        messages, ends = [], 0
+        while ends < len(requests):
+            msg = json.loads(f.readline().decode('utf-8'))
+            msg['time'] = time.time()
+            messages.append(msg)
+            ends += msg['event'] == 'end'
+    return messages
+
+
+def start_server(obj, **kw):
+    port = random.choice(range(2000, 20000))
+    server = multiprocessing.Process(
+        target=plac.Interpreter(obj).start_server, args=(port,), kwargs=kw)
+    server.start()
+    return server, port
+
 
 def test():
+    tmp = tempfile.mkdtemp()
+    try:
+        server, port = start_server(
+            ShelveInterface(os.path.join(tmp, 'conf.shelve')))
+        # the clients share the shelve, so they run one after the other
+        out1, out2 = [client(cmds, port) for cmds in COMMANDS]
+        server.terminate()  # graceful shutdown
+        server.join()
+    finally:
+        shutil.rmtree(tmp)
+    assert 'showall' in out1[0], out1[0]
+    assert out1[1] == 'setting a=1\n', out1[1]
+    assert out2[0] == 'setting b=1\n', out2[0]
+    assert out2[1].startswith("No command 'wrong'"), out2[1]
+    assert sorted(out2[2].splitlines()) == ['a = 1', 'b = 1'], out2[2]
+    assert server.exitcode == 0, server.exitcode
+
+
+def test_concurrency():
+    server, port = start_server(SlowInterface())
+    try:
+        pool = multiprocessing.Pool(2)
+        slow = pool.apply_async(client, ('sleep 1', port))
+        time.sleep(.2)
+        t0 = time.time()
+        assert client('ping', port) == ['pong\n']
+        assert time.time() - t0 < .5, 'blocked by the slow client'
+        assert slow.get() == ['slept\n']
+        pool.close()
+        pool.join()
+    finally:
+        server.terminate()
+        server.join()
+    assert server.exitcode == 0, server.exitcode
+
+
+def test_json_protocol():
+    server, port = start_server(SlowInterface(), protocol='json')
+    try:
+        messages = json_client([
+            dict(id=1, line='tick 3'), dict(id=2, line='count 3'),
+            dict(id=3, args=['ping']), dict(id=4, line='wrong'),
+            'not a request'], port)
+    finally:
+        server.terminate()
+        server.join()
+    byid = {}
+    for msg in messages:
+        byid.setdefault(msg['id'], []).append(msg)
+    items = [msg['value'] for msg in byid[1] if msg['event'] == 'item']
+    assert items == ['tick 0', 'tick 1', 'tick 2'], byid[1]
+    count = byid[2]
+    assert [msg['value'] for msg in count[:-1]] == [0, 1, 2], count
+    assert count[1]['time'] - count[0]['time'] > .05, 'not streamed'
+    assert count[-1]['event'] == 'end', count
+    assert count[-1]['status'] == 'FINISHED', count
+    assert byid[3][0]['value'] == 'pong', byid[3]
+    assert byid[4][0]['value'] == "No command 'wrong'", byid[4]
+    assert byid[None][0]['status'] == 'ABORTED', byid[None]
+    # the threaded task runs in the background, concurrently with count
+    assert byid[1][-1]['time'] < count[-1]['time'] + .1, messages
+    assert server.exitcode == 0, server.exitcode
+
+
+def test_line_limit():
+    server, port = start_server(SlowInterface(), limit=1024)
+    try:
+        sock = connect(port)
+        with sock, sock.makefile('rwb') as f:
+            read_answer(f)  # the first prompt
+            f.write(b'x' * 4096 + b'\r\n')
+            f.flush()
+            answer = f.read().decode('utf-8')  # then the server closes
+        assert answer.startswith('ValueError: line too long'), answer
+        assert client('ping', port) == ['pong\n']  # still serving
+    finally:
+        server.terminate()
+        server.join()
+    assert server.exitcode == 0, server.exitcode
+
+
+def test_new_sessions():
+    # the interpreters of the new sessions are not built in the event loop
+    server, port = start_server(BigInterface())
+    try:
+        sock = connect(port)
+        with sock, sock.makefile('rwb') as f:
+            read_answer(f)  # the first prompt
+            news = [connect(port) for _ in range(10)]
+            t0 = time.time()
+            f.write(b'ping\r\n')
+            f.flush()
+            assert read_answer(f) == 'pong\n'
+            dt = time.time() - t0
+            for s in news:
+                s.makefile('rb').read(3)  # the prompt
+                s.close()
+        assert dt < .3, 'the event loop was blocked for %.2fs' % dt
+    finally:
+        server.terminate()
+        server.join()
+    assert server.exitcode == 0, server.exitcode
+
+
+def test_bounded_output():
+    # the values of a bounded output are streamed to the end
+    for overflow in ('spill', 'gzip', 'discard'):
+        server, port = start_server(
+            BoundedInterface(overflow), protocol='json', interval=.01)
+        try:
+            messages = json_client([dict(id=1, line='gen 200')], port)
+        finally:
+            server.terminate()
+            server.join()
+        items = [msg['value'] for msg in messages if msg['event'] == 'item']
+        end = messages[-1]
+        assert end['status'] == 'FINISHED', end
+        if overflow == 'discard':
+            assert items[-1] == 199 and items == sorted(items), items
+            assert len(items) + end.get('discarded', 0) == 200, end
+        else:
+            assert items == list(range(200)), items
+    # the same in the HTTP gateway
+    port = random.choice(range(2000, 20000))
+    server = multiprocessing.Process(
+        target=plac.Interpreter(BoundedInterface('discard')).start_gateway,
+        args=(port,), kwargs=dict(interval=.01))
+    server.start()
+    try:
+        connect(port).close()  # wait for the server
+        status, events = http_request(port, 'POST', '/gen', '[200]')
+    finally:
+        server.terminate()
+        server.join()
+    assert status == 200, status
+    items = [e['value'] for e in events[:-1]]
+    assert items[-1] == 199 and items == sorted(items), items
+    assert len(items) + events[-1].get('discarded', 0) == 200, events[-1]
+
+
+def test_client():
+    server, port = start_server(SlowInterface(), protocol='json')
+    try:
+        connect(port).close()  # wait for the server
+        with plac.Client(port=port, size=2, timeout=5) as c:
+            assert c.send('ping').str == 'pong'
+            t0 = time.time()
+            slow = c.submit('sleep 1')
+            tasks = [c.submit('count 3'), c.submit(['ping'])]
+            items = list(tasks[0])  # streamed while sleep is running
+            assert items == [0, 1, 2], items
+            assert time.time() - t0 < 1, 'blocked by sleep'
+            assert tasks[1].result == 'pong', tasks[1]  # pipelined
+            assert slow.result == 'slept', slow
+            assert len(c.pool) == 2, c.pool
+            err = c.send('sleep x')
+            assert err.status == 'ABORTED', err
+            assert 'ValueError' in str(err.exc), err.exc
+            assert 'in sleep' in err.traceback, err.traceback
+            task = c.submit('sleep 2')
+            task.timeout = .1
+            try:
+                task.wait()
+            except TimeoutError:
+                pass
+            else:
+                raise AssertionError('the timeout was not raised')
+    finally:
+        server.terminate()
+        server.join()
+    assert server.exitcode == 0, server.exitcode
+
+
+def test_client_pipelining():
+    # many large requests and larger answers in flight on one connection:
+    # the server stops reading until its answers are read
+    server, port = start_server(SlowInterface(), protocol='json')
+    try:
+        connect(port).close()  # wait for the server
+        with plac.Client(port=port, size=1, timeout=30) as c:
+            texts = [str(n % 10) * 50000 for n in range(400)]
+            results = []
+
+            def run():
+                tasks = [c.submit(['repeat', text, '10']) for text in texts]
+                results.extend(task.result for task in tasks)
+            thread = threading.Thread(target=run)
+            thread.daemon = True
+            thread.start()
+            thread.join(30)
+            assert not thread.is_alive(), 'deadlock'
+            assert results == [text * 10 for text in texts]
+    finally:
+        server.terminate()
+        server.join()
+    assert server.exitcode == 0, server.exitcode
+
+
+def http_request(port, method, path, body=None):
+    "Send an HTTP request and return the status and the decoded answer"
+    conn = http.client.HTTPConnection('localhost', port, timeout=10)
+    try:
+        conn.request(method, path, body)
+        resp = conn.getresponse()
+        data = resp.read().decode('utf-8')
+        if resp.getheader('Content-Type') == 'application/x-ndjson':
+            return resp.status, [json.loads(line)
+                                 for line in data.splitlines()]
+        return resp.status, json.loads(data)
+    finally:
+        conn.close()
+
+
+def test_gateway():
     port = random.choice(range(2000, 20000))
-    server = multiprocessing.Process(target=i.start_server, args=(port,))
+    server = multiprocessing.Process(
+        target=plac.Interpreter(SlowInterface()).start_gateway,
+        args=(port,))
     server.start()
-    clients = []
-    for cmds in COMMANDS:
-        cl = multiprocessing.Process(target=telnet, args=(cmds, port))
-        clients.append(cl)
-        cl.start()
-    for cl in clients:
-        cl.join()
-    server.terminate()
-    # should trap the output and check it
+    try:
+        connect(port).close()  # wait for the server
+        status, events = http_request(port, 'POST', '/count', '[3]')
+        assert status == 200, status
+        assert [e['value'] for e in events[:-1]] == [0, 1, 2], events
+        assert events[-1] == dict(event='end', no=1, status='FINISHED')
+        # a threaded task followed while another request is served
+        conn = http.client.HTTPConnection('localhost', port, timeout=10)
+        conn.request('POST', '/tick', '[50]')
+        resp = conn.getresponse()
+        no = int(resp.getheader('X-Task-No'))
+        assert json.loads(resp.readline())['value'] == 'tick 0'
+        status, tasks = http_request(port, 'GET', '/tasks?status=RUNNING')
+        assert [t['no'] for t in tasks] == [no], tasks
+        status, task = http_request(port, 'POST', '/tasks/%d/kill' % no)
+        assert task['status'] == 'TOBEKILLED', task
+        end = [json.loads(line) for line in resp.read().splitlines()][-1]
+        assert end['status'] == 'KILLED', end
+        conn.close()
+        status, events = http_request(port, 'GET', '/tasks/1/output')
+        assert [e.get('value') for e in events] == [0, 1, 2, None], events
+        status, events = http_request(port, 'POST', '/sleep', '["x"]')
+        assert 'ValueError' in events[-1]['error'], events
+        status, tasks = http_request(port, 'GET', '/tasks')
+        assert [t['status'] for t in tasks] == [
+            'FINISHED', 'KILLED', 'ABORTED'], tasks
+        # a blocking command runs outside the lock of the gateway
+        conn = http.client.HTTPConnection('localhost', port, timeout=10)
+        conn.request('POST', '/sleep', '[1]')
+        time.sleep(.2)
+        t0 = time.time()
+        status, tasks = http_request(
+            port, 'GET', '/tasks?status=RUNNING&cmd=sleep')
+        assert time.time() - t0 < .5, 'blocked by sleep'
+        assert len(tasks) == 1, tasks
+        events = [json.loads(line)
+                  for line in conn.getresponse().read().splitlines()]
+        assert events[0]['value'] == 'slept', events
+        conn.close()
+        assert http_request(port, 'POST', '/wrong')[0] == 404
+        assert http_request(port, 'GET', '/ping')[0] == 405
+        assert http_request(port, 'GET', '/tasks/99')[0] == 404
+        assert http_request(port, 'POST', '/tasks/1/kill')[0] == 409
+        # a body larger than the limit is refused before being read
+        sock = connect(port)
+        sock.sendall(b'POST /count HTTP/1.1\r\nContent-Length: %d\r\n\r\n'
+                     % 2 ** 30)
+        assert sock.makefile('rb').readline().startswith(b'HTTP/1.1 413')
+        sock.close()
+    finally:
+        server.terminate()
+        server.join()
+    assert server.exitcode == 0, server.exitcode
+
+
+def test_prefork():
+    server = plac.PreforkServer(plac.Interpreter(SlowInterface()), 0,
+                                processes=2)
+    answers = []
+
+    def clients():
+        try:
+            answers.append(client('pid', server.port))
+            sock = connect(server.port)  # crash a worker
+            with sock:
+                sock.sendall(b'crash\r\n')
+                while sock.recv(1024):
+                    pass
+            time.sleep(.5)  # wait for the restart
+            answers.append(client('ping', server.port))
+        finally:
+            os.kill(os.getpid(), signal.SIGTERM)  # stop the server
+    th = threading.Thread(target=clients)
+    th.start()
+    server.run()
+    th.join()
+    assert answers[1] == ['pong\n'], answers
+    assert int(answers[0][0]) != os.getpid(), answers  # served by a worker
+    assert server.restarts == 1, server.restarts
+    stats = server.stats()
+    assert len(stats) == 2 and not any(s['alive'] for s in stats), stats
+    assert sum(s['requests'] for s in stats) >= 1, stats
+
+
+if __name__ == '__main__':
+    test()
+    test_concurrency()
+    test_json_protocol()
+    test_line_limit()
+    test_new_sessions()
+    test_bounded_output()
+    test_client()
+    test_client_pipelining()
+    test_gateway()
+    test_prefork()
+    print('ok')
@@ -25,13 +25,57 @@
 """
 See docs/index.html for the documentation.
 """
+import sys
 from plac_core import *
-from plac_ext import (import_main, ReadlineInput, Interpreter,
-                      stdout, runp, Monitor, default_help)
 
 __version__ = '1.4.5'
 
-try:
-    from plac_tk import TkMonitor
-except ImportError:
-    pass
+# names imported from plac_ext on first access, since plac_ext imports
+# multiprocessing, subprocess, threading and more, which are not needed
+# by scripts using only plac.call
+_ext_names = ('import_main', 'ReadlineInput', 'Interpreter', 'stdout',
+              'runp', 'Monitor', 'default_help', 'OutputWriter', 'Client',
+              'RemoteError')
+# names imported from plac_async, which requires Python 3.5+
+if sys.version_info >= (3, 5):
+    _async_names = ('InterpreterServer', 'PreforkServer', 'HTTPGateway')
+else:
+    _async_names = ()
+
+if sys.version_info < (3, 7):  # no module-level __getattr__
+    from plac_ext import (import_main, ReadlineInput, Interpreter,
+                          stdout, runp, Monitor, default_help, OutputWriter,
+                          Client, RemoteError)
+    if _async_names:
+        from plac_async import InterpreterServer, PreforkServer, HTTPGateway
+    try:
+        from plac_tk import TkMonitor
+    except ImportError:
+        pass
+else:
+    def __getattr__(name):
+        "Import the names of plac_ext and plac_tk lazily"
+        if name in _ext_names:
+            import plac_ext
+            value = getattr(plac_ext, name)
+        elif name in _async_names:
+            import plac_async
+            value = getattr(plac_async, name)
+        elif name == 'TkMonitor':
+            try:
+                from plac_tk import TkMonitor as value
+            except ImportError:
+                raise AttributeError(name)
+        else:
+            raise AttributeError(
+                "module 'plac' has no attribute %r" % name)
+        globals()[name] = value  # next accesses will not call __getattr__
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_ext_names) | set(_async_names))
+
+# a generator expression, since on Python 2 the variable of a list
+# comprehension would be added to globals() while iterating on it
+__all__ = list(name for name in globals() if not name.startswith('_')) + \
+    list(_ext_names) + list(_async_names)
@@ -0,0 +1,964 @@
+# this module requires Python 3.5+ and it is imported by plac_ext only
+# when needed, i.e. when running asynchronous commands or the servers
+import os
+import sys
+import time
+import signal
+import inspect
+import asyncio
+import threading
+import multiprocessing
+import multiprocessing.connection
+from plac_ext import (
+    BaseTask, SynTask, OutputCursor, Histogram, Interpreter, decode,
+    terminatedProcess, _ms)
+
+if sys.version_info >= (3, 7):
+    _current_task = asyncio.current_task
+    _get_running_loop = asyncio.get_running_loop
+    _run = asyncio.run
+else:  # the running loop is the current event loop
+    _current_task = asyncio.Task.current_task
+    _get_running_loop = asyncio.get_event_loop
+
+    def _run(coro):
+        "Run the coroutine in a new event loop, like asyncio.run"
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            pending = asyncio.Task.all_tasks(loop)
+            for task in pending:  # as asyncio.run, cancel the leftovers
+                task.cancel()
+            loop.run_until_complete(
+                asyncio.gather(*pending, return_exceptions=True))
+            if hasattr(loop, 'shutdown_asyncgens'):  # Python 3.6
+                loop.run_until_complete(loop.shutdown_asyncgens())
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+# ######################## asynchronous tasks ############################ #
+
+class _Awaited(object):
+    "An asynchronous iterator yielding the result of a coroutine"
+    def __init__(self, coro):
+        self.coro = coro
+        self.done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.done:
+            raise StopAsyncIteration
+        self.done = True
+        return await self.coro
+
+    async def aclose(self):
+        if not self.done:  # avoid the warning "never awaited"
+            self.done = True
+            self.coro.close()
+
+
+def _as_agen(aobj):
+    "Convert a coroutine into an asynchronous iterator yielding its result"
+    if hasattr(aobj, '__anext__'):  # already an asynchronous generator
+        return aobj
+    return _Awaited(aobj)
+
+
+def _iter_async(aobj):
+    """
+    Iterate on an asynchronous generator, or on the result of a coroutine,
+    by using a private event loop
+    """
+    agen = _as_agen(aobj)
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        if hasattr(loop, 'shutdown_asyncgens'):  # Python 3.6+
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+def _run_async(aobj):
+    """
+    Run a coroutine with asyncio or convert an asynchronous generator into
+    a regular one. If an event loop is already running in this thread,
+    return aobj unchanged, so that the caller can await it.
+    """
+    try:
+        running = _get_running_loop().is_running()
+    except RuntimeError:  # no loop in this thread
+        running = False
+    if running:
+        return aobj
+    elif inspect.isasyncgen(aobj):
+        return _iter_async(aobj)
+    return _run(aobj)
+
+
+class EventLoopThread(object):
+    """
+    An asyncio event loop running in a daemon thread, shared by all the
+    asynchronous tasks of an interpreter.
+    """
+    def __init__(self):
+        self.asyncio = asyncio
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        self.asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        "Schedule the coroutine in the loop and return a concurrent future"
+        return self.asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        "Stop the loop and wait for the thread to end"
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class AsyncTask(BaseTask):
+    """
+    A task wrapping a coroutine or an asynchronous generator and running
+    in the event loop of the interpreter, concurrently with the other
+    asynchronous tasks but in a single thread.
+    """
+    def __init__(self, no, arglist, aobj, eventloop):
+        self.no = no
+        self.arglist = arglist
+        self._agenobj = _as_agen(aobj)
+        self._genobj = self._blocking()  # used by Interpreter.send
+        self.eventloop = eventloop
+        self.str, self.etype, self.exc, self.tb = '', None, None, None
+        self.status = 'SUBMITTED'
+        self.outlist = []
+        self.wall, self.cpu = None, None  # no CPU time for async tasks
+        self.future = None
+        self._atask = None
+
+    async def _awrap(self):
+        "The asynchronous version of BaseTask._wrap"
+        self._atask = _current_task()
+        self.status = 'RUNNING'
+        t0 = time.time()
+        try:
+            async for value in self._agenobj:
+                if self.status == 'TOBEKILLED':  # exit from the loop
+                    raise GeneratorExit
+                if value is not None:  # add output
+                    self.outlist.append(value)
+                    self.notify(decode(value))
+        except Interpreter.Exit:  # wanted exit
+            self._regular_exit()
+            raise
+        except (GeneratorExit, KeyboardInterrupt,
+                self.eventloop.asyncio.CancelledError):
+            # soft termination
+            self.status = 'KILLED'
+        except Exception:  # unexpected exception
+            self.etype, self.exc, self.tb = sys.exc_info()
+            self.status = 'ABORTED'
+        else:
+            self._regular_exit()
+        finally:
+            await self._agenobj.aclose()
+            self.finished = time.time()
+            self.wall = self.finished - t0
+
+    def _blocking(self):
+        "Run the task and wait for it"
+        self.run()
+        self.wait()
+        yield
+
+    def run(self):
+        "Schedule the task in the event loop"
+        if self.future is None:
+            self.future = self.eventloop.submit(self._awrap())
+
+    def wait(self):
+        "Block until the task ends"
+        if self.future is not None:
+            self.future.result()
+
+    def kill(self):
+        "Set a TOBEKILLED status and cancel the task"
+        self.status = 'TOBEKILLED'
+        if self._atask is not None:
+            self.eventloop.loop.call_soon_threadsafe(self._atask.cancel)
+
+
+# ######################### plac server ############################# #
+
+class _LineTooLong(Exception):
+    "Raised by InterpreterServer.readline when a line exceeds the limit"
+
+
+class InterpreterServer(object):
+    """
+    An asyncio server reading commands from its clients, with a new
+    interpreter for each connection. The commands are run in a pool of
+    workers threads, so that a slow command does not block the other
+    clients; the commands of a client are run one at the time. On SIGTERM
+    the server stops accepting connections and waits up to grace seconds
+    for the running commands before closing.
+
+    The protocol is 'text' (for humans using telnet) or 'json', where
+    each line sent by the client is a JSON object with an "id" and a
+    "line" (or a list of "args") and the server answers with JSON lines
+    tagged with the id of the request: an "item" event for each value
+    yielded by the command, as soon as it is available, and a final "end"
+    event with the status of the task and the error, if any. The client
+    can send many requests without waiting for the answers; the tasks
+    running in the background are followed every interval seconds.
+    A line longer than limit bytes is answered with an error and the
+    connection is closed.
+    """
+    terminator = '\r\n'  # the standard one for telnet
+    prompt = 'i> '
+
+    def __init__(self, interpreter, port=2199, host=None, workers=16,
+                 grace=5.0, backlog=1024, protocol='text', interval=0.05,
+                 sock=None, statsconn=None, limit=2 ** 20):
+        if protocol not in ('text', 'json'):
+            raise ValueError('Invalid protocol %r' % protocol)
+        self.interpreter = interpreter
+        self.port = port
+        self.protocol = protocol
+        self.interval = interval
+        self.sock = sock  # a listening socket, used instead of host/port
+        self.limit = limit  # the maximum length of a line
+        self.statsconn = statsconn  # where to send the statistics
+        self.nrequests = 0
+        self.latency = Histogram()  # of the requests, in seconds
+        self.host = host
+        self.workers = workers
+        self.grace = grace
+        self.backlog = backlog
+        self.sessions = set()  # the asyncio tasks serving the clients
+        self.idle = set()  # the sessions waiting for a line
+        self.stopping = False
+        self.pid = os.getpid()
+        # the interpreters are built one at the time, since they replace
+        # the parser of the shared object in the parser registry
+        self._building = threading.Lock()
+        self.asyncio = asyncio
+
+    def new_interpreter(self):
+        """
+        A new interpreter over the same object, for a new client; called
+        in a worker thread, since building the parser of a large container
+        would block the event loop
+        """
+        with self._building:
+            i = self.interpreter.__class__(self.interpreter.obj)
+        self._handle_sigterm()  # the TaskManager installed its own handler
+        return i
+
+    def _handle_sigterm(self):
+        try:
+            signal.signal(signal.SIGTERM, self._on_sigterm)
+        except ValueError:  # not in the main thread
+            pass
+
+    def _on_sigterm(self, signum, frame):
+        if os.getpid() != self.pid:  # in a forked task
+            terminatedProcess(signum, frame)
+        self.loop.call_soon_threadsafe(self.stop)
+
+    def stop(self):
+        "Stop accepting connections and close the idle sessions"
+        if self.stopping:
+            return
+        self.stopping = True
+        self.server.close()
+        for session in self.idle:
+            session.cancel()
+        self._stopped.set()
+
+    def run_line(self, i, line):
+        "Run a line in the interpreter i and return the text for the client"
+        task = i.submit(line)
+        task.run()  # synchronous or not
+        if task.etype:  # manage exception
+            error = '%s: %s\nReceived: %s' % (
+                task.etype.__name__, task.exc, ' '.join(task.arglist))
+            sys.stderr.write(task.traceback + error + '\n')  # on the server
+            return error
+        return task.str
+
+    def send_error(self, writer, error):
+        "Send an error not associated to a request"
+        if self.protocol == 'json':
+            import json
+            data = json.dumps(dict(id=None, event='end', status='ABORTED',
+                                   error=error)) + '\n'
+            writer.write(data.encode('utf-8'))
+        else:
+            self.write(writer, error + self.terminator)
+
+    def write(self, writer, text):
+        "Send a text to the client, fixing the newlines"
+        text = text.replace('\r\n', '\n').replace('\n', self.terminator)
+        writer.write(text.encode('utf-8'))
+
+    async def readline(self, reader):
+        "Read a line from the client, marking the session as idle"
+        session = _current_task()
+        self.idle.add(session)
+        try:
+            return await reader.readline()
+        except (ValueError, self.asyncio.LimitOverrunError):
+            raise _LineTooLong('ValueError: line too long (limit %d bytes), '
+                               'closing the connection' % self.limit)
+        finally:
+            self.idle.discard(session)
+
+    async def handle(self, reader, writer):
+        "Serve a client until EOF"
+        session = _current_task()
+        self.sessions.add(session)
+        i = None
+        try:
+            i = await self.loop.run_in_executor(
+                self.executor, self.new_interpreter)
+            await self.loop.run_in_executor(self.executor, i.__enter__)
+            if self.protocol == 'json':
+                await self.handle_json(i, reader, writer)
+            else:
+                await self.handle_text(i, reader, writer)
+        except (self.asyncio.CancelledError, ConnectionError):
+            pass
+        except _LineTooLong as exc:
+            self.send_error(writer, str(exc))
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+        finally:
+            try:
+                if i is not None:
+                    await self.loop.run_in_executor(
+                        self.executor, i.__exit__, None, None, None)
+            finally:
+                writer.close()
+                self.sessions.discard(session)
+
+    async def handle_text(self, i, reader, writer):
+        "The telnet protocol: a prompt, a line, the output of the task"
+        self.write(writer, self.prompt)
+        while not self.stopping:
+            data = await self.readline(reader)
+            line = data.decode('utf-8', 'replace').strip()
+            if not data or line == 'EOF':
+                break
+            elif line:
+                t0 = time.time()
+                text = await self.loop.run_in_executor(
+                    self.executor, self.run_line, i, line)
+                self.record(t0)
+                if text:
+                    self.write(writer, text + self.terminator)
+            self.write(writer, self.prompt)
+            await writer.drain()
+
+    def record(self, t0):
+        "Record a request started at time t0"
+        self.nrequests += 1
+        self.latency.add(time.time() - t0)
+
+    def _encode(self, msg):
+        # a message of the JSON lines protocol, as bytes
+        import json
+        return (json.dumps(msg, default=str) + '\n').encode('utf-8')
+
+    async def _write_and_drain(self, writer, data):
+        writer.write(data)
+        await writer.drain()
+
+    def _send_json(self, writer, msg):
+        # called in a worker thread: wait until the data can be written,
+        # so that a slow client slows down the task instead of filling
+        # the memory of the server
+        asyncio.run_coroutine_threadsafe(
+            self._write_and_drain(writer, self._encode(msg)),
+            self.loop).result()
+
+    def _send_items(self, writer, reqid, task, cursor):
+        # send the values not yet read by the OutputCursor and the final
+        # state if the task is finished; return the finished flag
+        done = task.status in ('FINISHED', 'ABORTED', 'KILLED')
+        for value in cursor.read():
+            self._send_json(writer, dict(id=reqid, event='item', value=value))
+        if done:
+            end = dict(id=reqid, event='end', no=task.no, status=task.status)
+            if cursor.skipped:
+                end['discarded'] = cursor.skipped
+            if task.etype:
+                end['error'] = '%s: %s' % (task.etype.__name__, task.exc)
+                end['traceback'] = task.traceback
+            self._send_json(writer, end)
+        return done
+
+    def run_json(self, i, lock, writer, reqid, line):
+        """
+        Submit the line and, if the task is synchronous, run it sending
+        its values as soon as they are yielded; return the task if it
+        runs in the background
+        """
+        t0 = time.time()
+        with lock:
+            task = i.submit(line)
+            if not isinstance(task, SynTask):
+                task.run()
+                return task
+            cursor = OutputCursor(task)
+            for _ in task._genobj:
+                self._send_items(writer, reqid, task, cursor)
+            self._send_items(writer, reqid, task, cursor)
+        self.loop.call_soon_threadsafe(self.record, t0)
+
+    def _poll_json(self, lock, writer, reqid, task, cursor):
+        with lock:
+            return self._send_items(writer, reqid, task, cursor)
+
+    async def follow(self, lock, writer, reqid, task):
+        "Send the values of a background task until it ends"
+        t0 = time.time()
+        run = self.loop.run_in_executor
+        cursor, done = OutputCursor(task), False
+        while not done:
+            try:
+                done = await run(self.executor, self._poll_json, lock,
+                                 writer, reqid, task, cursor)
+            except ConnectionError:  # the client is gone
+                return
+            if not done:
+                await self.asyncio.sleep(self.interval)
+        self.record(t0)
+
+    async def handle_json(self, i, reader, writer):
+        "The JSON lines protocol, with pipelined requests"
+        import json
+        lock = threading.Lock()  # serializes the access to the interpreter
+        followers = set()
+        try:
+            while not self.stopping:
+                data = await self.readline(reader)
+                if not data:
+                    break
+                elif not data.strip():
+                    continue
+                reqid = None
+                try:
+                    req = json.loads(data.decode('utf-8'))
+                    reqid = req.get('id')
+                    line = req['line'] if 'line' in req else req['args']
+                except Exception as exc:  # invalid request
+                    writer.write(self._encode(dict(
+                        id=reqid, event='end', status='ABORTED',
+                        error='%s: %s' % (exc.__class__.__name__, exc))))
+                    continue
+                if line == 'EOF':
+                    break
+                task = await self.loop.run_in_executor(
+                    self.executor, self.run_json, i, lock, writer, reqid,
+                    line)
+                if task is not None:
+                    followers.add(self.loop.create_task(
+                        self.follow(lock, writer, reqid, task)))
+                    followers = set(f for f in followers if not f.done())
+                await writer.drain()
+            if followers:  # wait for the answers of the background tasks
+                await self.asyncio.wait(followers)
+            await writer.drain()
+        finally:
+            for follower in followers:
+                follower.cancel()
+
+    async def serve(self):
+        "Serve until stopped, then wait for the running sessions"
+        self.loop = _get_running_loop()
+        self._stopped = self.asyncio.Event()
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor = ThreadPoolExecutor(self.workers)
+        if self.sock is None:
+            self.server = await self.asyncio.start_server(
+                self.handle, self.host, self.port, backlog=self.backlog,
+                limit=self.limit)
+        else:
+            self.server = await self.asyncio.start_server(
+                self.handle, sock=self.sock, limit=self.limit)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self._handle_sigterm()
+        if self.statsconn is not None:
+            reporter = self.loop.create_task(self.report())
+        wait = self.asyncio.wait
+        try:
+            await self._stopped.wait()
+            if self.sessions:
+                await wait(list(self.sessions), timeout=self.grace)
+            for session in list(self.sessions):
+                session.cancel()
+            if self.sessions:
+                await wait(list(self.sessions))
+        finally:
+            if self.statsconn is not None:
+                reporter.cancel()
+                self._send_stats()
+            self.server.close()
+            self.executor.shutdown(wait=False)
+
+    def _send_stats(self):
+        try:
+            self.statsconn.send(dict(
+                connections=len(self.sessions), requests=self.nrequests,
+                latency=self.latency))
+        except (OSError, EOFError):  # the supervisor is gone
+            pass
+
+    async def report(self, every=1.0):
+        "Send the statistics to statsconn when they change"
+        last = None
+        while True:
+            await self.asyncio.sleep(every)
+            current = (len(self.sessions), self.nrequests)
+            if current != last:
+                self._send_stats()
+                last = current
+
+    def run(self):
+        "Run the server in a new event loop until SIGTERM or CTRL-C"
+        try:
+            _run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+
+def _prefork_worker(interpreter, sock, conn, kw):
+    "The main function of a process of a PreforkServer"
+    for signum in (signal.SIGHUP, signal.SIGUSR1):  # for the supervisor
+        signal.signal(signum, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # until serving
+    InterpreterServer(interpreter, sock=sock, statsconn=conn, **kw).run()
+
+
+def _create_server(address, backlog):
+    "A listening TCP socket, like socket.create_server in Python 3.8+"
+    import socket
+    if hasattr(socket, 'create_server'):
+        return socket.create_server(address, backlog=backlog)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        if os.name == 'posix':
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen(backlog)
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+
+class _ServerProcess(object):
+    "A worker process of a PreforkServer, with its latest statistics"
+    def __init__(self, server):
+        self.conn, child_conn = multiprocessing.Pipe(duplex=False)
+        self.proc = multiprocessing.Process(
+            target=_prefork_worker,
+            args=(server.interpreter, server.sock, child_conn, server.kw))
+        self.proc.start()
+        child_conn.close()
+        self.stopping = False
+        self.stats = dict(connections=0, requests=0, latency=Histogram())
+
+    def receive(self):
+        "Read the statistics sent by the process, if any"
+        try:
+            while self.conn.poll():
+                self.stats = self.conn.recv()
+        except (EOFError, OSError):  # the process is dead
+            pass
+
+    def stop(self):
+        "Send a SIGTERM to the process: it will stop gracefully"
+        self.stopping = True
+        self.proc.terminate()
+
+
+class PreforkServer(object):
+    """
+    A server made of n processes (by default one per CPU) sharing the same
+    listening socket, each one running an InterpreterServer over a copy of
+    the object of the interpreter, forked by a supervisor process. The
+    supervisor restarts the processes which die unexpectedly; on SIGHUP it
+    starts new processes and stops gracefully the old ones (a reload), on
+    SIGUSR1 it prints the statistics of the processes on stderr and on
+    SIGTERM it stops all the processes gracefully. The keyword arguments
+    are passed to the InterpreterServers.
+    """
+    def __init__(self, interpreter, port=2199, processes=None, host=None,
+                 backlog=1024, **kw):
+        self.interpreter = interpreter
+        self.processes = processes or multiprocessing.cpu_count()
+        self.kw = kw
+        self.sock = _create_server((host or '', port), backlog)
+        self.port = self.sock.getsockname()[1]
+        self.workers = []  # list of _ServerProcess
+        self.restarts = 0
+        self._signals = []
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def start(self):
+        "Start the missing worker processes"
+        while len([w for w in self.workers if not w.stopping]) < \
+                self.processes:
+            self.workers.append(_ServerProcess(self))
+
+    def stats(self):
+        "A list of dictionaries with the statistics of the processes"
+        stats = []
+        for w in self.workers:
+            w.receive()
+            latency = w.stats['latency']
+            stats.append(dict(
+                pid=w.proc.pid, alive=w.proc.is_alive(),
+                connections=w.stats['connections'],
+                requests=w.stats['requests'], mean=latency.mean,
+                p50=latency.percentile(50), p99=latency.percentile(99)))
+        return stats
+
+    def format_stats(self):
+        "The statistics of the processes, as a table (times in ms)"
+        lines = ['%8s %6s %11s %9s %8s %8s %8s' % (
+            'pid', 'alive', 'connections', 'requests', 'mean', 'p50',
+            'p99')]
+        for s in self.stats():
+            lines.append('%8d %6s %11d %9d %8s %8s %8s' % (
+                s['pid'], s['alive'], s['connections'], s['requests'],
+                _ms(s['mean']), _ms(s['p50']), _ms(s['p99'])))
+        return '\n'.join(lines)
+
+    def reload(self):
+        "Replace the worker processes with new ones"
+        old = [w for w in self.workers if not w.stopping]
+        for w in old:
+            w.stopping = True
+        self.start()
+        for w in old:
+            w.stop()
+
+    def stop(self):
+        "Stop all the processes gracefully and wait for them"
+        for w in self.workers:
+            if not w.stopping:
+                w.stop()
+        for w in self.workers:
+            w.proc.join()
+            w.receive()  # the final statistics
+        self.sock.close()
+
+    def _reap(self):
+        "Remove the dead processes, restarting the crashed ones"
+        for w in list(self.workers):
+            if not w.proc.is_alive():
+                w.proc.join()
+                w.receive()
+                self.workers.remove(w)
+                if not w.stopping:  # died unexpectedly
+                    self.restarts += 1
+        self.start()
+
+    def run(self):
+        "Start the processes and supervise them until SIGTERM or CTRL-C"
+        handlers = dict((signum, signal.signal(signum, self._on_signal))
+                        for signum in (signal.SIGTERM, signal.SIGHUP,
+                                       signal.SIGUSR1))
+        try:
+            self.start()
+            while signal.SIGTERM not in self._signals:
+                waitables = [w.proc.sentinel for w in self.workers] + [
+                    w.conn for w in self.workers]
+                multiprocessing.connection.wait(waitables, 0.2)
+                for w in self.workers:
+                    w.receive()
+                while self._signals and self._signals[0] != signal.SIGTERM:
+                    signum = self._signals.pop(0)
+                    if signum == signal.SIGHUP:
+                        self.reload()
+                    else:  # SIGUSR1
+                        sys.stderr.write(self.format_stats() + '\n')
+                self._reap()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            self.stop()
+
+
+# ########################## HTTP gateway ############################### #
+
+class _HTTPError(Exception):
+    "An error to be sent to the HTTP client as a JSON object"
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class HTTPGateway(InterpreterServer):
+    """
+    An HTTP front end for a command container: POST /<command> with a
+    JSON list of arguments as body submits the command to the interpreter
+    and streams back the output as chunked JSON lines (an "item" event for
+    each value, then an "end" event, as in the JSON lines protocol). All
+    the clients share the given interpreter, so the tasks are visible in
+    GET /tasks (filtered by ?status= and ?cmd=), GET /tasks/<no>,
+    GET /tasks/<no>/output (following the task if still running) and can
+    be killed with POST /tasks/<no>/kill. A request line or header longer
+    than limit bytes is answered with 431, a longer body with 413. The
+    requests run in a pool of worker threads; the access to the
+    interpreter is serialized, but the blocking commands run outside the
+    lock, in the thread of the request.
+    """
+    def __init__(self, interpreter, port=8080, host=None, workers=16,
+                 grace=5.0, backlog=1024, interval=0.05, sock=None,
+                 statsconn=None, limit=2 ** 20):
+        InterpreterServer.__init__(
+            self, interpreter, port, host, workers, grace, backlog, 'json',
+            interval, sock, statsconn, limit)
+        self.lock = threading.Lock()  # serializes the access to the tasks
+        i = interpreter
+        i.defer_calls = True  # call the plain functions in _run_task
+        self.commands = (i.commands | i.mpcommands | i.thcommands |
+                         i.asyncommands)
+
+    # ############################ requests ############################ #
+
+    async def read_request(self, reader):
+        """
+        Read a request and return (method, path, query, headers, body),
+        or None if the client closed the connection
+        """
+        from urllib.parse import urlsplit, parse_qs, unquote
+        line = await self.readline(reader)
+        if not line.strip():
+            return None
+        try:
+            method, target, _version = line.decode('latin-1').split()
+        except ValueError:
+            raise _HTTPError(400, 'Invalid request line %r' % line)
+        headers = {}
+        while True:
+            line = await self.readline(reader)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if 'chunked' in headers.get('transfer-encoding', ''):
+            raise _HTTPError(411, 'Chunked requests are not supported')
+        length = int(headers.get('content-length') or 0)
+        if length > self.limit:
+            raise _HTTPError(413, 'The body exceeds the limit of %d bytes'
+                             % self.limit)
+        body = await reader.readexactly(length)
+        url = urlsplit(target)
+        path = [unquote(part) for part in url.path.split('/') if part]
+        query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+        return method, path, query, headers, body
+
+    async def handle(self, reader, writer):
+        "Serve the requests of a client until EOF or Connection: close"
+        session = _current_task()
+        self.sessions.add(session)
+        try:
+            while not self.stopping:
+                try:
+                    request = await self.read_request(reader)
+                    if request is None:
+                        break
+                    t0 = time.time()
+                    await self.respond(writer, *request)
+                    self.record(t0)
+                except _HTTPError as exc:
+                    self.reply(writer, exc.status, dict(error=str(exc)))
+                    break
+                except _LineTooLong as exc:
+                    self.reply(writer, 431, dict(error=str(exc)))
+                    break
+                except (self.asyncio.IncompleteReadError, ValueError) as e:
+                    self.reply(writer, 400, dict(error=str(e)))
+                    break
+                await writer.drain()
+                if request[3].get('connection', '').lower() == 'close':
+                    break
+            await writer.drain()
+        except (self.asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            self.sessions.discard(session)
+
+    async def respond(self, writer, method, path, query, headers, body):
+        "Dispatch a request to the right method"
+        run = self.loop.run_in_executor
+        if path[:1] == ['tasks'] and len(path) <= 3:
+            if len(path) == 3 and path[2] not in ('output', 'kill'):
+                raise _HTTPError(404, 'Not found')
+            allowed = 'POST' if path[2:] == ['kill'] else 'GET'
+            if method != allowed:
+                raise _HTTPError(405, 'Use %s' % allowed)
+            if len(path) == 1:
+                tasks = await run(self.executor, self.list_tasks,
+                                  query.get('status'), query.get('cmd'))
+                self.reply(writer, 200, tasks)
+                return
+            task = self.get_task(path[1])
+            if path[2:] == ['kill']:
+                self.reply(writer, *await run(
+                    self.executor, self.kill_task, task))
+            elif path[2:] == ['output']:
+                await self.stream(writer, task)
+            else:
+                self.reply(writer, 200, self.task_info(task))
+        elif len(path) == 1 and path[0] in self.commands:
+            if method != 'POST':
+                raise _HTTPError(405, 'Use POST')
+            args = self.json.loads(body.decode('utf-8')) if body else []
+            if not isinstance(args, list):
+                raise _HTTPError(400, 'Expected a JSON list of arguments')
+            task = await run(self.executor, self.submit,
+                             path[:1] + [str(arg) for arg in args])
+            await self.stream(writer, task, run=True)
+        else:
+            raise _HTTPError(404, 'Not found')
+
+    # ############################ tasks ############################### #
+
+    def submit(self, arglist):
+        "Submit the arguments to the interpreter and return the task"
+        with self.lock:
+            task = self.interpreter.submit(arglist)
+        if not isinstance(task, SynTask):
+            task.run()  # in the background
+        return task
+
+    def get_task(self, taskno):
+        "The task with the given number, if it is in the registry"
+        tm = self.interpreter.tm
+        try:
+            no = int(taskno)
+        except ValueError:
+            raise _HTTPError(400, 'Invalid task number %r' % taskno)
+        with self.lock:
+            if no not in tm.registry:
+                raise _HTTPError(410 if no in tm.evicted else 404,
+                                 tm._unknown(no))
+            return tm.registry[no]
+
+    def task_info(self, task):
+        "A JSON-serializable description of the task"
+        info = dict(no=task.no, cmd=task.cmd, line=' '.join(task.arglist),
+                    status=task.status, submitted=task.submitted)
+        if task.etype:
+            info['error'] = '%s: %s' % (task.etype.__name__, task.exc)
+        return info
+
+    def list_tasks(self, status=None, cmd=None):
+        "The descriptions of the tasks, optionally filtered"
+        tm = self.interpreter.tm
+        if status is not None and status not in BaseTask.STATES:
+            raise _HTTPError(400, 'Invalid status %r' % status)
+        with self.lock:
+            tm.refresh()
+            tasks = list(tm.bystatus[status].values() if status
+                         else tm.registry.values())
+        return [self.task_info(task) for task in tasks
+                if cmd is None or task.cmd == cmd]
+
+    def kill_task(self, task):
+        "Kill the task and return the HTTP status and the answer"
+        with self.lock:
+            if task.status in ('ABORTED', 'KILLED', 'FINISHED'):
+                return 409, dict(error='Task %d already %s' % (
+                    task.no, task.status))
+            task.kill()
+        return 200, self.task_info(task)
+
+    # ############################ responses ########################### #
+
+    def write_head(self, writer, status, headers):
+        "Write the status line and the headers"
+        from http import HTTPStatus
+        lines = ['HTTP/1.1 %d %s' % (status, HTTPStatus(status).phrase)]
+        lines.extend('%s: %s' % item for item in headers)
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    def reply(self, writer, status, obj):
+        "Send a JSON answer"
+        data = self.json.dumps(obj, default=str).encode('utf-8')
+        self.write_head(writer, status, [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', len(data))])
+        writer.write(data)
+
+    def _encode(self, msg):
+        # a JSON line without the id, as a chunk; used by _send_json
+        del msg['id']
+        data = (self.json.dumps(msg, default=str) + '\n').encode('utf-8')
+        return b'%x\r\n%s\r\n' % (len(data), data)
+
+    def _run_task(self, writer, task):
+        # run a synchronous task sending its values as soon as yielded
+        cursor = OutputCursor(task)
+        for _ in task._genobj:
+            self._send_items(writer, None, task, cursor)
+        self._send_items(writer, None, task, cursor)
+
+    async def stream(self, writer, task, run=False):
+        """
+        Send the output of the task as chunked JSON lines, running it if
+        it is synchronous and run is true, following it otherwise
+        """
+        self.write_head(writer, 200, [
+            ('Content-Type', 'application/x-ndjson'),
+            ('Transfer-Encoding', 'chunked'), ('X-Task-No', task.no)])
+        execute = self.loop.run_in_executor
+        if run and isinstance(task, SynTask):
+            await execute(self.executor, self._run_task, writer, task)
+        else:
+            cursor, done = OutputCursor(task), False
+            while not done:
+                done = await execute(self.executor, self._send_items,
+                                     writer, None, task, cursor)
+                if not done:
+                    await self.asyncio.sleep(self.interval)
+        writer.write(b'0\r\n\r\n')
+
+    async def serve(self):
+        "Serve until stopped, inside the interpreter"
+        import json
+        self.json = json
+        self.interpreter.__enter__()
+        try:
+            await InterpreterServer.serve(self)
+        finally:
+            self.interpreter.__exit__(None, None, None)
@@ -1,11 +1,17 @@
 # this module should be kept Python 2.3 compatible
+import os
 import re
 import sys
+import shlex
+import zlib
 import time
+import bisect
+import weakref
 import inspect
 import textwrap
 import functools
 import argparse
+import collections
 from datetime import datetime, date
 from gettext import gettext as _
 
@@ -22,13 +28,37 @@ else:
             self.annotations = getattr(f, '__annotations__', {})
 
 
+if hasattr(functools, 'lru_cache'):  # Python 3.2+
+    _memoize = functools.lru_cache(maxsize=256)
+else:
+    def _memoize(func):
+        return func
+
+_isodate = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}\Z')
+_isodatetime = re.compile(
+    r'[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}-[0-9]{2}-[0-9]{2}\Z')
+
+
+@_memoize
 def to_date(s):
     """Returns year-month-day"""
+    if _isodate.match(s):  # fast path
+        try:
+            return date(int(s[:4]), int(s[5:7]), int(s[8:]))
+        except ValueError:  # let strptime raise the usual error
+            pass
     return date(*time.strptime(s, "%Y-%m-%d")[0:3])
 
 
+@_memoize
 def to_datetime(s):
     """Returns year-month-day hour-minute-second"""
+    if _isodatetime.match(s):  # fast path
+        try:
+            return datetime(int(s[:4]), int(s[5:7]), int(s[8:10]),
+                            int(s[11:13]), int(s[14:16]), int(s[17:]))
+        except ValueError:  # let strptime raise the usual error
+            pass
     return datetime(*time.strptime(s, "%Y-%m-%d %H-%M-%S")[0:6])
 
 
@@ -151,12 +181,16 @@ PARSER_CFG = getfullargspec(argparse.ArgumentParser.__init__).args[1:]
 # the default arguments accepted by an ArgumentParser object
 
 
+def _getdoc(obj):
+    "The dedented docstring of obj, if any"
+    return textwrap.dedent(obj.__doc__.rstrip()) if obj.__doc__ else None
+
+
 def pconf(obj):
     """
     Extracts the configuration of the underlying ArgumentParser from obj
     """
-    cfg = dict(description=(textwrap.dedent(obj.__doc__.rstrip())
-                            if obj.__doc__ else None),
+    cfg = dict(description=_getdoc(obj),
                formatter_class=argparse.RawDescriptionHelpFormatter)
     for name in dir(obj):
         if name in PARSER_CFG:  # argument of ArgumentParser
@@ -164,31 +198,382 @@ def pconf(obj):
     return cfg
 
 
-_parser_registry = {}
+class _StrongRef(object):
+    "Same interface of weakref.ref, for objects not weakly referenceable"
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __call__(self):
+        return self.obj
+
+
+def _weakref(obj, callback=None):
+    "A weak reference to obj or a _StrongRef if it is not possible"
+    try:
+        return weakref.ref(obj, callback)
+    except TypeError:
+        return _StrongRef(obj)
+
+
+class _RegistryEntry(object):
+    "The parsers of an owner, referenced strongly or weakly"
+    __slots__ = ('ref', 'parsers', 'strong')
+
+    def __init__(self, ref):
+        self.ref = ref  # to the owner
+        self.parsers = {}  # key -> parser or weakref(parser)
+        self.strong = True
+
+
+class ParserRegistry(object):
+    """
+    A mapping obj -> parser with hit/miss/eviction counters. The parsers
+    are grouped by owner (the object itself or, for bound methods, the
+    instance). The registry keeps alive the parsers of the maxsize most
+    recently used owners (all of them if maxsize is None); the parsers of
+    the other owners are evicted, i.e. referenced weakly, so that they
+    are discarded, and their owners garbage collected, as soon as nobody
+    else uses them.
+    """
+    def __init__(self, maxsize=128):
+        self.hits = self.misses = self.evictions = 0
+        self._index = {}  # id(owner) -> _RegistryEntry
+        # the ids of the owners with strong entries, least recent first
+        self._recent = collections.OrderedDict()
+        self.maxsize = maxsize
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, maxsize):
+        self._maxsize = maxsize
+        self._evict()
+
+    def _split(self, obj):
+        "Return the owner of the parser of obj and the key inside the owner"
+        if inspect.ismethod(obj) and obj.__self__ is not None:
+            return obj.__self__, obj.__func__
+        return obj, None
+
+    def _lookup(self, owner):
+        "Return the entry of the owner, if registered, as most recently used"
+        ident = id(owner)
+        entry = self._index.get(ident)
+        if entry is None or entry.ref() is not owner:  # not registered
+            return None
+        self._recent.pop(ident, None)  # move it to the end
+        self._recent[ident] = None
+        if not entry.strong:  # used again
+            parsers = ((key, ref()) for key, ref in entry.parsers.items())
+            entry.parsers = dict(
+                item for item in parsers if item[1] is not None)
+            entry.strong = True
+        self._evict()
+        return entry
+
+    def _evict(self):
+        # keep strong only the entries of the maxsize most recent owners
+        while self.maxsize is not None and len(self._recent) > self.maxsize:
+            ident = self._recent.popitem(last=False)[0]
+            entry = self._index[ident]
+            entry.strong = False
+            entry.parsers = dict(
+                (key, weakref.ref(parser, self._discarder(ident, key)))
+                for key, parser in entry.parsers.items())
+            self.evictions += 1
+
+    def _discarder(self, ident, key):
+        "A weakref callback removing a collected parser"
+        def discard(ref):
+            entry = self._index.get(ident)
+            if entry is not None and entry.parsers.get(key) is ref:
+                del entry.parsers[key]
+                if not entry.parsers:
+                    del self._index[ident]
+        return discard
+
+    def __getitem__(self, obj):
+        owner, key = self._split(obj)
+        entry = self._lookup(owner)
+        if entry is None or key not in entry.parsers:
+            self.misses += 1
+            raise KeyError(obj)
+        self.hits += 1
+        return entry.parsers[key]
+
+    def __setitem__(self, obj, parser):
+        owner, key = self._split(obj)
+        entry = self._lookup(owner)
+        if entry is None:
+            ident = id(owner)
+            entry = self._index[ident] = _RegistryEntry(
+                _weakref(owner, lambda ref: self._remove(ident, ref)))
+            self._recent[ident] = None
+            self._evict()
+        if entry.strong:
+            entry.parsers[key] = parser
+        else:  # maxsize == 0
+            entry.parsers[key] = weakref.ref(
+                parser, self._discarder(id(owner), key))
+
+    def __delitem__(self, obj):
+        owner, key = self._split(obj)
+        entry = self._lookup(owner)
+        if entry is None or key not in entry.parsers:
+            raise KeyError(obj)
+        del entry.parsers[key]
+        if not entry.parsers:
+            del self._index[id(owner)]
+            self._recent.pop(id(owner), None)
+
+    def __contains__(self, obj):
+        owner, key = self._split(obj)
+        entry = self._lookup(owner)
+        return entry is not None and key in entry.parsers
+
+    def __len__(self):
+        return len(self._index)
+
+    def discard(self, owner):
+        "Remove the parsers of owner and of its bound methods, if any"
+        entry = self._index.get(id(owner))
+        if entry is not None and entry.ref() is owner:
+            del self._index[id(owner)]
+            self._recent.pop(id(owner), None)
+
+    def _remove(self, ident, ref):
+        "Called when a weakly referenced owner is garbage collected"
+        entry = self._index.get(ident)
+        if entry is not None and entry.ref is ref:  # not a new owner
+            del self._index[ident]
+            self._recent.pop(ident, None)
+
+    def clear(self):
+        "Remove all the parsers and reset the counters"
+        self._index.clear()
+        self._recent.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        "Return a dictionary with the counters and the number of owners"
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, size=len(self._index),
+                    maxsize=self.maxsize)
+
+
+parser_registry = _parser_registry = ParserRegistry()
 
 
 def parser_from(obj, **confparams):
     """
     obj can be a callable or an object with a .commands attribute.
-    Returns an ArgumentParser.
+    Returns an ArgumentParser. If lazy is true (or obj.lazy is true) the
+    subparsers of a command container are built only when needed.
+    If spec_cache is true (or obj.spec_cache is true) the description of
+    the parser is cached on the filesystem (see load_spec).
     """
     try:  # the underlying parser has been generated already
         return _parser_registry[obj]
     except KeyError:  # generate a new parser
         pass
-    conf = pconf(obj).copy()
-    conf.update(confparams)
+    lazy = confparams.pop('lazy', getattr(obj, 'lazy', False))
+    spec_cache = confparams.pop(
+        'spec_cache', getattr(obj, 'spec_cache', None))
+    if lazy:  # nothing to cache
+        spec_cache = None
+    spec = load_spec(obj, spec_cache) if spec_cache else None
+    baseconf = _decode_kw(spec['conf']) if spec else pconf(obj)
+    conf = dict(baseconf, **confparams)
     _parser_registry[obj] = parser = ArgumentParser(**conf)
     parser.obj = obj
+    parser.lazy = lazy
     parser.case_sensitive = confparams.get(
         'case_sensitive', getattr(obj, 'case_sensitive', True))
-    if hasattr(obj, 'commands') and not inspect.isclass(obj):
+    if spec and 'commands' in spec:  # a cached command container
+        parser.addsubcommands_from_spec(obj, spec['commands'])
+    elif spec:  # a cached callable
+        parser.populate_from_spec(obj, spec)
+    elif hasattr(obj, 'commands') and not inspect.isclass(obj):
         # a command container instance
         parser.addsubcommands(obj.commands, obj, 'subcommands')
     else:
         parser.populate_from(obj)
+    if spec_cache and not spec:
+        save_spec(obj, parser, baseconf, spec_cache)
     return parser
 
+# ########################### spec cache ################################ #
+
+SPEC_VERSION = 1  # to be changed when the format of the specs changes
+# the working directory at import time, against which the relative source
+# paths are resolved (before Python 3.9 __main__.__file__ can be relative)
+_STARTDIR = os.path.abspath(os.curdir)
+
+
+class _NotCacheable(Exception):
+    "Raised when a parser cannot be described in JSON"
+
+
+class _CachedArgSpec(object):
+    "The part of the argspec used by plac, as restored from the spec cache"
+    def __init__(self, args, varargs, varkw, defaults):
+        self.args = args
+        self.varargs = varargs
+        self.varkw = varkw
+        self.defaults = defaults
+        self.annotations = {}
+
+
+def _qualname(obj):
+    "Return the importable name module:qualname of obj"
+    module = getattr(obj, '__module__', None)
+    name = getattr(obj, '__qualname__', getattr(obj, '__name__', None))
+    if module is None or name is None or '<' in name:  # lambda or local
+        raise _NotCacheable(obj)
+    return '%s:%s' % (module, name)
+
+
+def _resolve(qualname):
+    "Return the object with the given module:qualname"
+    module, name = qualname.split(':')
+    obj = sys.modules.get(module) or __import__(module, {}, {}, ['*'])
+    for attr in name.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def _jsonable(value):
+    "Check that value is unchanged by a JSON round trip"
+    import json
+    try:
+        return json.loads(json.dumps(value)) == value
+    except (TypeError, ValueError):
+        return False
+
+
+def _encode_kw(kw):
+    "Convert a dictionary of keyword arguments into a JSON-compatible one"
+    out = {}
+    for key, value in kw.items():
+        if key in ('type', 'formatter_class') and value is not None:
+            value = _qualname(value)
+        elif key == 'choices' and value is not None:
+            value = list(value)
+        if not _jsonable(value):
+            raise _NotCacheable(key)
+        out[key] = value
+    return out
+
+
+def _decode_kw(kw):
+    "The inverse of _encode_kw"
+    out = dict(kw)
+    for key in ('type', 'formatter_class'):
+        if out.get(key) is not None:
+            out[key] = _resolve(out[key])
+    return out
+
+
+def _describe(parser):
+    "Describe a parser populated from a callable"
+    a = parser.argspec
+    if a.defaults and not _jsonable(list(a.defaults)):
+        raise _NotCacheable(a.defaults)
+    return dict(argspec=[a.args, a.varargs, a.varkw, list(a.defaults or [])],
+                prefix=parser.prefix,
+                argcalls=[[args, _encode_kw(kw)]
+                          for args, kw in parser._argcalls])
+
+
+def _describe_obj(obj):
+    "Identify obj by module, name, commands and command prefix"
+    if inspect.isroutine(obj) or inspect.isclass(obj):
+        name = _qualname(obj)
+    else:  # an instance
+        name = _qualname(obj.__class__)
+    return [name, sorted(getattr(obj, 'commands', ())),
+            getattr(obj, 'cmdprefix', '')]
+
+
+def _spec_path(obj, spec_cache):
+    """
+    Return the path of the cache file for obj and the path of the
+    source file of obj. Raise _NotCacheable if obj has no source file.
+    """
+    try:
+        srcfile = os.path.normpath(os.path.join(
+            _STARTDIR, sys.modules[obj.__module__].__file__))
+    except (AttributeError, KeyError):  # builtin or not a module
+        raise _NotCacheable(obj)
+    if not os.path.isfile(srcfile):  # say a zipped module
+        raise _NotCacheable(obj)
+    if spec_cache is True:  # use the XDG cache directory
+        spec_cache = os.path.join(
+            os.environ.get('XDG_CACHE_HOME') or
+            os.path.expanduser(os.path.join('~', '.cache')), 'plac')
+    key = repr([srcfile, _describe_obj(obj)]).encode('utf-8')
+    base = os.path.splitext(os.path.basename(srcfile))[0]
+    fname = '%s.%08x.json' % (base, zlib.crc32(key) & 0xffffffff)
+    return os.path.join(spec_cache, fname), srcfile
+
+
+def load_spec(obj, spec_cache=True):
+    """
+    Return the cached description of the parser of obj, or None if it
+    is missing or stale. The cache is invalidated by changes in the
+    modification time or in the size of the source file of obj.
+    """
+    import json
+    try:
+        path, srcfile = _spec_path(obj, spec_cache)
+        st = os.stat(srcfile)
+        with open(path) as f:
+            spec = json.load(f)
+    except (_NotCacheable, OSError, IOError, ValueError):
+        return  # missing or corrupted
+    if (spec.get('version') != SPEC_VERSION or
+            spec.get('source') != [srcfile, st.st_mtime, st.st_size] or
+            spec.get('object') != _describe_obj(obj)):
+        return
+    return spec
+
+
+def save_spec(obj, parser, conf, spec_cache=True):
+    """
+    Save a description of the parser of obj in the spec cache directory.
+    Objects that cannot be described (for instance because of lambda
+    types or non-JSON defaults) and I/O errors are silently skipped.
+    """
+    import json
+    try:
+        path, srcfile = _spec_path(obj, spec_cache)
+        st = os.stat(srcfile)
+        spec = dict(version=SPEC_VERSION,
+                    source=[srcfile, st.st_mtime, st.st_size],
+                    object=_describe_obj(obj), conf=_encode_kw(conf))
+        if hasattr(parser, 'subparsers'):
+            spec['commands'] = [
+                [name, _encode_kw(pconf(sub.func)), _getdoc(sub.func),
+                 _describe(sub)]
+                for name, sub in parser.subparsers._name_parser_map.items()]
+        else:
+            spec.update(_describe(parser))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp = '%s.%d' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(spec, f)
+        os.rename(tmp, path)  # atomic on POSIX
+    except (_NotCacheable, OSError, IOError):
+        pass
+
+
+_kwarg = re.compile(r'([a-zA-Z_]\w*)=')
+
 
 def _extract_kwargs(args):
     """
@@ -197,7 +582,7 @@ def _extract_kwargs(args):
     arglist = []
     kwargs = {}
     for arg in args:
-        match = re.match(r'([a-zA-Z_]\w*)=', arg)
+        match = _kwarg.match(arg)
         if match:
             name = match.group(1)
             kwargs[name] = arg[len(name)+1:]
@@ -206,23 +591,248 @@ def _extract_kwargs(args):
     return arglist, kwargs
 
 
+class CommandIndex(object):
+    """
+    A sorted index of command names, resolving exact matches, unique
+    prefixes and completions with a binary search. If case_sensitive is
+    false the lookups ignore the case, but the original names are returned.
+    """
+    def __init__(self, commands, case_sensitive=True):
+        self.case_sensitive = case_sensitive
+        pairs = sorted((self.normalize(name), name) for name in commands)
+        self.keys = [key for key, name in pairs]
+        self.names = [name for key, name in pairs]
+
+    def __len__(self):
+        return len(self.names)
+
+    def normalize(self, name):
+        "Return the key used to index the given name"
+        return name if self.case_sensitive else name.upper()
+
+    def _range(self, prefix):
+        "Return the indices (lo, hi) of the keys starting with prefix"
+        key = self.normalize(prefix)
+        lo = bisect.bisect_left(self.keys, key)
+        if not key:
+            return lo, len(self.keys)
+        try:  # the smallest string greater than all the keys with the prefix
+            upper = key[:-1] + chr(ord(key[-1]) + 1)
+        except ValueError:  # the last character is the maximum one
+            return lo, len(self.keys)
+        return lo, bisect.bisect_left(self.keys, upper, lo)
+
+    def completions(self, prefix):
+        "Return the names starting with the given prefix, sorted"
+        lo, hi = self._range(prefix)
+        return self.names[lo:hi]
+
+    def match(self, abbrev):
+        """
+        Return the command name matching exactly or as unique prefix,
+        None if there is no match, or raise a NameError if ambiguous.
+        """
+        key = self.normalize(abbrev)
+        lo = bisect.bisect_left(self.keys, key)
+        if (lo < len(self.keys) and self.keys[lo] == key and
+                (lo + 1 == len(self.keys) or self.keys[lo + 1] != key)):
+            return self.names[lo]  # perfect match
+        matches = self.completions(abbrev)
+        n = len(matches)
+        if n == 1:
+            return matches[0]
+        elif n > 1:
+            raise NameError(
+                _('Ambiguous command %r: matching %s' % (key, matches)))
+
+
 def _match_cmd(abbrev, commands, case_sensitive=True):
     """
     Extract the command name from an abbreviation or raise a NameError
     """
-    if not case_sensitive:
-        abbrev = abbrev.upper()
-        commands = [c.upper() for c in commands]
-    perfect_matches = [name for name in commands if name == abbrev]
-    if len(perfect_matches) == 1:
-        return perfect_matches[0]
-    matches = [name for name in commands if name.startswith(abbrev)]
-    n = len(matches)
-    if n == 1:
-        return matches[0]
-    elif n > 1:
-        raise NameError(
-            _('Ambiguous command %r: matching %s' % (abbrev, matches)))
+    if not isinstance(commands, CommandIndex):
+        commands = CommandIndex(commands, case_sensitive)
+    return commands.match(abbrev)
+
+
+class _FastMatcher(object):
+    """
+    A matcher compiled from the actions of a populated parser, mapping
+    the arguments into a namespace without going through argparse. It
+    only understands what plac generates (positional arguments, options
+    with one value, flags and varargs) in the simple forms -o value,
+    --option value and --option=value; .parse returns None for anything
+    else (help, errors, unknown options, combined flags, abbreviations,
+    positional arguments interleaved with options ...) so that the caller
+    can fall back to argparse, which gives the right result or error.
+    """
+    ERRORS = (argparse.ArgumentTypeError, TypeError, ValueError)
+
+    def compile(cls, parser):
+        "Return a matcher for the parser or None if it is not supported"
+        if parser.fromfile_prefix_chars:
+            return
+        options, positionals, defaults = {}, [], []
+        for action in parser._actions:
+            if isinstance(action, argparse._HelpAction):
+                continue  # -h/--help is managed by argparse
+            if isinstance(action.type, argparse.FileType):
+                return  # do not open files twice in case of fallback
+            if isinstance(action, argparse._StoreTrueAction):
+                flag = True
+            elif type(action) is argparse._StoreAction:
+                flag = False
+                if action.nargs not in (None, '?', '*') or (
+                        action.nargs == '*' and action.choices is not None):
+                    return
+                if action.option_strings and action.nargs is not None:
+                    return
+            else:  # versions, subparsers, custom actions
+                return
+            if action.option_strings:
+                for optstring in action.option_strings:
+                    options[optstring] = (action, flag)
+                defaults.append(action)
+            else:
+                positionals.append(action)
+        return cls(parser.prefix_chars, options, positionals, defaults,
+                   len(parser._actions))
+    compile = classmethod(compile)
+
+    def __init__(self, prefix_chars, options, positionals, optdefaults,
+                 nactions):
+        self.prefix_chars = prefix_chars
+        self.options = options
+        self.positionals = positionals
+        self.optdefaults = optdefaults
+        self.nactions = nactions
+        self.nrequired = sum(1 for a in positionals if a.nargs is None)
+
+    def _convert(self, action, string):
+        "Convert a string as argparse would do, raising ERRORS on failure"
+        value = string if action.type is None else action.type(string)
+        if action.choices is not None and value not in action.choices:
+            raise ValueError(value)
+        return value
+
+    def parse(self, arglist):
+        "Return an argparse.Namespace or None"
+        values = {}
+        tokens = []  # positional arguments
+        closed = False  # true if the positional arguments are interrupted
+        i, n = 0, len(arglist)
+        try:
+            while i < n:
+                arg = arglist[i]
+                if arg[:1] and arg[0] in self.prefix_chars:
+                    name, eq, value = arg.partition('=')
+                    if eq and name[1:2] == name[0]:  # --option=value
+                        action, flag = self.options.get(name, (None, True))
+                        if flag:
+                            return
+                        i += 1
+                    else:
+                        action, flag = self.options.get(arg, (None, None))
+                        if action is None:
+                            return
+                        elif flag:
+                            value = True
+                            i += 1
+                        elif i + 1 < n and not (
+                                arglist[i + 1][:1] and
+                                arglist[i + 1][0] in self.prefix_chars):
+                            value = arglist[i + 1]
+                            i += 2
+                        else:  # missing value
+                            return
+                    if not flag:
+                        value = self._convert(action, value)
+                    values[action.dest] = value
+                    closed = bool(tokens)
+                elif closed:
+                    return
+                else:
+                    tokens.append(arg)
+                    i += 1
+            extra = len(tokens) - self.nrequired
+            if extra < 0:  # missing required arguments
+                return
+            for action in self.positionals:
+                if action.nargs is None:
+                    values[action.dest] = self._convert(action, tokens.pop(0))
+                elif action.nargs == '?' and extra:
+                    values[action.dest] = self._convert(action, tokens.pop(0))
+                    extra -= 1
+                elif action.nargs == '?':
+                    value = action.default
+                    if isinstance(value, str):
+                        value = self._convert(action, value)
+                    values[action.dest] = value
+                elif extra:  # nargs == '*'
+                    values[action.dest] = [
+                        self._convert(action, t) for t in tokens[:extra]]
+                    del tokens[:extra]
+                    extra = 0
+                else:
+                    values[action.dest] = (action.default if action.default
+                                           is not None else [])
+            if tokens:  # unrecognized arguments
+                return
+            for action in self.optdefaults:
+                if action.dest not in values:
+                    value = action.default
+                    if isinstance(value, str) and action.type is not None:
+                        value = action.type(value)
+                    values[action.dest] = value
+        except self.ERRORS:
+            return
+        return argparse.Namespace(**values)
+
+
+class _LazyParserMap(collections.OrderedDict):
+    """
+    The name -> subparser dictionary used by lazy parsers: the commands
+    are registered by name only, in order, and their subparsers are built
+    and populated the first time they are looked up.
+    """
+    def __init__(self, subparsers):
+        collections.OrderedDict.__init__(self)
+        self.subparsers = subparsers
+        self.pending = {}  # name -> (func, add_help)
+
+    def register(self, name, func, add_help, doc):
+        "Register a command without building its subparser"
+        sp = self.subparsers
+        if version < (3,):
+            choice = sp._ChoicesPseudoAction(name, doc)
+        else:
+            choice = sp._ChoicesPseudoAction(name, (), doc)
+        sp._choices_actions.append(choice)
+        self.pending[name] = (func, add_help)
+        collections.OrderedDict.__setitem__(self, name, None)
+
+    def build(self, name):
+        "Build the subparser associated to a pending command"
+        func, add_help = self.pending[name]
+        sp = self.subparsers
+        conf = pconf(func)
+        if conf.get('prog') is None:
+            conf['prog'] = '%s %s' % (sp._prog_prefix, name)
+        parser = sp._parser_class(add_help=add_help, **conf)
+        parser.populate_from(func)
+        del self.pending[name]
+        collections.OrderedDict.__setitem__(self, name, parser)
+        return parser
+
+    def __getitem__(self, name):
+        if name in self.pending:
+            return self.build(name)
+        return collections.OrderedDict.__getitem__(self, name)
+
+    def get(self, name, default=None):
+        if name in self.pending:
+            return self.build(name)
+        return collections.OrderedDict.get(self, name, default)
 
 
 class ArgumentParser(argparse.ArgumentParser):
@@ -231,6 +841,8 @@ class ArgumentParser(argparse.ArgumentParser):
     .commands and .subparsers.
     """
     case_sensitive = True
+    lazy = False
+    fastpath = True  # use the _FastMatcher when possible
 
     if version < (3, 10):
         def __init__(self, *args, **kwargs):
@@ -247,15 +859,26 @@ class ArgumentParser(argparse.ArgumentParser):
         Call the underlying function with the args. Works also for
         command containers, by dispatching to the right subparser.
         """
+        cmd, func, args, kwargs = self.parse_call(args)
+        return cmd, func(*args, **kwargs)
+
+    def parse_call(self, args):
+        """
+        Parse the args and return a tuple (cmd, func, args, kwargs) without
+        calling the function. May raise a SystemExit.
+        """
         arglist = [self.alias(a) for a in args]
         cmd = None
         if hasattr(self, 'subparsers'):
             subp, cmd = self._extract_subparser_cmd(arglist)
             if subp is None and cmd is not None:
-                return cmd, self.missing(cmd)
+                return cmd, self.missing, [cmd], {}
             elif subp is not None:  # use the subparser
                 self = subp
-        if hasattr(self, 'argspec') and self.argspec.varargs:
+        ns = self._fast_parse(arglist) if self.fastpath else None
+        if ns is not None:  # parsed without argparse
+            extraopts = []
+        elif hasattr(self, 'argspec') and self.argspec.varargs:
             # ignore unrecognized arguments
             ns, extraopts = self.parse_known_args(arglist)
         else:
@@ -284,7 +907,21 @@ class ArgumentParser(argparse.ArgumentParser):
         # Correct options with trailing undescores
         args = [getattr(ns, a.rstrip('_')) for a in self.argspec.args]
         varargs = getattr(ns, self.argspec.varargs or '', [])
-        return cmd, self.func(*(args + varargs + extraopts), **kwargs)
+        return cmd, self.func, args + varargs + extraopts, kwargs
+
+    def _fast_parse(self, arglist):
+        """
+        Parse the arglist with a _FastMatcher compiled on first usage;
+        return None if argparse must be used instead
+        """
+        if not hasattr(self, 'argspec'):
+            return
+        matcher = getattr(self, '_matcher', None)
+        if matcher is None or matcher is not NONE and (
+                matcher.nactions != len(self._actions)):  # recompile
+            matcher = self._matcher = _FastMatcher.compile(self) or NONE
+        if matcher is not NONE:
+            return matcher.parse(arglist)
 
     def _extract_subparser_cmd(self, arglist):
         """
@@ -294,31 +931,77 @@ class ArgumentParser(argparse.ArgumentParser):
         name_parser_map = self.subparsers._name_parser_map
         for i, arg in enumerate(arglist):
             if not arg.startswith(optprefix):
-                cmd = _match_cmd(arg, name_parser_map, self.case_sensitive)
+                cmd = self.cmdindex().match(arg)
                 del arglist[i]
                 return name_parser_map.get(cmd), cmd or arg
         return None, None
 
+    def cmdindex(self):
+        """
+        Return the CommandIndex of the subcommands, built once and
+        rebuilt only if subcommands are added
+        """
+        names = self.subparsers._name_parser_map
+        index = getattr(self, '_cmdindex', None)
+        if (index is None or len(index) != len(names) or
+                index.case_sensitive != self.case_sensitive):
+            index = self._cmdindex = CommandIndex(names, self.case_sensitive)
+        return index
+
+    def cached_help(self, key, build):
+        """
+        Return the help text associated to the key, calling build() to
+        compute it the first time; the cache is invalidated when new
+        subcommands are added.
+        """
+        cache = self.__dict__.setdefault('_helpcache', {})
+        try:
+            return cache[key]
+        except KeyError:
+            text = cache[key] = build()
+            return text
+
     def addsubcommands(self, commands, obj, title=None, cmdprefix=''):
         """
         Extract a list of subcommands from obj and add them to the parser
         """
         if hasattr(obj, cmdprefix) and obj.cmdprefix in self.prefix_chars:
             raise ValueError(_('The prefix %r is already taken!' % cmdprefix))
+        self._helpcache = {}  # invalidate the cached help texts
         if not hasattr(self, 'subparsers'):
             self.subparsers = self.add_subparsers(title=title)
+            if self.lazy:  # build the subparsers on demand
+                self.subparsers._name_parser_map = self.subparsers.choices = \
+                    _LazyParserMap(self.subparsers)
         elif title:
             self.add_argument_group(title=title)  # populate ._action_groups
         prefixlen = len(getattr(obj, 'cmdprefix', ''))
         add_help = getattr(obj, 'add_help', True)
         for cmd in commands:
             func = getattr(obj, cmd[prefixlen:])  # strip the prefix
-            doc = (textwrap.dedent(func.__doc__.rstrip())
-                   if func.__doc__ else None)
+            doc = _getdoc(func)
+            if self.lazy:
+                self.subparsers._name_parser_map.register(
+                    cmd, func, add_help, doc)
+                continue
             self.subparsers.add_parser(
                 cmd, add_help=add_help, help=doc, **pconf(func)
                 ).populate_from(func)
 
+    def addsubcommands_from_spec(self, obj, commands):
+        """
+        Add the subcommands of obj described in the spec cache
+        """
+        self._helpcache = {}  # invalidate the cached help texts
+        self.subparsers = self.add_subparsers(title='subcommands')
+        prefixlen = len(getattr(obj, 'cmdprefix', ''))
+        add_help = getattr(obj, 'add_help', True)
+        for cmd, conf, doc, spec in commands:
+            func = getattr(obj, cmd[prefixlen:])  # strip the prefix
+            self.subparsers.add_parser(
+                cmd, add_help=add_help, help=doc, **_decode_kw(conf)
+                ).populate_from_spec(func, spec)
+
     def _set_func_argspec(self, obj):
         """
         Extracts the signature from a callable object and adds an .argspec
@@ -328,12 +1011,18 @@ class ArgumentParser(argparse.ArgumentParser):
         self.argspec = getargspec(obj)
         _parser_registry[obj] = self
 
+    def _add_argument(self, *args, **kw):
+        "Call .add_argument and record the call for the spec cache"
+        self._argcalls.append((args, kw))
+        return self.add_argument(*args, **kw)
+
     def populate_from(self, func):
         """
         Extract the arguments from the attributes of the passed function
         and return a populated ArgumentParser instance.
         """
         self._set_func_argspec(func)
+        self._argcalls = []
         f = self.argspec
         defaults = f.defaults or ()
         n_args = len(f.args)
@@ -375,32 +1064,48 @@ class ArgumentParser(argparse.ArgumentParser):
                 else:
                     shortlong = (prefix + suffix,)
             elif default is NONE:  # required argument
-                self.add_argument(name, help=a.help, type=a.type,
+                self._add_argument(name, help=a.help, type=a.type,
                                   choices=a.choices, metavar=metavar)
             else:  # default argument
-                self.add_argument(
+                self._add_argument(
                     name, nargs='?', help=a.help, default=dflt,
                     type=a.type, choices=a.choices, metavar=metavar)
             if a.kind == 'option':
                 if default is not NONE:
                     metavar = metavar or str(default)
-                self.add_argument(
+                self._add_argument(
                     help=a.help, default=dflt, type=a.type,
                     choices=a.choices, metavar=metavar, *shortlong)
             elif a.kind == 'flag':
                 if default is not NONE and default is not False:
                     raise TypeError(_('Flag %r wants default False, got %r') %
                                     (name, default))
-                self.add_argument(action='store_true', help=a.help, *shortlong)
+                self._add_argument(
+                    action='store_true', help=a.help, *shortlong)
         if f.varargs:
             a = Annotation.from_(f.annotations.get(f.varargs, ()))
-            self.add_argument(f.varargs, nargs='*', help=a.help, default=[],
+            self._add_argument(f.varargs, nargs='*', help=a.help, default=[],
                               type=a.type, metavar=a.metavar)
         if f.varkw:
             a = Annotation.from_(f.annotations.get(f.varkw, ()))
-            self.add_argument(f.varkw, nargs='*', help=a.help, default={},
+            self._add_argument(f.varkw, nargs='*', help=a.help, default={},
                               type=a.type, metavar=a.metavar)
 
+    def populate_from_spec(self, func, spec):
+        """
+        Populate the parser from a description saved in the spec cache,
+        without introspecting func.
+        """
+        self.func = func
+        args, varargs, varkw, defaults = spec['argspec']
+        self.argspec = _CachedArgSpec(
+            args, varargs, varkw, tuple(defaults) if defaults else None)
+        _parser_registry[func] = self
+        self.prefix = spec['prefix']
+        self._argcalls = []
+        for args, kw in spec['argcalls']:
+            self._add_argument(*args, **_decode_kw(kw))
+
     def missing(self, name):
         "May raise a SystemExit"
         miss = getattr(self.obj, '__missing__', lambda name:
@@ -419,6 +1124,15 @@ def iterable(obj):
     return hasattr(obj, '__iter__') and not inspect.isclass(obj) and not isinstance(obj, (str, bytes))
 
 
+if hasattr(inspect, 'isasyncgen'):  # Python 3.6+
+    def _isasync(obj):
+        "True for coroutines and asynchronous generators"
+        return inspect.iscoroutine(obj) or inspect.isasyncgen(obj)
+else:
+    def _isasync(obj):
+        return False
+
+
 def call(obj, arglist=None, eager=True, version=None):
     """
     If obj is a function or a bound method, parse the given arglist
@@ -426,6 +1140,8 @@ def call(obj, arglist=None, eager=True, version=None):
     and call obj with the parsed arguments.
     If obj is an object with attribute .commands, dispatch to the
     associated subparser.
+    Coroutine functions are run with asyncio and asynchronous generators
+    are iterated as regular generators.
     """
     if arglist is None:
         arglist = sys.argv[1:]
@@ -433,7 +1149,201 @@ def call(obj, arglist=None, eager=True, version=None):
     if version:
         parser.add_argument(
             '--version', '-v', action='version', version=version)
+    return _call_one(parser, arglist, eager)
+
+
+def _call_one(parser, arglist, eager=True):
+    "Dispatch an arglist to the parser and listify the result if eager"
     cmd, result = parser.consume(arglist)
+    if _isasync(result):
+        import plac_async  # not imported by plac, since it imports asyncio
+        result = plac_async._run_async(result)
     if iterable(result) and eager:  # listify the result
         return list(result)
     return result
+
+
+_worker = None  # (obj, parser) in the processes of call_many
+
+
+def _init_worker(obj):
+    "Build the parser once per process of call_many"
+    global _worker
+    _worker = obj, parser_from(obj)  # obj is kept alive with its parser
+
+
+def _call_in_process(arglist):
+    "Used by call_many in process mode"
+    return _call_one(_worker[1], arglist)
+
+
+def _call_obj_in_process(obj, arglist):
+    "Used by call_many in process mode when there are no initializers"
+    return _call_one(parser_from(obj), arglist)
+
+
+def call_many(obj, arglists, eager=True, mode=None, workers=None,
+              ordered=True):
+    """
+    Call obj on each arglist (a list of strings or a line to be split with
+    shlex) by reusing the same parser and yield the results in streaming.
+    mode can be None (sequential), 't' (use a pool of threads) or 'p'
+    (use a pool of processes: obj and the results must be pickleable).
+    In parallel mode the results are always listified and, if ordered is
+    false, yielded as soon as they are ready.
+    """
+    parser = parser_from(obj)
+    arglists = (shlex.split(a) if isinstance(a, str) else a
+                for a in arglists)
+    if mode is None:
+        for arglist in arglists:
+            yield _call_one(parser, arglist, eager)
+        return
+    assert mode in ('p', 't'), mode
+    from concurrent import futures
+    if not workers:
+        import multiprocessing
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    if mode == 'p' and sys.version_info >= (3, 7):
+        executor = futures.ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(obj,))
+        submit = functools.partial(executor.submit, _call_in_process)
+    elif mode == 'p':  # the parser is looked up at each call
+        executor = futures.ProcessPoolExecutor(workers)
+        submit = functools.partial(
+            executor.submit, _call_obj_in_process, obj)
+    else:
+        executor = futures.ThreadPoolExecutor(workers)
+        submit = functools.partial(executor.submit, _call_one, parser)
+    maxpending = 2 * workers  # do not read the whole input in advance
+    with executor:
+        if ordered:
+            pending = collections.deque()
+            for arglist in arglists:
+                pending.append(submit(arglist))
+                if len(pending) >= maxpending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        else:
+            pending = set()
+            for arglist in arglists:
+                pending.add(submit(arglist))
+                if len(pending) >= maxpending:
+                    done, pending = futures.wait(
+                        pending, return_when=futures.FIRST_COMPLETED)
+                    for fut in done:
+                        yield fut.result()
+            for fut in futures.as_completed(pending):
+                yield fut.result()
+
+# ########################### shell completion ############################ #
+
+_BASH_HEADER = '''\
+# %(shell)s completion for %(prog)s, generated by plac
+_plac_%(name)s() {
+    local cur prev cmd i
+    cur="${COMP_WORDS[COMP_CWORD]}"
+    prev="${COMP_WORDS[COMP_CWORD-1]}"
+    cmd=""
+'''
+
+_BASH_FIND_CMD = '''\
+    for ((i=1; i < COMP_CWORD; i++)); do
+        case "${COMP_WORDS[i]}" in
+            %s) cmd="${COMP_WORDS[i]}"; break;;
+        esac
+    done
+'''
+
+_BASH_FOOTER = '''\
+}
+complete -o default -F _plac_%(name)s %(prog)s
+'''
+
+
+def _words(words):
+    "Quote a list of candidates as a single argument of compgen -W"
+    return "'%s'" % ' '.join(words).replace("'", "'\\''")
+
+
+def _compgen(words, hook=None):
+    "Return a bash expression computing the candidates"
+    gen = _words(words)
+    if hook:  # dynamic candidates, computed by calling the hook
+        gen += '" $( { %s; } 2>/dev/null)"' % hook
+    return 'COMPREPLY=($(compgen -W %s -- "$cur"))' % gen
+
+
+def _complete_section(parser, hooks, cmd=None):
+    "Return the bash code completing the arguments of a (sub)parser"
+    def hook(dest):
+        return hooks.get('%s.%s' % (cmd, dest)) or hooks.get(dest)
+    options, positional, commands = [], [], []
+    lines = ['case "$prev" in']
+    for action in parser._actions:
+        if isinstance(action, argparse._SubParsersAction):
+            commands.extend(action._name_parser_map)
+        elif action.option_strings:
+            options.extend(action.option_strings)
+            if action.nargs != 0:  # the option takes a value
+                lines.append('    %s) %s; return;;' % (
+                    '|'.join(action.option_strings),
+                    _compgen(action.choices or (), hook(action.dest))))
+        else:
+            positional.append(action)
+    lines.append('esac')
+    words = list(commands)
+    hookcmds = []
+    for action in positional:
+        words.extend(str(c) for c in action.choices or ())
+        if hook(action.dest):
+            hookcmds.append(hook(action.dest))
+    lines.extend([
+        'if [[ "$cur" == %s* ]]; then' % parser.prefix_chars[0],
+        '    %s' % _compgen(options),
+        'else',
+        '    %s' % _compgen(words, '; '.join(hookcmds)),
+        'fi'])
+    return lines
+
+
+def completion(obj, shell='bash', prog=None, hooks=None):
+    """
+    Return a self-contained completion script for the plac tool obj,
+    with all the commands, options and choices precomputed. hooks is an
+    optional dictionary {dest or cmd.dest: shell command} giving the
+    candidates of arguments without static choices; the shell command
+    (which may call the tool itself) runs only when completing them.
+    """
+    if shell not in ('bash', 'zsh'):
+        raise ValueError(_('Unsupported shell %r') % shell)
+    parser = parser_from(obj)
+    prog = prog or os.path.basename(parser.prog.split()[0])
+    hooks = hooks or {}
+    conf = dict(shell=shell, prog=prog, name=re.sub(r'\W', '_', prog))
+    out = []
+    if shell == 'zsh':
+        out.append('#compdef %s\n' % prog)
+        out.append('autoload -U +X bashcompinit && bashcompinit\n')
+    out.append(_BASH_HEADER % conf)
+    subparsers = getattr(parser, 'subparsers', None)
+    if subparsers is None:
+        sections = [('', parser)]
+    else:
+        names = list(subparsers._name_parser_map)
+        out.append(_BASH_FIND_CMD % '|'.join(names))
+        sections = [('', parser)] + [
+            (name, subparsers._name_parser_map[name]) for name in names]
+    out.append('    case "$cmd" in\n')
+    for name, subp in sections:
+        out.append('        %s)\n' % (name or '""'))
+        for line in _complete_section(subp, hooks, name or None):
+            out.append(' ' * 12 + line + '\n')
+        out.append(' ' * 12 + ';;\n')
+    out.append('    esac\n')
+    out.append(_BASH_FOOTER % conf)
+    return ''.join(out)
@@ -1,9 +1,16 @@
 # this module requires Python 2.6+
 from __future__ import with_statement
 from contextlib import contextmanager
-from operator import attrgetter
 from gettext import gettext as _
 import inspect
+import errno
+import io
+import gzip
+import zlib
+import pickle
+import tempfile
+import time
+import math
 import os
 import sys
 import cmd
@@ -12,9 +19,13 @@ import subprocess
 import argparse
 import itertools
 import traceback
+import heapq
+import collections
 import multiprocessing
+import multiprocessing.connection
 import signal
 import threading
+import weakref
 import plac_core
 
 version = sys.version_info[:2]
@@ -71,6 +82,20 @@ try:
 except NameError:  # Python 3
     raw_input = input
 
+try:
+    ConnectionError, TimeoutError
+except NameError:  # Python 2
+    import socket
+    ConnectionError = TimeoutError = socket.error
+
+# the CPU time of the current thread, used in the task statistics
+if hasattr(time, 'thread_time'):  # Python 3.7+
+    thread_time = time.thread_time
+elif hasattr(time, 'process_time'):  # Python 3.3+
+    thread_time = time.process_time
+else:
+    thread_time = time.clock
+
 
 def decode(val):
     """
@@ -103,6 +128,101 @@ def write(x):
     sys.stdout.flush()
 
 
+class OutputWriter(object):
+    """
+    A buffered writer for the output of commands. The buffer is flushed
+    when it contains more than bufsize characters, when more than interval
+    seconds passed since the last flush (by a timer, so that the last
+    output is not kept when no more writes come) and, if linebuffered is
+    true (the default when the stream is a TTY), at each newline. When
+    used as a context manager, the buffer is flushed at the
+    end and broken pipes (as in ``plac_runner.py tool.py | head``) are
+    silenced by redirecting the stream to the null device.
+    """
+    def __init__(self, stream=None, bufsize=65536, interval=1.0,
+                 linebuffered=None):
+        self.stream = stream or sys.stdout
+        if linebuffered is None:
+            isatty = getattr(self.stream, 'isatty', None)
+            linebuffered = bool(isatty and isatty())
+        self.bufsize = bufsize
+        self.interval = interval
+        self.linebuffered = linebuffered
+        self._buf = []
+        self._size = 0
+        self._last = time.time()
+        self._lock = threading.RLock()  # the timer flushes in a thread
+        self._timer = None
+
+    def write(self, x):
+        "Add str(x) to the buffer, flushing it if required"
+        s = str(x)
+        with self._lock:
+            self._buf.append(s)
+            self._size += len(s)
+            if (self._size >= self.bufsize or
+                    self.linebuffered and '\n' in s or
+                    self.interval is not None and
+                    time.time() - self._last >= self.interval):
+                self.flush()
+            elif self.interval is not None and self._timer is None:
+                self._timer = threading.Timer(
+                    self._last + self.interval - time.time(),
+                    self._timed_flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _timed_flush(self):
+        with self._lock:
+            if self._timer is not threading.current_thread():
+                return  # already flushed
+            self._timer = None
+            try:
+                if self._buf:
+                    self.flush()
+            except IOError:  # a broken pipe, seen at the next write
+                pass
+
+    def flush(self):
+        "Write the buffer on the stream and flush it"
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            data = ''.join(self._buf)
+            self._buf = []
+            self._size = 0
+            self._last = time.time()
+            try:
+                if data:
+                    self.stream.write(data)
+                self.stream.flush()
+            except IOError as e:  # BrokenPipeError in Python 3
+                if e.errno == errno.EPIPE:
+                    self._to_devnull()
+                raise
+
+    def _to_devnull(self):
+        "Redirect the stream to the null device, to avoid errors at exit"
+        try:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, self.stream.fileno())
+        except Exception:  # not a real file
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, exc, tb):
+        if isinstance(exc, IOError) and exc.errno == errno.EPIPE:
+            return True  # silence broken pipes
+        try:
+            self.flush()
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                raise
+
+
 def gen_val(value):
     "Return a generator object with a single element"
     yield value
@@ -114,6 +234,22 @@ def gen_exc(etype, exc, tb):
     yield
 
 
+def gen_call(func, args, kw):
+    """
+    Return a generator object calling func when iterated and yielding
+    its result, or the values of its result if iterable
+    """
+    result = func(*args, **kw)
+    if plac_core._isasync(result):  # run in a private event loop
+        import plac_async
+        result = plac_async._iter_async(result)
+    if plac_core.iterable(result):
+        for value in result:
+            yield value
+    else:
+        yield result
+
+
 def less(text):
     "Send a text to less via a pipe"
     # -c clear the screen before starting less
@@ -173,13 +309,17 @@ def read_long_line(stdin, terminator):
 class ReadlineInput(object):
     """
     An iterable with a .readline method reading from stdin.
+    The completions can be a list of names or a plac_core.CommandIndex.
     """
     def __init__(self, completions, case_sensitive=True, histfile=None):
-        self.completions = completions
-        self.case_sensitive = case_sensitive
+        if isinstance(completions, plac_core.CommandIndex):
+            self.index = completions
+        else:
+            self.index = plac_core.CommandIndex(completions, case_sensitive)
+        self.completions = self.index.names
+        self.case_sensitive = self.index.case_sensitive
         self.histfile = histfile
-        if not case_sensitive:
-            self.completions = [c.upper() for c in completions]
+        self._matches = []
         import readline
         self.rl = readline
         readline.parse_and_bind("tab: complete")
@@ -201,10 +341,10 @@ class ReadlineInput(object):
 
     def complete(self, kw, state):
         # state is 0, 1, 2, ... and increases by hitting TAB
-        if not self.case_sensitive:
-            kw = kw.upper()
+        if state == 0:  # new completion request
+            self._matches = self.index.completions(kw)
         try:
-            return [k for k in self.completions if k.startswith(kw)][state]
+            return self._matches[state]
         except IndexError:  # no completions
             return  # exit
 
@@ -225,7 +365,13 @@ class HelpSummary(object):
 
     @classmethod
     def add(cls, obj, specialcommands):
+        "Attach to the parser of obj a function building the summary"
         p = plac_core.parser_from(obj)
+        p.helpsummary = lambda: cls.build(obj, specialcommands)
+
+    @classmethod
+    def build(cls, obj, specialcommands):
+        "Build the summary; called only when the help is requested"
         c = cmd.Cmd(stdout=cls())
         c.stdout.write('\n')
         c.print_topics('special commands',
@@ -236,7 +382,9 @@ class HelpSummary(object):
                        sorted(obj.mpcommands), 15, 80)
         c.print_topics('threaded commands',
                        sorted(obj.thcommands), 15, 80)
-        p.helpsummary = str(c.stdout)
+        c.print_topics('asynchronous commands',
+                       sorted(obj.asyncommands), 15, 80)
+        return str(c.stdout)
 
     def __init__(self):
         self._ls = []
@@ -261,9 +409,12 @@ class PlacFormatter(argparse.RawDescriptionHelpFormatter):
 def format_help(self):
     "Attached to plac_core.ArgumentParser for plac interpreters"
     try:
-        return self.helpsummary
+        build = self.helpsummary
     except AttributeError:
         return super(plac_core.ArgumentParser, self).format_help()
+    if isinstance(build, str):
+        return build
+    return self.cached_help(None, build)
 plac_core.ArgumentParser.format_help = format_help
 
 
@@ -276,7 +427,15 @@ def default_help(obj, cmd=None):
     subp = parser.subparsers._name_parser_map.get(cmd)
     if subp is None:
         yield _('Unknown command %s' % cmd)
-    elif getattr(obj, '_interact_', False):  # in interactive mode
+        return
+    interact = getattr(obj, '_interact_', False)
+    yield parser.cached_help((cmd, interact), lambda: _subhelp(subp, cmd,
+                                                               interact))
+
+
+def _subhelp(subp, cmd, interact):
+    "Format the help of a subcommand"
+    if interact:  # in interactive mode
         formatter = subp._get_formatter()
         formatter._prog = cmd  # remove the program name from the usage
         formatter.add_usage(
@@ -289,9 +448,9 @@ def default_help(obj, cmd=None):
             formatter.add_arguments(a for a in action_group._group_actions
                                     if a.dest != 'help')
             formatter.end_section()
-        yield formatter.format_help()
+        return formatter.format_help()
     else:  # regular argparse help
-        yield subp.format_help()
+        return subp.format_help()
 
 # ######################## import management ############################## #
 
@@ -358,6 +517,204 @@ def import_main(path, *args):
 
 # ############################ Task classes ############################# #
 
+class _SpoolReader(io.RawIOBase):
+    "Read a spool file from the beginning, while it is being written"
+    def __init__(self, fileobj, lock):
+        self.fileobj = fileobj
+        self.lock = lock
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):  # GzipFile seeks on Python 2
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_END:
+            with self.lock:
+                self.fileobj.seek(0, os.SEEK_END)
+                offset += self.fileobj.tell()
+        elif whence == os.SEEK_CUR:
+            offset += self.pos
+        self.pos = offset
+        return offset
+
+    def readinto(self, b):
+        with self.lock:
+            self.fileobj.seek(self.pos)
+            data = self.fileobj.read(len(b))
+            self.fileobj.seek(0, os.SEEK_END)
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+
+class OutputBuffer(object):
+    """
+    A bounded replacement for the .outlist of a task, keeping in memory
+    the last maxlen values. The older values are pickled into a temporary
+    file if overflow is 'spill' (compressed if 'gzip') or thrown away if
+    it is 'discard'. Iterating on the buffer streams the spooled values
+    first and then the ones in memory; .total is the number of values
+    ever appended, discarded included.
+    """
+    OVERFLOWS = ('spill', 'gzip', 'discard')
+
+    def __init__(self, maxlen, overflow='spill'):
+        if overflow not in self.OVERFLOWS:
+            raise ValueError('Invalid overflow policy %r' % overflow)
+        self.maxlen = maxlen
+        self.overflow = overflow
+        self.ring = collections.deque()
+        self.nspooled = 0
+        self.ndiscarded = 0
+        self.total = 0
+        self._file = self._spool = None  # created at the first spill
+        self._lock = threading.Lock()
+
+    def append(self, value):
+        "Add a value, spilling or discarding the oldest one if needed"
+        with self._lock:
+            self.ring.append(value)
+            self.total += 1
+            if len(self.ring) > self.maxlen:
+                old = self.ring.popleft()
+                if self.overflow == 'discard':
+                    self.ndiscarded += 1
+                else:
+                    self._spill(old)
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def _spill(self, value):
+        if self._spool is None:
+            self._file = tempfile.TemporaryFile()
+            self._spool = gzip.GzipFile(fileobj=self._file, mode='wb') if (
+                self.overflow == 'gzip') else self._file
+        pickle.dump(value, self._spool, pickle.HIGHEST_PROTOCOL)
+        self.nspooled += 1
+
+    def _spool_reader(self):
+        # a new reader of the spooled values, from the first one
+        reader = io.BufferedReader(_SpoolReader(self._file, self._lock))
+        if self.overflow == 'gzip':
+            reader = gzip.GzipFile(fileobj=reader, mode='rb')
+        return reader
+
+    def _read_spool(self, n):
+        # yield the first n spooled values
+        if not n:
+            return
+        reader = self._spool_reader()
+        for _ in range(n):
+            yield pickle.load(reader)
+
+    def _flush_spool(self):
+        # make the spooled values readable; called with the lock held
+        if self._spool is not None:
+            self._spool.flush(zlib.Z_SYNC_FLUSH) if (
+                self.overflow == 'gzip') else self._spool.flush()
+
+    def __iter__(self):
+        with self._lock:
+            self._flush_spool()
+            n, ring = self.nspooled, list(self.ring)
+        for value in self._read_spool(n):
+            yield value
+        for value in ring:
+            yield value
+
+    def __len__(self):
+        "The number of values available, i.e. not discarded"
+        return self.nspooled + len(self.ring)
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('OutputBuffer index out of range')
+        if i >= self.nspooled:
+            return self.ring[i - self.nspooled]
+        return next(itertools.islice(iter(self), i, None))
+
+    def text(self):
+        "The values as a newline-separated string, as in task.str"
+        return '\n'.join(map(decode, self))
+
+    def close(self):
+        "Remove the spool file, if any: the spooled values are discarded"
+        with self._lock:
+            if self._spool is not None and self._spool is not self._file:
+                self._spool.close()  # the GzipFile, before its file
+            if self._file is not None:
+                self._file.close()
+                self._file = self._spool = None
+                self.ndiscarded += self.nspooled
+                self.nspooled = 0
+
+
+class OutputCursor(object):
+    """
+    Reads incrementally the .outlist of a task (a list or an OutputBuffer):
+    each call to .read() returns the values added since the previous
+    call. The spool of an OutputBuffer is read sequentially, and the
+    values discarded before being read are skipped and counted in
+    .skipped.
+    """
+    def __init__(self, task):
+        self.task = task
+        self.pos = 0  # the number of values read or skipped
+        self.skipped = 0
+        self._reader = self._file = None  # on the spool of an OutputBuffer
+        self._rpos = 0  # the index of the next value of the reader
+
+    def read(self):
+        "Return the list of the values not read yet"
+        buf = self.task.outlist  # polling the process of an MPTask
+        if not isinstance(buf, OutputBuffer):
+            values = list(buf[self.pos:])
+            self.pos += len(values)
+            return values
+        with buf._lock:
+            buf._flush_spool()
+            total, first = buf.total, buf.ndiscarded
+            spooled = first + buf.nspooled  # index after the spooled values
+            tail = list(itertools.islice(
+                buf.ring, max(self.pos - spooled, 0), None))
+            if self.pos < spooled and self._file is not buf._file:
+                self._reader, self._file = buf._spool_reader(), buf._file
+                self._rpos = first
+        if self.pos < first:  # discarded before being read
+            self.skipped += first - self.pos
+            self.pos = first
+        values = []
+        try:
+            while self.pos < spooled:
+                value = pickle.load(self._reader)
+                self._rpos += 1
+                if self._rpos > self.pos:  # not read from the ring already
+                    values.append(value)
+                    self.pos += 1
+        except (ValueError, EOFError):  # the spool was closed meanwhile
+            self.skipped += spooled - self.pos
+        values.extend(tail)
+        self.pos = total
+        return values
+
+
+def _joined(outlist):
+    # the .str of a finished task; None means built on demand
+    if isinstance(outlist, OutputBuffer):
+        return None
+    return '\n'.join(map(decode, outlist))
+
 
 # base class not instantiated directly
 class BaseTask(object):
@@ -376,6 +733,9 @@ class BaseTask(object):
     """
     STATES = ('SUBMITTED', 'RUNNING', 'TOBEKILLED',  'KILLED', 'FINISHED',
               'ABORTED')
+    cmd = None  # the name of the command, set by the interpreter
+    submitted = None  # the submission time, set by the TaskManager
+    finished = None  # the time when the task ended, if known
 
     def __init__(self, no, arglist, genobj):
         self.no = no
@@ -384,6 +744,22 @@ class BaseTask(object):
         self.str, self.etype, self.exc, self.tb = '', None, None, None
         self.status = 'SUBMITTED'
         self.outlist = []
+        self.wall, self.cpu = None, None  # set when the task ends
+
+    @property
+    def str(self):
+        "The output as a string, joined on demand for an OutputBuffer"
+        if self._str is None:
+            return self.outlist.text()
+        return self._str
+
+    @str.setter
+    def str(self, value):
+        self._str = value
+
+    def _set_outlist(self, outlist):
+        "Replace the default .outlist with an OutputBuffer"
+        self.outlist = outlist
 
     def notify(self, msg):
         "Notifies the underlying monitor. To be implemented"
@@ -395,6 +771,7 @@ class BaseTask(object):
         stringify_tb must be True if the traceback must be sent to a process.
         """
         self.status = 'RUNNING'
+        t0, c0 = time.time(), thread_time()
         try:
             for value in genobj:
                 if self.status == 'TOBEKILLED':  # exit from the loop
@@ -415,11 +792,14 @@ class BaseTask(object):
             self.status = 'ABORTED'
         else:
             self._regular_exit()
+        finally:
+            self.finished = time.time()
+            self.wall, self.cpu = self.finished - t0, thread_time() - c0
 
     def _regular_exit(self):
         self.status = 'FINISHED'
         try:
-            self.str = '\n'.join(map(decode, self.outlist))
+            self.str = _joined(self.outlist)
         except IndexError:
             self.str = 'no result'
 
@@ -483,81 +863,328 @@ class SynTask(BaseTask):
 
 class ThreadedTask(BaseTask):
     """
-    A task running in a separated thread.
+    A task running in a separated thread, or in a thread of the given
+    ThreadPool, where it stays SUBMITTED until a thread is available.
     """
-    def __init__(self, no, arglist, genobj):
+    def __init__(self, no, arglist, genobj, pool=None, cmd=None):
         BaseTask.__init__(self, no, arglist, genobj)
-        self.thread = threading.Thread(target=super(ThreadedTask, self).run)
+        self.pool = pool
+        self.cmd = cmd
+        if pool is None:
+            self.thread = threading.Thread(
+                target=super(ThreadedTask, self).run)
+        else:
+            self.done = threading.Event()
 
     def run(self):
         "Run the task into a thread"
-        self.thread.start()
+        if self.pool is None:
+            self.thread.start()
+        else:
+            self.pool.submit(self)
+
+    def _run_in_pool(self):
+        try:
+            if self.status == 'TOBEKILLED':  # killed before starting
+                self.status = 'KILLED'
+            else:
+                BaseTask.run(self)
+        finally:
+            self.done.set()
 
     def wait(self):
         "Block until the thread ends"
-        self.thread.join()
+        if self.pool is None:
+            self.thread.join()
+        else:
+            self.done.wait()
+
+    def kill(self):
+        "Remove the task from the queue of the pool or set TOBEKILLED"
+        if self.pool is not None and self.pool.cancel(self):
+            self.status = 'KILLED'
+            self.done.set()
+        else:
+            BaseTask.kill(self)
+
+
+class ThreadPool(object):
+    """
+    A pool of daemon threads running ThreadedTasks, created when needed up
+    to size (unbounded if None); limits is a dictionary command name ->
+    maximum number of tasks of that command running at the same time.
+    The tasks exceeding the limits are queued in submission order.
+    """
+    def __init__(self, size=None, limits=None):
+        self.size = size
+        self.limits = limits or {}
+        self.queue = collections.deque()  # tasks waiting for a thread
+        self.queued = collections.defaultdict(int)  # cmd -> queued tasks
+        self.running = collections.defaultdict(int)  # cmd -> running tasks
+        self.nthreads = 0
+        self.idle = 0
+        self.stopped = False
+        self.cond = threading.Condition()
+
+    def _startable(self):
+        # the number of queued tasks which are not held back by the limits
+        n = 0
+        for cmd, queued in self.queued.items():
+            limit = self.limits.get(cmd)
+            n += queued if limit is None else min(
+                queued, max(limit - self.running[cmd], 0))
+        return n
+
+    def _dequeue(self, task):
+        self.queue.remove(task)
+        self.queued[task.cmd] -= 1
+
+    def submit(self, task):
+        "Queue the task, spawning a new thread if needed"
+        with self.cond:
+            self.queue.append(task)
+            self.queued[task.cmd] += 1
+            if self._startable() > self.idle and (
+                    self.size is None or self.nthreads < self.size):
+                self.nthreads += 1
+                self.idle += 1
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+            self.cond.notify()
+
+    def _next(self):
+        # the first queued task whose command is under its limit
+        for task in self.queue:
+            limit = self.limits.get(task.cmd)
+            if limit is None or self.running[task.cmd] < limit:
+                self._dequeue(task)
+                return task
+
+    def _work(self):
+        with self.cond:
+            while not self.stopped:
+                task = self._next()
+                if task is None:
+                    self.cond.wait()
+                    continue
+                self.idle -= 1
+                self.running[task.cmd] += 1
+                self.cond.release()
+                try:
+                    task._run_in_pool()
+                finally:
+                    self.cond.acquire()
+                    self.idle += 1
+                    self.running[task.cmd] -= 1
+                    self.cond.notify_all()
+            self.nthreads -= 1
+            self.idle -= 1
+
+    def cancel(self, task):
+        "Remove a queued task, returning True if it was in the queue"
+        with self.cond:
+            if task in self.queue:
+                self._dequeue(task)
+                return True
+            return False
+
+    def summary(self):
+        "A line with the utilization of the pool and the queue depth"
+        with self.cond:
+            busy = self.nthreads - self.idle
+            line = 'thread pool: %d/%s threads busy, %d queued' % (
+                busy, self.size or 'unbounded', len(self.queue))
+            for cmd, limit in sorted(self.limits.items()):
+                line += ', %s %d/%d' % (cmd, self.running[cmd], limit)
+        return line
+
+    def stop(self):
+        "Kill the queued tasks and let the idle threads exit"
+        with self.cond:
+            self.stopped = True
+            self.queued.clear()
+            while self.queue:
+                task = self.queue.popleft()
+                task.status = 'KILLED'
+                task.done.set()
+            self.cond.notify_all()
 
 
 # ######################## multiprocessing tasks ######################### #
 
-def sharedattr(name, on_error):
-    "Return a property to be attached to an MPTask"
+def mirrorattr(name):
+    """
+    Return a property to be attached to an MPTask, reading the state
+    mirrored from the external process
+    """
     def get(self):
-        try:
-            return getattr(self.ns, name)
-        except:  # the process was killed or died hard
-            return on_error
+        self._poll()
+        return self._state[name]
 
     def set(self, value):
-        try:
-            setattr(self.ns, name, value)
-        except:  # the process was killed or died hard
-            pass
+        self._state[name] = value
     return property(get, set)
 
 
+class PipeChannel(object):
+    """
+    The child side of the channel of an MPTask: the yielded values are sent
+    to the parent in batches, when there are batchsize of them or when
+    more than interval seconds passed since the last batch. At the end the
+    state of the task is sent.
+    """
+    def __init__(self, conn, batchsize, interval):
+        self.conn = conn
+        self.batchsize = batchsize
+        self.interval = interval
+        self._batch = []
+        self._last = time.time()
+
+    def append(self, value):
+        "Called by BaseTask._wrap in the child"
+        self._batch.append(value)
+        if (len(self._batch) >= self.batchsize or
+                time.time() - self._last >= self.interval):
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            self.conn.send(('out', self._batch))
+            self._batch = []
+        self._last = time.time()
+
+    def end(self, state):
+        "Send the pending values and the final state of the task"
+        self.flush()
+        try:
+            self.conn.send(('end', state))
+        except Exception:  # the exception is not pickleable
+            state['exc'] = str(state['exc'])
+            self.conn.send(('end', state))
+
+
 class MPTask(BaseTask):
     """
     A task running as an external process. The current implementation
     only works on Unix-like systems, where multiprocessing use forks.
+    The output and the final state are sent by the process through a
+    pipe and mirrored in the parent.
     """
-    str = sharedattr('str', '')
-    etype = sharedattr('etype', None)
-    exc = sharedattr('exc', None)
-    tb = sharedattr('tb', None)
-    status = sharedattr('status', 'ABORTED')
+    batchsize = 1000  # maximum number of values per message
+    batchinterval = 0.1  # maximum delay of a value, in seconds
+
+    etype = mirrorattr('etype')
+    exc = mirrorattr('exc')
+    tb = mirrorattr('tb')
+    status = mirrorattr('status')
+    wall = mirrorattr('wall')
+    cpu = mirrorattr('cpu')
+    finished = mirrorattr('finished')
 
     @property
     def outlist(self):
-        try:
-            return self._outlist
-        except:  # the process died hard
-            return []
+        self._poll()
+        return self._outlist
+
+    @property
+    def str(self):
+        self._poll()
+        if self._state['str'] is None:
+            return self._outlist.text()
+        return self._state['str']
+
+    @str.setter
+    def str(self, value):
+        self._state['str'] = value
+
+    def _set_outlist(self, outlist):
+        self._outlist = outlist
 
     def notify(self, msg):
         self.man.notify_listener(self.no, msg)
 
     def __init__(self, no, arglist, genobj, manager):
         """
-        The monitor has a .send method and a .man multiprocessing.Manager
+        The manager has .notify_listener and .add_listener methods
         """
         self.no = no
         self.arglist = arglist
         self._genobj = self._wrap(genobj, stringify_tb=True)
         self.man = manager
-        self._outlist = manager.mp.list()
-        self.ns = manager.mp.Namespace()
-        self.status = 'SUBMITTED'
-        self.etype, self.exc, self.tb = None, None, None
+        self._outlist = []
+        self._state = dict(status='SUBMITTED', str='', etype=None, exc=None,
+                           tb=None, wall=None, cpu=None, finished=None)
+        self._lock = threading.Lock()  # _poll is called by many threads
+        self._channel = None  # set in the child
+        self._conn, self._child_conn = multiprocessing.Pipe(duplex=False)
         self.str = repr(self)
-        self.proc = multiprocessing.Process(target=super(MPTask, self).run)
+        self.proc = multiprocessing.Process(
+            target=self._run_child, args=(self._child_conn,))
+
+    def _run_child(self, conn):
+        "Run the task in the external process"
+        self._lock = threading.Lock()  # it could be held by another thread
+        self._conn.close()
+        self._conn = None
+        self._channel = self._outlist = PipeChannel(
+            conn, self.batchsize, self.batchinterval)
+        try:
+            BaseTask.run(self)
+        finally:
+            try:
+                self._channel.end(self._state)
+            finally:
+                conn.close()
+
+    def _regular_exit(self):
+        if self._channel is None:  # running in the parent
+            BaseTask._regular_exit(self)
+        else:  # the parent will build the .str
+            self.status = 'FINISHED'
+
+    def _poll(self, block=False):
+        "Read the messages sent by the external process, if any"
+        while True:
+            with self._lock:
+                conn = self._conn
+                if conn is None:  # in the child or already finished
+                    return
+                try:
+                    while conn.poll():
+                        kind, data = conn.recv()
+                        if kind == 'out':
+                            self._outlist.extend(data)
+                        else:  # 'end'
+                            self._end(data)
+                            return
+                except (EOFError, OSError):  # the process died hard
+                    self._end(dict(status='ABORTED'))
+                    return
+            if not block:
+                return
+            try:  # wait for a message without the lock
+                conn.poll(None)
+            except (EOFError, OSError):  # read on the next iteration
+                pass
+
+    def _end(self, state):
+        "Store the final state sent by the process and close the pipe"
+        self._conn = None
+        self._state.update(state)
+        if self._state['status'] == 'FINISHED':
+            self._state['str'] = _joined(self._outlist)
+        self._child_conn.close()
 
     def run(self):
         "Run the task into an external process"
         self.proc.start()
+        self._child_conn.close()  # used only by the child
+        self.status = 'RUNNING'
 
     def wait(self):
         "Block until the external process ends or is killed"
+        self._poll(block=True)
         self.proc.join()
 
     def kill(self):
@@ -565,6 +1192,444 @@ class MPTask(BaseTask):
         exception in the children"""
         self.proc.terminate()
 
+# ######################## worker pool ################################# #
+
+class _WorkerState(object):
+    "The state of a worker process, managing the SIGTERM signal"
+    def __init__(self, killno):
+        self.killno = killno  # the number of the task to kill
+        self.task = None
+        self.interruptible = False
+
+    def on_sigterm(self, signum, frame):
+        "Kill the current task, if it is the one to kill"
+        task = self.task
+        if task is None or self.killno.value != task.no:
+            return  # the task already ended
+        if self.interruptible:
+            raise TerminatedProcess
+        task.status = 'TOBEKILLED'  # killed at the next iteration
+
+    def interruptible_call(self, func, *args, **kw):
+        "Call func with the SIGTERM signal raising a TerminatedProcess"
+        self.interruptible = True
+        try:
+            return func(*args, **kw)
+        finally:
+            self.interruptible = False
+
+    def iterate(self, genobj):
+        "Iterate on genobj with the SIGTERM raising a TerminatedProcess"
+        it = iter(genobj)
+        while True:
+            try:
+                value = self.interruptible_call(next, it)
+            except StopIteration:
+                return
+            yield value
+
+
+class _WorkerTask(BaseTask):
+    "The side of a PoolTask running in the worker process"
+    def __init__(self, no, arglist, genobj, channel, manager):
+        self.no = no
+        self.arglist = arglist
+        self.man = manager
+        self.outlist = channel
+        self.str, self.etype, self.exc, self.tb = '', None, None, None
+        self.wall, self.cpu = None, None
+        self.status = 'SUBMITTED'
+        self._genobj = self._wrap(genobj, stringify_tb=True)
+
+    def notify(self, msg):
+        self.man.notify_listener(self.no, msg)
+
+    def _regular_exit(self):  # the parent will build the .str
+        self.status = 'FINISHED'
+
+
+def _worker_main(obj, manager, conn, killno, batchsize, interval):
+    "The loop of a worker process, running tasks until receiving None"
+    state = _WorkerState(killno)
+    signal.signal(signal.SIGTERM, state.on_sigterm)
+    channel = PipeChannel(conn, batchsize, interval)
+    prefixlen = len(getattr(obj, 'cmdprefix', ''))
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:  # the parent died
+            break
+        if msg is None:  # regular stop
+            break
+        no, arglist, cmd, args, kw = msg
+        task = state.task = _WorkerTask(no, arglist, (), channel, manager)
+        try:
+            result = state.interruptible_call(
+                getattr(obj, cmd[prefixlen:]), *args, **kw)
+        except BaseException:
+            result = gen_exc(*sys.exc_info())
+        else:
+            if plac_core._isasync(result):
+                import plac_async
+                result = plac_async._iter_async(result)
+            if not plac_core.iterable(result):
+                result = gen_val(result)
+        task._genobj = task._wrap(state.iterate(result), stringify_tb=True)
+        BaseTask.run(task)
+        state.task = None
+        channel.end(dict(status=task.status, etype=task.etype, exc=task.exc,
+                         tb=task.tb, wall=task.wall, cpu=task.cpu,
+                         finished=task.finished))
+    conn.close()
+
+
+class Worker(object):
+    "A long-lived process of a WorkerPool, running a task at the time"
+    def __init__(self, pool):
+        self.pool = pool
+        self.task = None
+        self.ntasks = 0
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.killno = multiprocessing.RawValue('i', 0)
+        self.proc = multiprocessing.Process(
+            target=_worker_main, args=(
+                pool.obj, pool.man, child_conn, self.killno,
+                MPTask.batchsize, MPTask.batchinterval))
+        self.proc.daemon = True
+        self.proc.start()
+        child_conn.close()
+
+    def start(self, task):
+        "Send the task to the worker process"
+        self.conn.send((task.no, task.arglist, task.cmd, task.args,
+                        task.kw))
+        self.task = task
+        task.worker = self
+        task.status = 'RUNNING'
+
+    def receive(self):
+        "Read the available messages about the current task"
+        task = self.task
+        try:
+            while self.conn.poll():
+                kind, data = self.conn.recv()
+                if kind == 'out':
+                    task._outlist.extend(data)
+                else:  # 'end'
+                    self.task = None
+                    self.ntasks += 1
+                    task._end(data)
+                    if self.ntasks == self.pool.maxtasksperchild:
+                        self.pool.retire(self)
+                    return
+        except (EOFError, OSError):  # the worker process died
+            self.proc.join()
+            self.task = None
+            task._end(dict(status='ABORTED', etype=RuntimeError,
+                           tb='The worker process died with exit code %s' %
+                           self.proc.exitcode))
+            self.pool.retire(self)
+
+    def kill(self, task):
+        "Kill the task, if it is still running in this worker"
+        if self.task is task:
+            self.killno.value = task.no
+            self.proc.terminate()  # send a SIGTERM
+
+    def stop(self):
+        "Stop the worker process after the current task"
+        try:
+            self.conn.send(None)
+        except (EOFError, OSError):  # already dead
+            pass
+        self.proc.join(1)
+        if self.proc.is_alive():
+            self.proc.terminate()
+            self.proc.join()
+        self.conn.close()
+
+
+def _wait_conns(conns, timeout=None):
+    "multiprocessing.connection.wait, by polling on Python 2"
+    if hasattr(multiprocessing.connection, 'wait'):
+        return multiprocessing.connection.wait(conns, timeout)
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        ready = [conn for conn in conns if conn.poll()]
+        if ready or deadline is not None and time.time() >= deadline:
+            return ready
+        time.sleep(.001)
+
+
+class WorkerPool(object):
+    """
+    A pool of long-lived worker processes running the mpcommands of obj,
+    created when needed up to size and recycled after maxtasksperchild
+    tasks (never if None). The workers are forked when they are created,
+    so they see the state of obj at that moment. The tasks exceeding the
+    pool size are queued.
+    """
+    def __init__(self, obj, size, maxtasksperchild=None, manager=None):
+        self.obj = obj
+        self.size = size
+        self.maxtasksperchild = maxtasksperchild
+        self.man = manager
+        self.workers = []
+        self.queue = collections.deque()  # tasks waiting for a worker
+        self.lock = threading.RLock()  # the tasks are polled by many threads
+
+    def submit(self, task):
+        "Queue the task and dispatch it if there is an idle worker"
+        with self.lock:
+            self.queue.append(task)
+            self._dispatch()
+
+    def _dispatch(self):
+        while self.queue:
+            worker = self._idle_worker()
+            if worker is None:
+                return
+            task = self.queue.popleft()
+            try:
+                worker.start(task)
+            except Exception:  # the arguments are not pickleable
+                etype, exc, tb = sys.exc_info()
+                task._end(dict(status='ABORTED', etype=etype, exc=exc,
+                               tb=''.join(traceback.format_tb(tb))))
+
+    def _idle_worker(self):
+        for worker in self.workers:
+            if worker.task is None:
+                return worker
+        if len(self.workers) < self.size:
+            worker = Worker(self)
+            self.workers.append(worker)
+            return worker
+
+    def pump(self, block=False):
+        """
+        Read the messages of the workers and dispatch the queued tasks;
+        if block is true, wait for at least a message
+        """
+        if block:  # without the lock, so that the other threads can poll
+            with self.lock:
+                conns = [w.conn for w in self.workers if w.task is not None]
+            try:
+                _wait_conns(conns)
+            except (IOError, OSError, ValueError):  # a worker was retired
+                pass
+        with self.lock:
+            busy = dict((w.conn, w) for w in self.workers
+                        if w.task is not None)
+            if busy:
+                for conn in _wait_conns(list(busy), 0):
+                    busy[conn].receive()
+            self._dispatch()
+
+    def kill(self, task):
+        "Kill a running task or remove a queued task"
+        with self.lock:
+            if task in self.queue:
+                self.queue.remove(task)
+                task._end(dict(status='KILLED'))
+            elif task.worker is not None:
+                task.worker.kill(task)
+
+    def retire(self, worker):
+        "Remove a worker from the pool"
+        self.workers.remove(worker)
+        if worker.proc.is_alive():
+            worker.stop()
+
+    def summary(self):
+        "A line with the utilization of the pool and the queue depth"
+        busy = sum(1 for w in self.workers if w.task is not None)
+        return 'process pool: %d/%d workers busy, %d queued' % (
+            busy, self.size, len(self.queue))
+
+    def stop(self):
+        "Stop all the workers and kill the queued tasks"
+        while self.queue:
+            self.queue.popleft()._end(dict(status='KILLED'))
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+
+
+class PoolTask(MPTask):
+    """
+    A task running in a worker process of a WorkerPool: the command is
+    called in the worker, so only its name and arguments are sent.
+    """
+    def __init__(self, no, arglist, cmd, args, kw, pool):
+        self.no = no
+        self.arglist = arglist
+        self.cmd, self.args, self.kw = cmd, args, kw
+        self.pool = pool
+        self.worker = None
+        self._ended = False
+        self._outlist = []
+        self._state = dict(status='SUBMITTED', str='', etype=None, exc=None,
+                           tb=None, wall=None, cpu=None, finished=None)
+        self._genobj = self._blocking()  # used by Interpreter.send
+        self.str = repr(self)
+
+    def _blocking(self):
+        "Run the task and wait for it"
+        self.run()
+        self.wait()
+        yield
+
+    def _poll(self, block=False):
+        if not self._ended:
+            self.pool.pump()
+
+    def _end(self, state):
+        self._ended = True
+        self._state.update(state)
+        if self._state['status'] == 'FINISHED':
+            self._state['str'] = _joined(self._outlist)
+
+    def run(self):
+        "Submit the task to the pool"
+        self.pool.submit(self)
+
+    def wait(self):
+        "Block until the task ends or is killed"
+        while not self._ended:
+            self.pool.pump(block=True)
+
+    def kill(self):
+        "Kill the task, without affecting the other tasks of the worker"
+        self.pool.kill(self)
+
+
+# ########################### statistics ############################### #
+
+class Histogram(object):
+    """
+    A compact streaming histogram of positive values (times in seconds),
+    with logarithmic buckets of relative width 2**(1/resolution) - 1 (9%
+    by default) and exact count, total, min and max.
+    """
+    def __init__(self, resolution=8):
+        self.resolution = resolution
+        self.buckets = {}  # {bucket index: count}
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        "Add a value to the histogram"
+        if value <= 0:
+            idx = None  # a special bucket for zeros
+        else:
+            idx = int(math.floor(math.log(value, 2) * self.resolution))
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def _upper(self, idx):
+        "Upper bound of a bucket"
+        if idx is None:
+            return 0.
+        return 2 ** ((idx + 1.) / self.resolution)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, p):
+        """
+        Return an upper bound to the p-th percentile, with the relative
+        error of the buckets, or None if the histogram is empty
+        """
+        if not self.count:
+            return None
+        rank = self.count * p / 100.
+        seen = 0
+        for idx in sorted(self.buckets, key=lambda i: -1E9 if i is None
+                          else i):
+            seen += self.buckets[idx]
+            if seen >= rank:
+                return min(self._upper(idx), self.max)
+        return self.max
+
+    def items(self):
+        "Yield pairs (upper bound, count) in increasing order"
+        for idx in sorted(self.buckets, key=lambda i: -1E9 if i is None
+                          else i):
+            yield min(self._upper(idx), self.max), self.buckets[idx]
+
+
+class CommandStats(object):
+    """
+    Statistics about the tasks of a command: histograms of the parse time,
+    wall time, CPU time (not available for asynchronous tasks) and number
+    of yielded items, plus a count of the tasks per final status.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.parse = Histogram()
+        self.wall = Histogram()
+        self.cpu = Histogram()
+        self.items = Histogram()
+        self.outcomes = dict((s, 0) for s in ('FINISHED', 'ABORTED',
+                                              'KILLED'))
+
+    def add(self, task, parse_time, call_wall=0, call_cpu=0):
+        "Add the data of a finished task"
+        self.parse.add(parse_time)
+        if task.wall is not None:
+            self.wall.add(call_wall + task.wall)
+        if task.cpu is not None:
+            self.cpu.add(call_cpu + task.cpu)
+        outlist = task.outlist  # an OutputBuffer counts the discarded too
+        self.items.add(outlist.total if isinstance(outlist, OutputBuffer)
+                       else len(outlist))
+        self.outcomes[task.status] = self.outcomes.get(task.status, 0) + 1
+
+    @property
+    def count(self):
+        return self.parse.count
+
+
+def _ms(seconds):
+    "Format a time in milliseconds"
+    return '-' if seconds is None else '%.2f' % (seconds * 1000)
+
+
+def _outsize(task):
+    "The size in bytes (UTF-8 encoded) of the output kept in memory"
+    outlist = task.outlist
+    values = outlist.ring if isinstance(outlist, OutputBuffer) else outlist
+    return sum(len(decode(value).encode('utf-8', 'replace'))
+               for value in values)
+
+
+class TaskSummary(object):
+    "What is left of a task evicted from the registry"
+    __slots__ = ('no', 'kind', 'line', 'status', 'wall', 'cpu')
+
+    def __init__(self, task):
+        self.no = task.no
+        self.kind = task.__class__.__name__
+        self.line = ' '.join(task.arglist)
+        self.status = task.status
+        self.wall = task.wall
+        self.cpu = task.cpu
+
+    def __repr__(self):
+        return '<%s %d [%s] %s, evicted, wall %s ms, cpu %s ms>' % (
+            self.kind, self.no, self.line, self.status, _ms(self.wall),
+            _ms(self.cpu))
+
+
 # ######################## Task Manager ###################### #
 
 
@@ -574,19 +1639,126 @@ class TaskManager(object):
     manage the submitted tasks.
     """
     cmdprefix = '.'
-    specialcommands = set(['.last_tb'])
+    specialcommands = set(['.last_tb', '.stats'])
+    maxpending = 256  # harvest the statistics beyond this many tasks
+    maxevicted = 10000  # number of summaries of evicted tasks to keep
 
     def __init__(self, obj):
         self.obj = obj
-        self.registry = {}  # {taskno : task}
-        if obj.mpcommands or obj.thcommands:
+        self.registry = collections.OrderedDict()  # {taskno: task}
+        # {status: {taskno: task}} in order of status change
+        self.bystatus = dict((status, collections.OrderedDict())
+                             for status in BaseTask.STATES)
+        self._live = collections.OrderedDict()  # {taskno: indexed status}
+        if obj.mpcommands or obj.thcommands or obj.asyncommands:
             self.specialcommands.update(['.kill', '.list', '.output'])
+        self.specialindex = plac_core.CommandIndex(self.specialcommands)
         interact = getattr(obj, '_interact_', False)
+        if obj in plac_core.parser_registry and getattr(
+                plac_core.parser_registry[obj], 'taskmanager', None):
+            # the parser has the special commands of another interpreter
+            del plac_core.parser_registry[obj]
         self.parser = plac_core.parser_from(
             obj, prog='' if interact else None, formatter_class=PlacFormatter)
+        self.parser.taskmanager = weakref.ref(self)
         HelpSummary.add(obj, self.specialcommands)
         self.man = Manager() if obj.mpcommands else None
-        signal.signal(signal.SIGTERM, terminatedProcess)
+        pool_size = getattr(obj, 'mp_pool_size', None)
+        self.mppool = WorkerPool(
+            obj, pool_size, getattr(obj, 'mp_maxtasksperchild', None),
+            self.man) if obj.mpcommands and pool_size else None
+        th_pool_size = getattr(obj, 'th_pool_size', None)
+        th_limits = getattr(obj, 'th_limits', None)
+        self.thpool = ThreadPool(th_pool_size, th_limits) if (
+            obj.thcommands and (th_pool_size or th_limits)) else None
+        self.out_maxlen = getattr(obj, 'out_maxlen', None)
+        self.out_overflow = getattr(obj, 'out_overflow', 'spill')
+        self.keep_tasks = getattr(obj, 'keep_tasks', None)
+        self.keep_age = getattr(obj, 'keep_age', None)
+        self.keep_bytes = getattr(obj, 'keep_bytes', None)
+        self.retention = (self.keep_tasks is not None or
+                          self.keep_age is not None or
+                          self.keep_bytes is not None)
+        self._finished = collections.OrderedDict()  # {taskno: (time, size)}
+        self._finished_bytes = 0
+        self.evicted = collections.OrderedDict()  # {taskno: TaskSummary}
+        self._eventloop = None
+        self.cmdstats = {}  # {command name: CommandStats}
+        self._pending = []  # tasks not yet recorded in cmdstats
+        try:
+            signal.signal(signal.SIGTERM, terminatedProcess)
+        except ValueError:  # not in the main thread, as in a server
+            pass
+
+    def outbuffer(self):
+        "A new OutputBuffer for a task, or None if the output is unbounded"
+        if self.out_maxlen:
+            return OutputBuffer(self.out_maxlen, self.out_overflow)
+
+    def register(self, task):
+        "Add a task to the registry, evicting old tasks if needed"
+        task.submitted = time.time()
+        self.registry[task.no] = task
+        self._live[task.no] = None  # indexed at the next refresh
+        if self.retention:
+            self.evict()
+
+    def refresh(self):
+        """
+        Move the tasks which changed status since the last call into the
+        right status index; only the tasks not yet terminated are checked
+        """
+        now = time.time()
+        for no, indexed in list(self._live.items()):
+            task = self.registry[no]
+            status = task.status
+            if status == indexed:
+                continue
+            if indexed is not None:
+                del self.bystatus[indexed][no]
+            self.bystatus[status][no] = task
+            if status in ('FINISHED', 'ABORTED', 'KILLED'):
+                del self._live[no]
+                if self.retention:
+                    size = _outsize(task)
+                    self._finished[no] = (task.finished or now, size)
+                    self._finished_bytes += size
+            else:
+                self._live[no] = status
+
+    def evict(self):
+        """
+        Remove from the registry the finished tasks exceeding keep_tasks,
+        older than keep_age seconds or whose output exceeds keep_bytes
+        bytes (UTF-8 encoded) in total, oldest first, keeping a TaskSummary
+        of them
+        """
+        now = time.time()
+        self.refresh()
+        while self._finished:
+            no, (end, size) = next(iter(self._finished.items()))
+            if not (self.keep_tasks is not None and
+                    len(self._finished) > self.keep_tasks or
+                    self.keep_age is not None and
+                    now - end > self.keep_age or
+                    self.keep_bytes is not None and
+                    self._finished_bytes > self.keep_bytes):
+                break
+            del self._finished[no]
+            self._finished_bytes -= size
+            task = self.registry.pop(no)
+            del self.bystatus[task.status][no]
+            if isinstance(task.outlist, OutputBuffer):
+                task.outlist.close()
+            self.evicted[no] = TaskSummary(task)
+            if len(self.evicted) > self.maxevicted:
+                self.evicted.popitem(last=False)
+
+    def _unknown(self, taskno):
+        "The message for a task not in the registry"
+        if taskno in self.evicted:
+            return repr(self.evicted[taskno])
+        return 'Unknown task %d' % taskno
 
     def close(self):
         "Kill all the running tasks"
@@ -597,20 +1769,70 @@ class TaskManager(object):
                     task.wait()
             except:  # task killed, nothing to wait
                 pass
+        if self.mppool:
+            self.mppool.stop()
+        if self.thpool:
+            self.thpool.stop()
         if self.man:
             self.man.stop()
+        if self._eventloop:
+            self._eventloop.stop()
+            self._eventloop = None
+        for task in self.registry.values():  # remove the spool files
+            if isinstance(task.outlist, OutputBuffer):
+                task.outlist.close()
+        registry = plac_core.parser_registry
+        registry.discard(self)  # the parsers of the special commands
+        if self.obj in registry and registry[self.obj] is self.parser:
+            registry.discard(self.obj)  # the parsers refer to self.obj
+
+    @property
+    def eventloop(self):
+        "The EventLoopThread of the asynchronous tasks, started when needed"
+        if self._eventloop is None:
+            import plac_async
+            self._eventloop = plac_async.EventLoopThread()
+        return self._eventloop
 
     def _get_latest(self, taskno=-1, status=None):
         "Get the latest submitted task from the registry"
         assert taskno < 0, 'You must pass a negative number'
+        n = abs(taskno)
         if status:
-            tasks = [t for t in self.registry.values()
-                     if t.status == status]
+            self.refresh()
+            nos = heapq.nlargest(n, self.bystatus[status])
         else:
-            tasks = [t for t in self.registry.values()]
-        tasks.sort(key=attrgetter('no'))
-        if len(tasks) >= abs(taskno):
-            return tasks[taskno]
+            nos = list(itertools.islice(reversed(self.registry), n))
+        if len(nos) == n:
+            return self.registry[nos[-1]]
+
+    def record(self, name, task, parse_time, call_wall=0, call_cpu=0):
+        """
+        Record a task in the statistics of the command, when finished;
+        the wall and CPU times spent calling the command are added to
+        the times of the task.
+        """
+        self._pending.append((name, task, parse_time, call_wall, call_cpu))
+        if len(self._pending) > self.maxpending:
+            self._harvest()
+
+    def _harvest(self):
+        "Move the finished tasks into the statistics"
+        pending = []
+        for item in self._pending:
+            name, task = item[:2]
+            if task.status in ('FINISHED', 'ABORTED', 'KILLED'):
+                if name not in self.cmdstats:
+                    self.cmdstats[name] = CommandStats(name)
+                self.cmdstats[name].add(*item[1:])
+            else:  # still running
+                pending.append(item)
+        self._pending = pending
+
+    def get_stats(self):
+        "Return a dictionary {command name: CommandStats}"
+        self._harvest()
+        return self.cmdstats
 
     # ########################## special commands ######################## #
 
@@ -624,7 +1846,7 @@ class TaskManager(object):
                 yield 'Nothing to kill'
                 return
         elif taskno not in self.registry:
-            yield 'Unknown task %d' % taskno
+            yield self._unknown(taskno)
             return
         else:
             task = self.registry[taskno]
@@ -635,11 +1857,30 @@ class TaskManager(object):
         yield task
 
     @plac_core.annotations(
-        status=('', 'positional', None, str, BaseTask.STATES))
-    def list(self, status='RUNNING'):
+        status=('', 'positional', None, str, BaseTask.STATES),
+        cmd=('only the tasks of this command', 'option', 'c'),
+        age=('only the tasks submitted in the last seconds', 'option', 'a',
+             float),
+        page=('page number', 'option', 'p', int),
+        size=('tasks per page', 'option', 's', int))
+    def list(self, status='RUNNING', cmd=None, age=None, page=1, size=100):
         'list tasks with a given status'
-        for task in self.registry.values():
-            if task.status == status:
+        for pool in (self.thpool, self.mppool):
+            if pool:
+                yield pool.summary()
+        self.refresh()
+        tasks = self.bystatus[status].values()
+        if cmd is not None:
+            tasks = (task for task in tasks if task.cmd == cmd)
+        if age is not None:
+            since = time.time() - age
+            tasks = (task for task in tasks if task.submitted >= since)
+        start = (page - 1) * size
+        for i, task in enumerate(itertools.islice(
+                tasks, start, start + size + 1)):
+            if i == size:
+                yield '... more tasks in page %d' % (page + 1)
+            else:
                 yield task
 
     @plac_core.annotations(
@@ -652,21 +1893,57 @@ class TaskManager(object):
                 yield 'Nothing to show'
                 return
         elif taskno not in self.registry:
-            yield 'Unknown task %d' % taskno
+            yield self._unknown(taskno)
             return
         else:
             task = self.registry[taskno]
-        outstr = '\n'.join(map(str, task.outlist))
         if fname:
-            open(fname, 'w').write(outstr)
+            with open(fname, 'w') as f:
+                for i, value in enumerate(task.outlist):
+                    f.write('\n%s' % value if i else str(value))
             yield 'saved output of %d into %s' % (taskno, fname)
             return
+        outstr = '\n'.join(map(str, task.outlist))
         yield task
         if len(task.outlist) > 20 and use_less:
             less(outstr)  # has no meaning for a plac server
         else:
             yield outstr
 
+    @plac_core.annotations(
+        cmd=('show the histograms of this command', 'positional'))
+    def stats(self, cmd=None):
+        "show the timings of the commands (in ms) or the histograms of one"
+        cmdstats = self.get_stats()
+        if cmd is None:
+            yield '%-16s %6s %6s %6s %8s %8s %8s %8s %8s' % (
+                'command', 'tasks', 'errors', 'killed', 'parse',
+                'wall p50', 'wall p99', 'wall max', 'cpu p50')
+            for name in sorted(cmdstats):
+                st = cmdstats[name]
+                yield '%-16s %6d %6d %6d %8s %8s %8s %8s %8s' % (
+                    name, st.count, st.outcomes['ABORTED'],
+                    st.outcomes['KILLED'], _ms(st.parse.percentile(50)),
+                    _ms(st.wall.percentile(50)), _ms(st.wall.percentile(99)),
+                    _ms(st.wall.max), _ms(st.cpu.percentile(50)))
+            return
+        if cmd not in cmdstats:
+            yield 'No statistics for %s' % cmd
+            return
+        st = cmdstats[cmd]
+        yield '%s: %d tasks, %s, %.1f items per task' % (
+            cmd, st.count, ', '.join('%d %s' % (n, s) for s, n in
+                                     sorted(st.outcomes.items()) if n),
+            st.items.mean)
+        for title, hist in (('wall time', st.wall), ('cpu time', st.cpu)):
+            if not hist.count:
+                continue
+            yield '%s (ms)' % title
+            top = max(n for _, n in hist.items())
+            for upper, n in hist.items():
+                yield '%10s %6d %s' % ('<=' + _ms(upper), n,
+                                       '#' * max(1, 40 * n // top))
+
     @plac_core.annotations(
         taskno=('task number', 'positional', None, int))
     def last_tb(self, taskno=-1):
@@ -757,14 +2034,13 @@ class Monitor(StartStopObject):
 
 class Manager(StartStopObject):
     """
-    The plac Manager contains a multiprocessing.Manager and a set
-    of slave monitor processes to which we can send commands. There
-    is a manager for each interpreter with mpcommands.
+    The plac Manager contains a set of slave monitor processes to which
+    we can send commands. There is a manager for each interpreter with
+    mpcommands.
     """
     def __init__(self):
         self.registry = {}
         self.started = False
-        self.mp = None
 
     def add(self, monitor):
         'Add or replace a monitor in the registry'
@@ -778,8 +2054,6 @@ class Manager(StartStopObject):
 
     # can be called more than once
     def start(self):
-        if self.mp is None:
-            self.mp = multiprocessing.Manager()
         for monitor in self.registry.values():
             monitor.start()
         self.started = True
@@ -788,9 +2062,6 @@ class Manager(StartStopObject):
         for monitor in self.registry.values():
             monitor.queue.close()
             monitor.terminate()
-        if self.mp:
-            self.mp.shutdown()
-            self.mp = None
         self.started = False
 
     def notify_listener(self, taskno, msg):
@@ -801,90 +2072,237 @@ class Manager(StartStopObject):
         for monitor in self.registry.values():
             monitor.queue.put(('add_listener', no))
 
-# ######################### plac server ############################# #
-
-#
-# Removed in version 1.4.0 due to incompatibility with Python 3.12
-#
-'''
-import asyncore
-import asynchat
-import socket
-
-class _AsynHandler(asynchat.async_chat):
-    "asynchat handler starting a new interpreter loop for each connection"
-
-    terminator = '\r\n'  # the standard one for telnet
-    prompt = 'i> '
-
-    def __init__(self, socket, interpreter):
-        asynchat.async_chat.__init__(self, socket)
-        self.set_terminator(self.terminator)
-        self.i = interpreter
-        self.i.__enter__()
-        self.data = []
-        self.write(self.prompt)
-
-    def write(self, data, *args):
-        "Push a string back to the client"
-        if args:
-            data %= args
-        if data.endswith('\n') and not data.endswith(self.terminator):
-            data = data[:-1] + self.terminator  # fix newlines
-        self.push(data)
-
-    def collect_incoming_data(self, data):
-        "Collect one character at the time"
-        self.data.append(data)
-
-    def found_terminator(self):
-        "Put in the queue the line received from the client"
-        line = ''.join(self.data)
-        self.log('Received line %r from %s' % (line, self.addr))
-        if line == 'EOF':
-            self.i.__exit__(None, None, None)
-            self.handle_close()
-        else:
-            task = self.i.submit(line)
-            task.run()  # synchronous or not
-            if task.etype:  # manage exception
-                error = '%s: %s\nReceived: %s' % (
-                    task.etype.__name__, task.exc, ' '.join(task.arglist))
-                self.log_info(task.traceback + error)  # on the server
-                self.write(error + self.terminator)  # back to the client
-            else:  # no exception
-                self.write(task.str + self.terminator)
-            self.data = []
-            self.write(self.prompt)
-
-
-class _AsynServer(asyncore.dispatcher):
-    "asyncore-based server spawning AsynHandlers"
-
-    def __init__(self, interpreter, newhandler, port, listen=5):
-        self.interpreter = interpreter
-        self.newhandler = newhandler
+
+# ########################## plac client ################################ #
+
+class RemoteError(Exception):
+    "An error raised by a command run by a plac server"
+
+
+class RemoteTask(object):
+    """
+    A task submitted to a plac server by a Client, with the same
+    attributes of the local tasks (.no, .arglist, .outlist, .status,
+    .str, .etype, .exc, .traceback, .result), filled as the answers of
+    the server arrive. Iterating on the task yields the output values
+    as soon as they are available.
+    """
+    def __init__(self, reqid, arglist, timeout=None):
+        self.reqid = reqid
+        self.arglist = arglist
+        self.timeout = timeout
+        self.no = None  # the number of the task in the server
+        self.outlist = []
+        self.status = 'SUBMITTED'
+        self.etype, self.exc, self.tb = None, None, ''
+        self._cond = threading.Condition()
+
+    def _receive(self, msg):
+        "Called by the reader thread of the connection"
+        with self._cond:
+            if msg['event'] == 'item':
+                self.outlist.append(msg['value'])
+                self.status = 'RUNNING'
+            else:  # 'end'
+                self.no = msg.get('no')
+                if msg.get('error'):
+                    self.etype = RemoteError
+                    self.exc = RemoteError(msg['error'])
+                    self.tb = msg.get('traceback', '')
+                self.status = msg['status']
+            self._cond.notify_all()
+
+    @property
+    def done(self):
+        return self.status in ('FINISHED', 'ABORTED', 'KILLED')
+
+    def _wait_for(self, predicate, timeout):
+        # as Condition.wait_for, which does not exist in Python 2
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not predicate():
+                left = None if deadline is None else deadline - time.time()
+                if left is not None and left <= 0:
+                    raise TimeoutError('No answer from the server in %ss '
+                                       'for %s' % (timeout, self))
+                self._cond.wait(left)
+
+    def wait(self, timeout=None):
+        "Block until the task ends (at most timeout seconds)"
+        self._wait_for(lambda: self.done, timeout or self.timeout)
+
+    def __iter__(self):
+        i = 0
+        while True:
+            self._wait_for(lambda: self.done or len(self.outlist) > i,
+                           self.timeout)
+            if len(self.outlist) > i:
+                yield self.outlist[i]
+                i += 1
+            elif self.done:
+                return
+
+    @property
+    def str(self):
+        "The output as a string (or the repr if the task is not finished)"
+        if self.status == 'FINISHED':
+            return '\n'.join(map(str, self.outlist))
+        return repr(self)
+
+    @property
+    def traceback(self):
+        return self.tb
+
+    @property
+    def result(self):
+        self.wait()
+        if self.exc:
+            raise self.exc
+        return self.outlist[-1] if self.outlist else None
+
+    def __repr__(self):
+        return '<%s %s [%s] %s>' % (
+            self.__class__.__name__, self.no, ' '.join(self.arglist),
+            self.status)
+
+
+class _ClientConnection(object):
+    "A connection of a Client, with a thread reading the answers"
+    def __init__(self, client):
+        import socket
+        import json
+        self.json = json
+        self.client = client
+        self.sock = socket.create_connection(
+            (client.host, client.port), client.timeout)
+        self.sock.settimeout(None)  # the reader blocks
+        self.rfile = self.sock.makefile('rb')
+        self.lock = threading.Lock()  # for .pending and .closed
+        # the writers hold their own lock, so that a sendall blocked by a
+        # server waiting for its answers to be read does not block the
+        # reader
+        self.wlock = threading.Lock()
+        self.pending = {}  # {reqid: RemoteTask}
+        self.closed = False
+        self.reader = threading.Thread(target=self._read)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def send(self, task, line):
+        "Send a request for the task"
+        key = 'args' if isinstance(line, list) else 'line'
+        data = self.json.dumps({'id': task.reqid, key: line}) + '\n'
+        with self.lock:
+            if self.closed:
+                raise ConnectionError('The connection is closed')
+            self.pending[task.reqid] = task  # before the answers arrive
+        try:
+            with self.wlock:
+                self.sock.sendall(data.encode('utf-8'))
+        except OSError:
+            with self.lock:
+                self.pending.pop(task.reqid, None)
+            raise
+
+    def _read(self):
+        try:
+            for data in self.rfile:
+                msg = self.json.loads(data.decode('utf-8'))
+                with self.lock:
+                    task = self.pending.get(msg.get('id'))
+                    if msg['event'] == 'end':
+                        self.pending.pop(msg.get('id'), None)
+                if task is not None:
+                    task._receive(msg)
+        except (OSError, ValueError):
+            pass
+        with self.lock:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+        for task in pending.values():  # the server went away
+            task._receive(dict(event='end', status='ABORTED',
+                               error='ConnectionError: connection closed'))
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        try:
+            self.sock.shutdown(2)  # socket.SHUT_RDWR, stops the reader
+        except OSError:
+            pass
+        self.sock.close()
+        self.reader.join()
+
+
+class Client(object):
+    """
+    A client for plac servers using the JSON lines protocol, with a pool
+    of at most size connections. Each request is sent on the connection
+    with the fewest pending requests, without waiting for the previous
+    answers (pipelining). Since the server runs an interpreter per
+    connection, the commands relying on the state of the session (say
+    .output) need a Client with size=1. The timeout (in seconds) is used
+    when connecting and when waiting for the answers.
+    """
+    def __init__(self, host='localhost', port=2199, size=4, timeout=None):
+        self.host = host
         self.port = port
-        asyncore.dispatcher.__init__(self)
-        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.bind(('', port))
-        self.listen(listen)
+        self.size = size
+        self.timeout = timeout
+        self.pool = []
+        self._reqno = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        with self._lock:
+            self.pool = [c for c in self.pool if not c.closed]
+            conn = min(self.pool, key=lambda c: len(c.pending), default=None)
+            if conn is None or conn.pending and len(self.pool) < self.size:
+                conn = _ClientConnection(self)
+                self.pool.append(conn)
+            return conn
 
-    def handle_accept(self):
-        clientsock, clientaddr = self.accept()
-        self.log('Connected from %s' % str(clientaddr))
-        i = self.interpreter.__class__(self.interpreter.obj)  # new interpreter
-        self.newhandler(clientsock, i)  # spawn a new handler
+    def submit(self, line):
+        """
+        Send a line (or a list of arguments) to the server and return
+        a RemoteTask, without waiting for the answer
+        """
+        arglist = line if isinstance(line, list) else shlex.split(line)
+        task = RemoteTask(next(self._reqno), arglist, self.timeout)
+        self._connection().send(task, line)
+        return task
+
+    def send(self, line):
+        "Send a line to the server and return the finished RemoteTask"
+        task = self.submit(line)
+        task.wait()
+        return task
+
+    def close(self):
+        "Close all the connections"
+        with self._lock:
+            pool, self.pool = self.pool, []
+        for conn in pool:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, exc, tb):
+        self.close()
 
-'''
 
 # ########################## the Interpreter ############################ #
 
 class Interpreter(object):
     """
     A context manager with a .send method and a few utility methods:
-    execute, test and doctest.
+    execute, test and doctest. If .defer_calls is true, the commands
+    which are plain functions are called when their task runs and not
+    when the line is submitted.
     """
+    defer_calls = False
+
     class Exit(Exception):
         pass
 
@@ -910,18 +2328,24 @@ class Interpreter(object):
         if obj.thcommands:
             self.parser.addsubcommands(
                 obj.thcommands, obj, title='threaded commands')
+        if obj.asyncommands:
+            self.parser.addsubcommands(
+                obj.asyncommands, obj, title='asynchronous commands')
         self.parser.error = lambda msg: sys.exit(msg)  # patch the parser
         self._interpreter = None
 
     def _set_commands(self, obj):
         "Make sure obj has the right command attributes as Python sets"
-        for attrname in ('commands', 'mpcommands', 'thcommands'):
+        for attrname in ('commands', 'mpcommands', 'thcommands',
+                         'asyncommands'):
             setattr(self, attrname, set(getattr(self.__class__, attrname, [])))
             setattr(obj, attrname, set(getattr(obj, attrname, [])))
         self.commands = obj.commands
         self.mpcommands.update(obj.mpcommands)
         self.thcommands.update(obj.thcommands)
-        if (obj.commands or obj.mpcommands or obj.thcommands) and \
+        self.asyncommands.update(obj.asyncommands)
+        if (obj.commands or obj.mpcommands or obj.thcommands or
+                obj.asyncommands) and \
            not hasattr(obj, 'help'):  # add default help
             obj.help = default_help.__get__(obj, obj.__class__)
             self.commands.add('help')
@@ -951,8 +2375,8 @@ class Interpreter(object):
         if m and not m.started:
             m.start()
         task = self._interpreter.send(arglist)  # nonblocking
-        if not plac_core._match_cmd(arglist[0], self.tm.specialcommands):
-            self.tm.registry[task.no] = task
+        if not self.tm.specialindex.match(arglist[0]):
+            self.tm.register(task)
             if m:
                 m.add_listener(task.no)
         return task
@@ -968,6 +2392,10 @@ class Interpreter(object):
         "The full lists of the submitted tasks"
         return self.tm.registry.values()
 
+    def stats(self):
+        "The statistics of the commands, as a dict {name: CommandStats}"
+        return self.tm.get_stats()
+
     def close(self, exctype=None, exc=None, tb=None):
         "Can be called to close the interpreter prematurely"
         self.tm.close()
@@ -985,8 +2413,18 @@ class Interpreter(object):
         try:
             for no in itertools.count(1):
                 arglist = yield task
+                t0, t1 = time.time(), None
                 try:
-                    cmd, result = self.parser.consume(arglist)
+                    cmd, func, args, kw = self.parser.parse_call(arglist)
+                    t1, c1 = time.time(), thread_time()
+                    if self.tm.mppool and cmd in self.obj.mpcommands:
+                        # the command will be called in a worker
+                        result = PoolTask(no, arglist, cmd, args, kw,
+                                          self.tm.mppool)
+                    elif self.defer_calls and self._deferrable(cmd, func):
+                        result = gen_call(func, args, kw)
+                    else:
+                        result = func(*args, **kw)
                 except SystemExit as e:  # for invalid commands
                     if e.args == (0,):  # raised as sys.exit(0)
                         errlist = []
@@ -996,21 +2434,55 @@ class Interpreter(object):
                     continue
                 except:  # anything else
                     task = SynTask(no, arglist, gen_exc(*sys.exc_info()))
-                    continue
-                if not plac_core.iterable(result):  # atomic result
-                    task = SynTask(no, arglist, gen_val(result))
-                elif cmd in self.obj.mpcommands:
-                    task = MPTask(no, arglist, result, self.tm.man)
-                elif cmd in self.obj.thcommands:
-                    task = ThreadedTask(no, arglist, result)
-                else:  # blocking task
-                    task = SynTask(no, arglist, result)
+                    if t1 is None:  # parsing error
+                        continue
+                else:
+                    task = self._make_task(no, arglist, cmd, result)
+                    task.cmd = cmd
+                    outbuffer = self.tm.outbuffer()
+                    if outbuffer is not None:
+                        task._set_outlist(outbuffer)
+                if cmd not in self.tm.specialcommands:
+                    self.tm.record(
+                        cmd or getattr(self.obj, '__name__', 'main'), task,
+                        t1 - t0, time.time() - t1, thread_time() - c1)
         except GeneratorExit:  # regular exit
             exit(None, None, None)
         except:  # exceptional exit
             exit(*sys.exc_info())
             raise
 
+    def _make_task(self, no, arglist, cmd, result):
+        "Build the right kind of task for the result of a command"
+        if isinstance(result, PoolTask):
+            return result
+        elif plac_core._isasync(result):
+            import plac_async
+            if cmd in self.obj.asyncommands:
+                return plac_async.AsyncTask(
+                    no, arglist, result, self.tm.eventloop)
+            # run in a private event loop
+            result = plac_async._iter_async(result)
+        if not plac_core.iterable(result):  # atomic result
+            return SynTask(no, arglist, gen_val(result))
+        elif cmd in self.obj.mpcommands:
+            return MPTask(no, arglist, result, self.tm.man)
+        elif cmd in self.obj.thcommands:
+            return ThreadedTask(no, arglist, result, self.tm.thpool, cmd)
+        else:  # blocking task
+            return SynTask(no, arglist, result)
+
+    def _deferrable(self, cmd, func):
+        "True for a blocking command which is a plain function"
+        if cmd in self.tm.specialcommands or cmd in self.obj.mpcommands or (
+                cmd in self.obj.thcommands or cmd in self.obj.asyncommands):
+            return False
+        for name in ('isgeneratorfunction', 'iscoroutinefunction',
+                     'isasyncgenfunction'):  # not all in old Pythons
+            if getattr(inspect, name, lambda f: False)(func):
+                return False
+        return True
+
     def check(self, given_input, expected_output):
         "Make sure you get the expected_output from the given_input"
         output = self.send(given_input).str  # blocking
@@ -1095,9 +2567,8 @@ class Interpreter(object):
             readline_present = False
         if stdin is sys.stdin and readline_present:  # use readline
             histfile = os.path.expanduser('~/.%s.history' % self.name)
-            completions = list(self.commands) + list(self.mpcommands) + \
-                list(self.thcommands) + list(self.tm.specialcommands)
-            self.stdin = ReadlineInput(completions, histfile=histfile)
+            self.stdin = ReadlineInput(self.parser.cmdindex(),
+                                       histfile=histfile)
         else:
             self.stdin = stdin
         self.prompt = prompt
@@ -1127,16 +2598,22 @@ class Interpreter(object):
         except self.Exit:
             pass
 
-    def start_server(self, port=2199, **kw):
-        """Starts an asyncore server reading commands for clients and opening
-        a new interpreter for each connection."""
-        _AsynServer(self, _AsynHandler, port)  # register the server
-        try:
-            asyncore.loop(**kw)
-        except (KeyboardInterrupt, TerminatedProcess):
-            pass
-        finally:
-            asyncore.close_all()
+    def start_server(self, port=2199, processes=None, **kw):
+        """Starts an asyncio server reading commands for clients and opening
+        a new interpreter for each connection; the keyword arguments are
+        passed to InterpreterServer. If processes is given, starts a
+        PreforkServer with that number of processes."""
+        from plac_async import InterpreterServer, PreforkServer
+        if processes:
+            PreforkServer(self, port, processes, **kw).run()
+        else:
+            InterpreterServer(self, port, **kw).run()
+
+    def start_gateway(self, port=8080, **kw):
+        """Starts an HTTP gateway to the commands of the interpreter; the
+        keyword arguments are passed to HTTPGateway"""
+        from plac_async import HTTPGateway
+        HTTPGateway(self, port, **kw).run()
 
     def add_monitor(self, mon):
         self.man.add(mon)
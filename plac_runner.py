@@ -27,13 +27,19 @@ def run(fnames, cmd, verbose):
     interactive=('run plac tool in interactive mode', 'flag', 'i'),
     multiline=('run plac tool in multiline mode', 'flag', 'm'),
     serve=('run plac server', 'option', 's', int),
+    jsonlines=('use the JSON lines protocol for the server', 'flag', 'j'),
+    processes=('number of server processes (prefork mode)', 'option', 'n',
+               int),
+    gateway=('run the HTTP gateway on the given port', 'option', 'g', int),
     batch=('run plac batch files', 'flag', 'b'),
     test=('run plac test files', 'flag', 't'),
+    completion=('print a completion script for the given shell',
+                'option', 'c', str, ['bash', 'zsh']),
     fname='script to run (.py or .plac or .placet)',
     extra='additional arguments',
     )
-def main(verbose, interactive, multiline, serve, batch, test, fname='',
-         *extra):
+def main(verbose, interactive, multiline, serve, jsonlines, processes,
+         gateway, batch, test, completion, fname='', *extra):
     "Runner for plac tools, plac batch files and plac tests"
     baseparser = plac.parser_from(main)
     if not fname:
@@ -42,12 +48,17 @@ def main(verbose, interactive, multiline, serve, batch, test, fname='',
         plactool = plac.import_main(fname)
         plactool.prog = os.path.basename(sys.argv[0]) + ' ' + fname
         out = plac.call(plactool, sys.argv[2:], eager=False)
-        if plac.iterable(out):
-            for output in out:
-                print(output)
-        else:
-            print(out)
-    elif interactive or multiline or serve:
+        with plac.OutputWriter() as writer:  # buffered, safe with | head
+            if plac.iterable(out):
+                for output in out:
+                    writer.write('%s\n' % (output,))
+            else:
+                writer.write('%s\n' % (out,))
+    elif completion:
+        plactool = plac.import_main(fname, *extra)
+        prog = os.path.basename(fname.split(':')[0])  # strip the factory
+        sys.stdout.write(plac.completion(plactool, completion, prog=prog))
+    elif interactive or multiline or serve or gateway:
         plactool = plac.import_main(fname, *extra)
         plactool.prog = ''
         i = plac.Interpreter(plactool)
@@ -56,7 +67,10 @@ def main(verbose, interactive, multiline, serve, batch, test, fname='',
         elif multiline:
             i.multiline(verbose=verbose)
         elif serve:
-            i.start_server(serve)
+            i.start_server(serve, processes,
+                           protocol='json' if jsonlines else 'text')
+        elif gateway:
+            i.start_gateway(gateway)
     elif batch:
         run((fname,) + extra, 'execute', verbose)
     elif test:
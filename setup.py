@@ -33,7 +33,8 @@ if __name__ == '__main__':
           author_email='michele.simionato@gmail.com',
           url='https://github.com/ialbert/plac',
           license="BSD License",
-          py_modules=['plac_core', 'plac_ext', 'plac_tk', 'plac'],
+          py_modules=['plac_core', 'plac_ext', 'plac_async', 'plac_tk',
+                      'plac'],
           scripts=['plac_runner.py'],
           install_requires=require('argparse'),
           keywords="command line arguments parser",